@@ -1,7 +1,11 @@
 import os
+import re
+import collections
 import scipy.stats as st
 from utils import *
 from dataget import *
+from constellation import *
+from records import *
 import numpy as np
 import pandas as pd
 
@@ -12,17 +16,14 @@ MAX_ISL_DISTANCE = 5016591
 # Theoretical best-case speed
 LIGHT_SPEED = 299792458
 TERRESTRIAL_TRANS_SPEED = LIGHT_SPEED * 2 / 3
+# the terrestrial hops csv files of a circuit range, as `hops_<range start>-<range end>.csv`
+TERRESTRIAL_CSV_FILENAME_PATTERN = re.compile(r"hops_(\d+)-(\d+)\.csv")
 
-def get_available_satellite(g_lat: float, g_lon: float, current_date_time_string: str, satellites: list):
-    # Find what satellites in the list are accessible to [g_lat, g_lon]
+def get_available_satellite(g_lat: float, g_lon: float, sat_positions: dict):
+    # Find what satellites (names) are accessible to [g_lat, g_lon] at the time point of `sat_positions`
     # That is, within maximum connection range as MAX_GSL_DISTANCE
-    available_sats = list()
-    for satellite in satellites:
-        dis_g_sat = distance_between_ground_satellite(g_lat, g_lon, current_date_time_string, satellite)
-
-        if dis_g_sat <= MAX_GSL_DISTANCE:
-            available_sats.append(satellite)
-    return available_sats
+    _, sat_indices, _ = ground_points_find_inrange_satellites(g_lat, g_lon, sat_positions, MAX_GSL_DISTANCE)
+    return [sat_positions["names"][sat_index] for sat_index in sat_indices]
 
 def get_theoretical_optimal_satellite_latency_gain_varying_distance(relay_distance: int, sat_height: int, max_gsl_distance: int = None):
     # Calculate the theoretical transmission latency of satellite and terrestrial communication
@@ -44,46 +45,31 @@ def get_time_point_number_in_simulation_record_files(sim_record_filenames: list)
     # Get the number of time points in the simulation record files
     time_point_number = 0
     for sim_record_filename in sim_record_filenames:
-        with open(sim_record_filename, 'r') as sim_rf:
-            _ = parse_simulation_record_metadata(sim_rf)
-            for _ in sim_rf:
-                time_point_number += 1
+        if is_columnar_simulation_record(sim_record_filename):
+            time_point_number += len(read_simulation_record_table(sim_record_filename, "times"))
+        else:
+            time_point_number += len(get_simulation_record_offset_index(sim_record_filename))
     return time_point_number
 
 def parse_simulation_record_metadata(record_file_d):
-    sim_start_time = record_file_d.readline()
-    sim_end_time = record_file_d.readline()
-    sim_time_step = record_file_d.readline()
-    sim_sat_number = record_file_d.readline()
-    sim_gs_number = record_file_d.readline()
-    sim_pop_number = record_file_d.readline()
-    sim_client_server_info = record_file_d.readline()
-    sim_routing_strategy = record_file_d.readline()
-    sim_gs_satellite_link_mode = record_file_d.readline()
-    sim_latency_mode = record_file_d.readline()
-    sim_dataset = record_file_d.readline()
-
-    return [
-        sim_start_time,
-        sim_end_time,
-        sim_time_step,
-        sim_sat_number,
-        sim_gs_number,
-        sim_pop_number,
-        sim_client_server_info,
-        sim_routing_strategy,
-        sim_gs_satellite_link_mode,
-        sim_latency_mode,
-        sim_dataset
-    ]
+    # Read the metadata lines of an opened text simulation record, stopping before the first time point
+    # the number of metadata lines depends on the version of the simulator that wrote the record
+    metadata = list()
+    while True:
+        position = record_file_d.tell()
+        line = record_file_d.readline()
+        if len(line) == 0 or line.startswith('{'):
+            record_file_d.seek(position)
+            return metadata
+        metadata.append(line)
 
 def extract_one_time_point_from_simulation_record_file(sim_record_filename: str, time_point_index: int):
     # Extract one time point from the simulation record file
-    with open(sim_record_filename, 'r') as sim_rf:
-        settings = parse_simulation_record_metadata(sim_rf)
-        for i in range(time_point_index):
-            _ = sim_rf.readline()
-        return settings, eval(sim_rf.readline())
+    # settings of a columnar record are its metadata dict
+    if is_columnar_simulation_record(sim_record_filename):
+        simulation_record = load_columnar_simulation_record(sim_record_filename)
+        return simulation_record["metadata"], get_columnar_simulation_record_time_point(simulation_record, time_point_index)
+    return read_text_simulation_record_metadata(sim_record_filename), read_text_simulation_record_time_point(sim_record_filename, time_point_index)
 
 # ------------------------ FOR EXP 1: SaTor feasibility ------------------------- #
 # Feasibility, from two parts:
@@ -99,15 +85,18 @@ def get_hops_basic_info_in_circuits(geo_extended_circuits: list):
             s_relay = circuit[i]
             d_relay = circuit[i + 1]
             hop_id = generate_hop_id(s_relay, d_relay)
-            dis = distance_between_ground_stations([s_relay[4], s_relay[5]],
-                                                   [d_relay[4], d_relay[5]])
-            hops_info[hop_id] = [s_relay[4], s_relay[5], d_relay[4], d_relay[5], dis]
+            hops_info[hop_id] = [s_relay[4], s_relay[5], d_relay[4], d_relay[5]]
+    hops_coordinates = np.array(list(hops_info.values()), dtype = np.float64).reshape(-1, 4)
+    distances = great_circle_distances(hops_coordinates[:, 0], hops_coordinates[:, 1], hops_coordinates[:, 2], hops_coordinates[:, 3])
+    for hop_info, dis in zip(hops_info.values(), distances.tolist()):
+        hop_info.append(dis)
     return hops_info
 
 # ---------------- Satellite availability analysis ---------------- #
 def get_relay_starlink_service_accessibility(tor_relays: dict, starlink_regions_info: list, filename_geoip_dataset: str):
     starlink_available_country_codes = [item["region"] for item in starlink_regions_info["prices"]] + ["US", "MT", "CY", "IS", "FI"]
     relay_accessibility_results = dict()
+    prefetch_geo_locations([relay_info["ip"] for relay_info in tor_relays.values()], filename_geoip_dataset)
     for relay_fp, relay_info in tor_relays.items():
         relay_for_retrieve = [relay_fp, relay_info["nickname"], relay_info["ip"], relay_info["or_port"]]
         geo_extended_relay = retrieve_relay_geo_location(relay_for_retrieve, relay_info["ip"], filename_geoip_dataset)
@@ -118,192 +107,263 @@ def get_relay_starlink_service_accessibility(tor_relays: dict, starlink_regions_
         verbose_print("Relay", relay_fp, "accessibility checked, we have checked", len(relay_accessibility_results), "relays", level = 0)
     return relay_accessibility_results
 
-def get_relay_accessible_satellites_num(tor_relays: dict, satellites: list, filename_geoip_dataset: str, time_start: ephem.Date, time_end: ephem.Date, time_step: int):
-    relay_accessible_satellites_num = dict()
+def get_relay_accessible_satellites_num(tor_relays: dict, constellation: dict, filename_geoip_dataset: str, time_start: ephem.Date, time_end: ephem.Date, time_step: int):
+    # Number of satellites accessible to each relay at each time point, all relays and time points at once
+    # output: {relay_fp: {time_point: satellite number}}
+    time_points = get_simulation_time_points(time_start, time_end, time_step)
+    prefetch_geo_locations([relay_info["ip"] for relay_info in tor_relays.values()], filename_geoip_dataset)
+    relay_coordinates = list()
     for relay_fp, relay_info in tor_relays.items():
         relay_for_retrieve = [relay_fp, relay_info["nickname"], relay_info["ip"], relay_info["or_port"]]
         geo_extended_relay = retrieve_relay_geo_location(relay_for_retrieve, relay_info["ip"], filename_geoip_dataset)
-        time_cursor = time_start
-        relay_accessible_satellites_num_time_range = dict()
-        while time_cursor < time_end:
-            available_sats = get_available_satellite(geo_extended_relay[4], geo_extended_relay[5], str(ephem.Date(time_cursor)), satellites)
-            relay_accessible_satellites_num_time_range[str(ephem.Date(time_cursor))] = len(available_sats)
-            time_cursor += time_step * ephem.second
-        relay_accessible_satellites_num[relay_fp] = relay_accessible_satellites_num_time_range
-        verbose_print("Relay", relay_fp, "satellite accessibility checked, we have checked", len(relay_accessible_satellites_num), "relays", level = 0)
+        relay_coordinates.append([geo_extended_relay[4], geo_extended_relay[5]])
+    relay_coordinates = np.array(relay_coordinates, dtype = np.float64).reshape(-1, 2)
+    # shape = (relays, time points)
+    accessible_satellites_num = ground_points_visibility_time_series(relay_coordinates[:, 0], relay_coordinates[:, 1], constellation, time_points, MAX_GSL_DISTANCE)
+    verbose_print("Satellite accessibility checked for", len(tor_relays), "relays at", len(time_points), "time points", level = 0)
+
+    relay_accessible_satellites_num = dict()
+    for relay_index, relay_fp in enumerate(tor_relays.keys()):
+        relay_accessible_satellites_num[relay_fp] = dict(zip(time_points, accessible_satellites_num[relay_index].tolist()))
     return relay_accessible_satellites_num
 
 # ------------------------------- Extract some useful information from raw simulation txt files ------------------------------- #
 
 def get_simulation_record_time_points(sim_record_filenames: list):
+    # Load all time points at once, prefer `iterate_simulation_record_time_points` for large records
     simulation_record_time_points = list()
-    for sim_record_filename in sim_record_filenames:
-        with open(sim_record_filename, 'r', errors = "ignore") as sim_rf:
-            _ = parse_simulation_record_metadata(sim_rf)
-            for sim_record_at_time_t in sim_rf:
-                try:
-                    simulation_record_time_points.append(eval(sim_record_at_time_t))
-                    verbose_print("Simulation record loaded of", len(simulation_record_time_points), "time points", level = 1)
-                except:
-                    verbose_print("Simulation record fails to load. Record content is", sim_record_at_time_t, level = 3)
+    for simulation_record_at_time_t in iterate_simulation_record_time_points(sim_record_filenames):
+        simulation_record_time_points.append(simulation_record_at_time_t)
+        verbose_print("Simulation record loaded of", len(simulation_record_time_points), "time points", level = 1)
     return simulation_record_time_points
 
 
+def is_satellite_involved_node(node_name: str):
+    return "s_" in node_name
+
+def split_path_record_latency(path_record: dict):
+    # output: (latency of the segments involving a satellite, latency of the other segments)
+    satellite_latency, terrestrial_latency = 0, 0
+    segment_latencies = path_record["latencies"]
+    route_nodes = path_record["path"]
+    for i in range(len(route_nodes) - 1):
+        if is_satellite_involved_node(route_nodes[i]) or is_satellite_involved_node(route_nodes[i + 1]):
+            satellite_latency += segment_latencies[i]
+        else:
+            terrestrial_latency += segment_latencies[i]
+    return satellite_latency, terrestrial_latency
+
+def iterate_simulation_record_path_latency_splits(sim_record_filenames: list):
+    # Yield, per time point, the hop id, satellite latency and terrestrial latency of every recorded path
+    # columnar records are split for all their time points at once
+    for sim_record_filename in sim_record_filenames:
+        if is_columnar_simulation_record(sim_record_filename):
+            simulation_record = load_columnar_simulation_record(sim_record_filename)
+            node_flags = np.array([is_satellite_involved_node(node_name) for node_name in simulation_record["nodes"]] + [False])
+            satellite_latencies, terrestrial_latencies = get_columnar_simulation_record_path_segment_sums(simulation_record, node_flags)
+            path_times = np.asarray(simulation_record["columns"]["path_time"])
+            path_hops = np.asarray(simulation_record["columns"]["path_hop"])
+            hop_ids = np.array(simulation_record["hops"] + [""], dtype = object)
+            time_bounds = np.searchsorted(path_times, np.arange(len(simulation_record["times"]) + 1))
+            for t in range(len(simulation_record["times"])):
+                paths = slice(time_bounds[t], time_bounds[t + 1])
+                yield hop_ids[path_hops[paths]], satellite_latencies[paths], terrestrial_latencies[paths]
+            continue
+        for simulation_record_at_time_t in iterate_simulation_record_time_points([sim_record_filename]):
+            path_hop_ids, path_latency_splits = list(), list()
+            for hop_id, hop_paths in simulation_record_at_time_t["results"].items():
+                for path_record in hop_paths:
+                    path_hop_ids.append(hop_id)
+                    path_latency_splits.append(split_path_record_latency(path_record))
+            path_latency_splits = np.array(path_latency_splits, dtype = np.float64).reshape(-1, 2)
+            yield path_hop_ids, path_latency_splits[:, 0], path_latency_splits[:, 1]
+
+def get_hops_latency_tensor(hop_ids: list, sim_record_filenames: list, latency_factor: list = None):
+    # Mean path latency of every hop at every time point, for every satellite latency factor
+    # the factor scales the segments involving a satellite: latency = factor * satellite latency + terrestrial latency
+    # output: latencies, shape = (hops, time points, factors), inf where a hop has no path
+    latency_factor = np.array([1] if latency_factor is None else latency_factor, dtype = np.float64)
+    hop_index = {hop_id: index for index, hop_id in enumerate(hop_ids)}
+    hop_latencies_time_points = list()
+    for path_hop_ids, satellite_latencies, terrestrial_latencies in iterate_simulation_record_path_latency_splits(sim_record_filenames):
+        # paths of hops that are not asked for go to an extra row
+        path_hops = np.array([hop_index.get(hop_id, len(hop_ids)) for hop_id in path_hop_ids], dtype = np.int64)
+        path_counts = np.bincount(path_hops, minlength = len(hop_ids) + 1)[:-1]
+        with np.errstate(invalid = "ignore", divide = "ignore"):
+            satellite_means = np.bincount(path_hops, weights = satellite_latencies, minlength = len(hop_ids) + 1)[:-1] / path_counts
+            terrestrial_means = np.bincount(path_hops, weights = terrestrial_latencies, minlength = len(hop_ids) + 1)[:-1] / path_counts
+        hop_latencies = satellite_means[:, np.newaxis] * latency_factor + terrestrial_means[:, np.newaxis]
+        hop_latencies[path_counts == 0] = math.inf
+        hop_latencies_time_points.append(hop_latencies)
+        verbose_print("Simulation record processed of", len(hop_latencies_time_points), "time points", level = 1)
+    if len(hop_latencies_time_points) == 0:
+        return np.empty((len(hop_ids), 0, len(latency_factor)))
+    return np.stack(hop_latencies_time_points, axis = 1)
+
 def extract_hops_raw_simulation_data(circuits: list, sim_record_filenames: list, latency_factor: list = None):
     # Input: lists of simulation files, and all circuits recorded in the simulation files
     # Output: csv ready dict for hops simulation info
-    def get_modified_latency_by_latency_factor(path_record: dict, factor: float):
-        # we want to modify the latency by a factor
-        # to align with different real-world measurements on satellite transmission speed
-        path_latency = 0
-        segment_latencies = path_record["latencies"]
-        route_nodes = path_record["path"]
-        for i in range(len(route_nodes) - 1):
-            if "s_" in route_nodes[i] or "s_" in route_nodes[i + 1]: # satellite involved
-                path_latency += segment_latencies[i] * factor
-            else:
-                path_latency += segment_latencies[i]
-        return path_latency
-
-    simulation_record_time_points = get_simulation_record_time_points(sim_record_filenames)
-    time_point_num = len(simulation_record_time_points)
+    # here we use the average of all satellite path as SaTor's performance
+    # we set a factor here to modify the latency
+    # this is because in raw simulation TXT files, the latency is calculated based on one location of satellite measurement (edinburgh)
+    # we use a factor: the radio between edinburgh speed and other places to modify the latency
 
     # we first do distance calculation for each hop
     # return format: {hop_id: [s_lat, s_lon, d_lat, d_lon, distance]}
     hops_basic_info = get_hops_basic_info_in_circuits(circuits)
+    hop_ids = list(hops_basic_info.keys())
 
     # Then we get the simulation record for each hop at each time point
-    extracted_hops_info = {}
+    # time points are streamed from the record files, only one of them is in memory at a time
     verbose_print("Start processing hops latency info from simulation records.", level = 1)
-
-    hop_index = 0
-    for hop_id, hop_basic_info in hops_basic_info.items():
-        extracted_hop_info = {
-            "hop_distance": hop_basic_info[-1],
-            "hop_coordinates": hop_basic_info[:4],
-            "hop_latency_records_time_range": [],
-            "hop_satellite_inaccessible_time_points": 0
-        }
-        # time point level
-        for simulation_record_at_time_t in simulation_record_time_points:
-            time_t = simulation_record_at_time_t["time"]
-            results = simulation_record_at_time_t["results"]
-            if hop_id in results.keys() and len(results[hop_id]) > 0:
-                # here we use the average of all satellite path as SaTor's performance
-                # we set a factor here to modify the latency
-                # this is because in raw simulation TXT files, the latency is calculated based on one location of satellite measurement (edinburgh)
-                # we use a factor: the radio between edinburgh speed and other places to modify the latency
-                hop_mean_latency_at_time_t = []
-                if latency_factor is None: # no modification
-                    hop_mean_latency_at_time_t.append(np.mean([get_modified_latency_by_latency_factor(hop_record_path, factor = 1) for hop_record_path in results[hop_id]]))
-                else:
-                    for factor in latency_factor:
-                        hop_mean_latency_at_time_t.append(np.mean([get_modified_latency_by_latency_factor(hop_record_path, factor = factor) for hop_record_path in results[hop_id]]))
-            else:
-                # verbose_print("Hop", hop_id, "at", time_t, "cannot get access to satellite.", level = 3)
-                hop_mean_latency_at_time_t = [math.inf] * len(latency_factor) if latency_factor is not None else [math.inf]
-                extracted_hop_info["hop_satellite_inaccessible_time_points"] += 1
-            extracted_hop_info["hop_latency_records_time_range"].append(hop_mean_latency_at_time_t)
-
-        extracted_hops_info[hop_id] = extracted_hop_info
-        hop_index += 1
+    hop_latencies = get_hops_latency_tensor(hop_ids, sim_record_filenames, latency_factor)
 
     csv_hops_info = {
-        "hop_id": list(extracted_hops_info.keys()),
-        "hop_distance (m)": [hop_info["hop_distance"] for hop_info in extracted_hops_info.values()],
-        "hop_coordinates": [hop_info["hop_coordinates"] for hop_info in extracted_hops_info.values()],
-        "hop_satellite_inaccessible_time_points": [hop_info["hop_satellite_inaccessible_time_points"] for hop_info in extracted_hops_info.values()]
+        "hop_id": hop_ids,
+        "hop_distance (m)": [hop_basic_info[-1] for hop_basic_info in hops_basic_info.values()],
+        "hop_coordinates": [hop_basic_info[:4] for hop_basic_info in hops_basic_info.values()],
+        "hop_satellite_inaccessible_time_points": np.sum(np.isinf(hop_latencies[:, :, 0]), axis = 1).tolist()
     }
-    for i in range(time_point_num):
-        csv_hops_info["time_point_" + str(i)] = [hop_info["hop_latency_records_time_range"][i] for hop_info in extracted_hops_info.values()]
+    for i in range(hop_latencies.shape[1]):
+        csv_hops_info["time_point_" + str(i)] = hop_latencies[:, i, :].tolist()
 
     return csv_hops_info
 
-def merge_hops_csv_for_origin(hops_group_csv_filedir: str, hops_group_csv_filenames: list, terrestrial_csv_filedir: str, factors_define: dict):
+def parse_latency_list_cells(cells: pd.Series):
+    # Parse CSV cells holding latency lists, e.g. "[0.01, inf]", into a float array of shape (cells, list length)
+    numbers = cells.astype(str).str.replace(r"np\.float64\(|[\[\]\)\s]", "", regex = True)
+    return np.array(numbers.str.split(",").tolist(), dtype = np.float64)
+
+def read_hops_latency_csv(hops_csv_filepath: str):
+    # Read a hops csv written from `extract_hops_raw_simulation_data`
+    # output: (dataframe without the time point columns, latencies of shape (hops, time points, factors))
+    hops_dataframe = pd.read_csv(hops_csv_filepath)
+    time_point_columns = sorted([column for column in hops_dataframe.columns if column.startswith("time_point_")], key = lambda column: int(column[len("time_point_"):]))
+    if len(time_point_columns) == 0 or len(hops_dataframe) == 0:
+        return hops_dataframe.drop(columns = time_point_columns), np.empty((len(hops_dataframe), len(time_point_columns), 0))
+    hop_latencies_time_points = np.stack([parse_latency_list_cells(hops_dataframe[column]) for column in time_point_columns], axis = 1)
+    return hops_dataframe.drop(columns = time_point_columns), hop_latencies_time_points
+
+def get_terrestrial_csv_filenames(terrestrial_csv_filedir: str):
+    # output: the names of the circuit range files in the directory, sorted by range start, other files are left out
+    range_filenames = list()
+    for filename in os.listdir(terrestrial_csv_filedir):
+        matched = TERRESTRIAL_CSV_FILENAME_PATTERN.fullmatch(filename)
+        if matched is not None:
+            range_filenames.append(((int(matched.group(1)), int(matched.group(2))), filename))
+    if len(range_filenames) == 0:
+        raise ValueError("No terrestrial hops csv file (hops_<start>-<end>.csv) in " + terrestrial_csv_filedir)
+    return [filename for _, filename in sorted(range_filenames)]
+
+def get_hops_terrestrial_dataframe(terrestrial_csv_filedir: str, terrestrial_csv_filenames: list = None):
+    # Merge the terrestrial hops csv files, by default all circuit range files in the directory, sorted by range start, one row per hop
+    if terrestrial_csv_filenames is None:
+        terrestrial_csv_filenames = get_terrestrial_csv_filenames(terrestrial_csv_filedir)
+    terrestrial_dataframes = [pd.read_csv(terrestrial_csv_filedir + filename) for filename in terrestrial_csv_filenames]
+    terrestrial_merged_dataframe = pd.concat(terrestrial_dataframes, ignore_index = True)
+    terrestrial_merged_dataframe["filename"] = np.repeat(terrestrial_csv_filenames, [len(dataframe) for dataframe in terrestrial_dataframes])
+    # a hop in several files is only fine with the same latency everywhere, otherwise which file is right is unknown
+    duplicated = terrestrial_merged_dataframe["hop_id"].duplicated(keep = False)
+    if duplicated.any():
+        overlaps = terrestrial_merged_dataframe[duplicated]
+        conflicting = overlaps.groupby("hop_id")["terrestrial_latency (ms)"].nunique() > 1
+        if conflicting.any():
+            raise ValueError(str(int(conflicting.sum())) + " hops have different terrestrial latencies across " + str(sorted(overlaps["filename"].unique().tolist())) +
+                             ", e.g., " + str(conflicting.index[conflicting].tolist()[:5]))
+        verbose_print(overlaps["hop_id"].nunique(), "hops are in several terrestrial csv files with the same latencies", level = 2)
+    return terrestrial_merged_dataframe.drop_duplicates(subset = "hop_id", keep = "first").drop(columns = "filename")
+
+def merge_hops_csv_for_origin(hops_group_csv_filedir: str, hops_group_csv_filenames: list, terrestrial_csv_filedir: str, factors_define: dict, terrestrial_csv_filenames: list = None):
     # what we need for origin figure:
     # 1. satellite inaccessible time points percentage
     # 2. pure terrestrial latency
     # 3. then different factors for satellite speed
     # 3.1. satellite latency using optimal dual-homing, min, max, average, average-improvement, satellite faster time percentage
     # 3.2. satellite latency fixing at satellite, min, max, average, improvement
+    factor_columns = [loc + "_" + str(i) for loc, factor_num in factors_define.items() for i in range(factor_num)]
+    terrestrial_merged_dataframe = get_hops_terrestrial_dataframe(terrestrial_csv_filedir, terrestrial_csv_filenames)
 
-    revised_merged_dataframe = {
-        "hop_id": [],
-        "hop_distance (m)": [],
-        "hop_satellite_inaccessible_time_points_percentage": [],
-        "terrestrial_latency (ms)": []
-    }
-    for loc, factor_num in factors_define.items():
-        for i in range(factor_num):
-            revised_merged_dataframe[loc + "_" + str(i)] = []
-
-    terrestrial_hops_csv_filenames = [terrestrial_csv_filedir + "hops_" + str(i) + "-" + str(i + 2500) + ".csv" for i in range(0, 20000, 2500)]
-    terrestrial_merged_dataframe = merge_csv(terrestrial_hops_csv_filenames)
-
+    revised_merged_dataframes = list()
     for hops_group_csv_filename in hops_group_csv_filenames:
-        hops_group_csv_filepath = hops_group_csv_filedir + hops_group_csv_filename
-        hops_group_dataframe = pd.read_csv(hops_group_csv_filepath)
-        # hop groups
-        for index, row in hops_group_dataframe.iterrows():
-            # each hop
-            hop_id = row["hop_id"]
-            hop_distance = row["hop_distance (m)"]
-            hop_satellite_inaccessible_time_points = row["hop_satellite_inaccessible_time_points"]
-            terrestrial_hop_latency = terrestrial_merged_dataframe[terrestrial_merged_dataframe["hop_id"] == hop_id]["terrestrial_latency (ms)"].values[0]
-            revised_merged_dataframe["hop_id"].append(hop_id)
-            revised_merged_dataframe["hop_distance (m)"].append(hop_distance)
-            revised_merged_dataframe["terrestrial_latency (ms)"].append(terrestrial_hop_latency)
-            revised_merged_dataframe["hop_satellite_inaccessible_time_points_percentage"].append(
-                hop_satellite_inaccessible_time_points / 121)  # we have 121 time points in total
-            hop_latencies_time_points = np.array(
-                [eval(row["time_point_" + str(i)], {"inf": np.inf}) for i in range(121)])
-            assert hop_latencies_time_points.shape == (121, sum(factors_define.values()))
-            # optimal dual-homing satellite latency
-            optimal_dual_homing_latencies = np.minimum(hop_latencies_time_points, terrestrial_hop_latency)
-            optimal_dual_homing_latencies_average_across_time = np.mean(optimal_dual_homing_latencies, axis=0)
-            optimal_dual_homing_latencies_min_across_time = np.min(optimal_dual_homing_latencies, axis=0)
-            optimal_dual_homing_latencies_max_across_time = np.max(optimal_dual_homing_latencies, axis=0)
-            optimal_dual_homing_latencies_average_improvement = np.mean(
-                terrestrial_hop_latency - optimal_dual_homing_latencies, axis=0)
-            # fix at satellite
-            fixed_satellite_dual_homing_average_across_time = np.mean(hop_latencies_time_points, axis=0)
-            fixed_satellite_dual_homing_min_across_time = np.min(hop_latencies_time_points, axis=0)
-            fixed_satellite_dual_homing_max_across_time = np.max(hop_latencies_time_points, axis=0)
-            fixed_satellite_dual_homing_average_improvement = np.mean(
-                terrestrial_hop_latency - hop_latencies_time_points, axis=0)
-            # satellite faster time percentage
-            latencies_satellite_faster_matrix = np.where(hop_latencies_time_points < terrestrial_hop_latency, 1, 0)
-            satellite_faster_time_percentage = np.sum(latencies_satellite_faster_matrix, axis=0) / 121
-            assert (optimal_dual_homing_latencies_average_across_time.shape ==
-                    optimal_dual_homing_latencies_min_across_time.shape ==
-                    optimal_dual_homing_latencies_max_across_time.shape ==
-                    optimal_dual_homing_latencies_average_improvement.shape ==
-                    fixed_satellite_dual_homing_average_across_time.shape ==
-                    fixed_satellite_dual_homing_min_across_time.shape ==
-                    fixed_satellite_dual_homing_max_across_time.shape ==
-                    fixed_satellite_dual_homing_average_improvement.shape ==
-                    satellite_faster_time_percentage.shape ==
-                    (sum(factors_define.values()),))
-
-            index = 0
-            for loc, factor_num in factors_define.items():
-                for i in range(factor_num):
-                    revised_merged_dataframe[loc + "_" + str(i)].append([
-                        optimal_dual_homing_latencies_average_across_time[index],
-                        optimal_dual_homing_latencies_min_across_time[index],
-                        optimal_dual_homing_latencies_max_across_time[index],
-                        optimal_dual_homing_latencies_average_improvement[index],
-                        fixed_satellite_dual_homing_average_across_time[index],
-                        fixed_satellite_dual_homing_min_across_time[index],
-                        fixed_satellite_dual_homing_max_across_time[index],
-                        fixed_satellite_dual_homing_average_improvement[index],
-                        satellite_faster_time_percentage[index]
-                    ])
-                    index += 1
-    # to file
-    revised_merged_dataframe = pd.DataFrame(revised_merged_dataframe)
-    return revised_merged_dataframe
+        hops_group_dataframe, hop_latencies_time_points = read_hops_latency_csv(hops_group_csv_filedir + hops_group_csv_filename)
+        # hop groups, joined with the terrestrial latencies once
+        hops_group_dataframe = hops_group_dataframe.merge(terrestrial_merged_dataframe[["hop_id", "terrestrial_latency (ms)"]], on = "hop_id", how = "left", validate = "many_to_one")
+        if hops_group_dataframe["terrestrial_latency (ms)"].isna().any():
+            raise ValueError("Hops without terrestrial latency in " + hops_group_csv_filename + ": " + str(hops_group_dataframe["hop_id"][hops_group_dataframe["terrestrial_latency (ms)"].isna()].tolist()[:5]))
+        time_point_num = hop_latencies_time_points.shape[1]
+        assert hop_latencies_time_points.shape == (len(hops_group_dataframe), time_point_num, len(factor_columns))
+        terrestrial_hop_latencies = hops_group_dataframe["terrestrial_latency (ms)"].to_numpy(dtype = np.float64)[:, np.newaxis, np.newaxis]
+
+        # statistics over time, shape = (hops, factors)
+        # optimal dual-homing satellite latency
+        optimal_dual_homing_latencies = np.minimum(hop_latencies_time_points, terrestrial_hop_latencies)
+        optimal_dual_homing_latencies_average_across_time = np.mean(optimal_dual_homing_latencies, axis = 1)
+        optimal_dual_homing_latencies_min_across_time = np.min(optimal_dual_homing_latencies, axis = 1)
+        optimal_dual_homing_latencies_max_across_time = np.max(optimal_dual_homing_latencies, axis = 1)
+        optimal_dual_homing_latencies_average_improvement = np.mean(terrestrial_hop_latencies - optimal_dual_homing_latencies, axis = 1)
+        # fix at satellite
+        fixed_satellite_dual_homing_average_across_time = np.mean(hop_latencies_time_points, axis = 1)
+        fixed_satellite_dual_homing_min_across_time = np.min(hop_latencies_time_points, axis = 1)
+        fixed_satellite_dual_homing_max_across_time = np.max(hop_latencies_time_points, axis = 1)
+        fixed_satellite_dual_homing_average_improvement = np.mean(terrestrial_hop_latencies - hop_latencies_time_points, axis = 1)
+        # satellite faster time percentage
+        satellite_faster_time_percentage = np.sum(hop_latencies_time_points < terrestrial_hop_latencies, axis = 1) / time_point_num
+        hops_statistics = np.stack([
+            optimal_dual_homing_latencies_average_across_time,
+            optimal_dual_homing_latencies_min_across_time,
+            optimal_dual_homing_latencies_max_across_time,
+            optimal_dual_homing_latencies_average_improvement,
+            fixed_satellite_dual_homing_average_across_time,
+            fixed_satellite_dual_homing_min_across_time,
+            fixed_satellite_dual_homing_max_across_time,
+            fixed_satellite_dual_homing_average_improvement,
+            satellite_faster_time_percentage
+        ], axis = 2) # shape = (hops, factors, statistics)
+
+        revised_merged_dataframe = {
+            "hop_id": hops_group_dataframe["hop_id"],
+            "hop_distance (m)": hops_group_dataframe["hop_distance (m)"],
+            "hop_satellite_inaccessible_time_points_percentage": hops_group_dataframe["hop_satellite_inaccessible_time_points"] / time_point_num,
+            "terrestrial_latency (ms)": hops_group_dataframe["terrestrial_latency (ms)"]
+        }
+        for index, factor_column in enumerate(factor_columns):
+            revised_merged_dataframe[factor_column] = hops_statistics[:, index, :].tolist()
+        revised_merged_dataframes.append(pd.DataFrame(revised_merged_dataframe))
 
+    # to file
+    if len(revised_merged_dataframes) == 0:
+        return pd.DataFrame(columns = ["hop_id", "hop_distance (m)", "hop_satellite_inaccessible_time_points_percentage", "terrestrial_latency (ms)"] + factor_columns)
+    return pd.concat(revised_merged_dataframes, ignore_index = True)
+
+
+def get_circuits_dual_homing_statistics(circuits_satellite_latencies: np.ndarray, circuits_terrestrial_latencies: np.ndarray):
+    # input: hop satellite latencies, shape = (circuits, hops, time points, factors), and hop terrestrial latencies, shape = (circuits, hops)
+    # output: statistics of each circuit and factor, shape = (circuits, factors, 13), see `extract_and_merge_circuit_simulation_result`
+    terrestrial_latencies = circuits_terrestrial_latencies[:, :, np.newaxis, np.newaxis]
+    circuits_terrestrial_latency = np.sum(circuits_terrestrial_latencies, axis = 1)[:, np.newaxis, np.newaxis]
+    # optimal dual-homing: at each time point, each hop takes the faster of satellite and terrestrial routing
+    optimal_dual_homing_latencies = np.sum(np.minimum(circuits_satellite_latencies, terrestrial_latencies), axis = 1) # shape = (circuits, time points, factors)
+    optimal_routing_methods = np.sum(circuits_satellite_latencies < terrestrial_latencies, axis = 1) # satellite hop number at each time point
+    # fixed dual-homing latency
+    # 1. determine the average latency of satellite routing and terrestrial routing
+    # 2. for each hop, if satellite routing is faster on average, we use satellite routing, otherwise, we use terrestrial routing at all time points
+    fixed_dual_homing_routing_methods = np.mean(circuits_satellite_latencies, axis = 2, keepdims = True) < terrestrial_latencies # shape = (circuits, hops, 1, factors)
+    fixed_dual_homing_latencies = np.sum(np.where(fixed_dual_homing_routing_methods, circuits_satellite_latencies, terrestrial_latencies), axis = 1)
+    return np.stack([
+        np.min(optimal_dual_homing_latencies, axis = 1),
+        np.mean(optimal_dual_homing_latencies, axis = 1),
+        np.max(optimal_dual_homing_latencies, axis = 1),
+        np.mean(circuits_terrestrial_latency - optimal_dual_homing_latencies, axis = 1),
+        np.min(fixed_dual_homing_latencies, axis = 1),
+        np.mean(fixed_dual_homing_latencies, axis = 1),
+        np.max(fixed_dual_homing_latencies, axis = 1),
+        np.mean(circuits_terrestrial_latency - fixed_dual_homing_latencies, axis = 1),
+        np.sum(optimal_routing_methods == 0, axis = 1),
+        np.sum(optimal_routing_methods == 1, axis = 1),
+        np.sum(optimal_routing_methods == 2, axis = 1),
+        np.sum(optimal_routing_methods >= 3, axis = 1), # circuits longer than three hops are counted here too
+        np.sum(fixed_dual_homing_routing_methods[:, :, 0, :], axis = 1)
+    ], axis = 2)
 
 def extract_and_merge_circuit_simulation_result(circuits: list,
                                                 hop_satellite_latency_csv_filedir: str,
@@ -314,19 +374,18 @@ def extract_and_merge_circuit_simulation_result(circuits: list,
                                                 circuit_hop_group_size: int):
 
     # get all hops' terrestrial latency info
-    hop_terrestrial_latencies = dict()
+    hop_terrestrial_latency_csv_filepaths = list()
     for hop_terrestrial_latency_csv_filename in hop_terrestrial_latency_csv_filenames:
         if not os.path.exists(hop_terrestrial_latency_csv_filedir + hop_terrestrial_latency_csv_filename):
             verbose_print("File", hop_terrestrial_latency_csv_filedir + hop_terrestrial_latency_csv_filename, "not found.", level = 3)
-            continue
         else:
-            hop_terrestrial_latency = pd.read_csv(hop_terrestrial_latency_csv_filedir + hop_terrestrial_latency_csv_filename)
-            for index, hop in hop_terrestrial_latency.iterrows():
-                hop_id = hop["hop_id"]
-                hop_terrestrial_latency_info = hop.to_dict()
-                hop_terrestrial_latency_info.pop("hop_id")
-                hop_terrestrial_latencies[hop_id] = hop_terrestrial_latency_info
+            hop_terrestrial_latency_csv_filepaths.append(hop_terrestrial_latency_csv_filedir + hop_terrestrial_latency_csv_filename)
+    hop_terrestrial_latencies = merge_csv(hop_terrestrial_latency_csv_filepaths).drop_duplicates(subset = "hop_id", keep = "last") if len(hop_terrestrial_latency_csv_filepaths) > 0 else pd.DataFrame(columns = ["hop_id", "hop_distance (m)", "terrestrial_latency (ms)"])
+    hop_terrestrial_index = {hop_id: index for index, hop_id in enumerate(hop_terrestrial_latencies["hop_id"])}
+    hop_distances = hop_terrestrial_latencies["hop_distance (m)"].to_numpy(dtype = np.float64)
+    hop_terrestrial_latencies = hop_terrestrial_latencies["terrestrial_latency (ms)"].to_numpy(dtype = np.float64)
 
+    factor_columns = [loc + "_" + str(i) for loc, factor_num in defined_factors.items() for i in range(factor_num)]
     circuits_csv_info = {
         "circuit_id": [],
         "circuit_hops_distance (m)": [], # distance of each hop
@@ -334,162 +393,86 @@ def extract_and_merge_circuit_simulation_result(circuits: list,
         "circuit_hops_terrestrial_latency (ms)": [], # terrestrial latency of each hop, constant throughout the simulation period
         "circuit_terrestrial_latency (ms)": [], # total terrestrial latency summing all hops, constant throughout the simulation period
     }
-    for loc, factor_num in defined_factors.items():
-        for i in range(factor_num):
-            circuits_csv_info[loc + "_" + str(i)] = []
+    for factor_column in factor_columns:
+        circuits_csv_info[factor_column] = []
     # in each factor, we have the following info:
     # [shortest, average, longest, average improvement (optimal dual_homing),
     # fixed satellite shortest, fixed satellite average, fixed satellite longest, fixed satellite average improvement,
-    # no/one/two/three hops satellite time points num for optimal routing method,
+    # no/one/two/three or more hops satellite time points num for optimal routing method,
     # satellite hop number for fixed routing method]
     for i in range(0, len(circuits), circuit_hop_group_size):
         circuits_group = circuits[i: i + circuit_hop_group_size]
         # get all related hop info for this group of circuits
-        hop_satellite_latencies = dict()
         hop_satellite_latency_csv_filename = hop_satellite_latency_csv_filenames[i // circuit_hop_group_size]
         if not os.path.exists(hop_satellite_latency_csv_filedir + hop_satellite_latency_csv_filename):
             verbose_print("File", hop_satellite_latency_csv_filedir + hop_satellite_latency_csv_filename, "not found.", level = 3)
             continue
-        else:
-            hop_satellite_latencies_csv_data = pd.read_csv(hop_satellite_latency_csv_filedir + hop_satellite_latency_csv_filename)
-            for index, hop in hop_satellite_latencies_csv_data.iterrows():
-                hop_id = hop["hop_id"]
-                hop_satellite_latency_info = hop.to_dict()
-                hop_satellite_latency_info.pop("hop_id")
-                hop_satellite_latency_info.pop("hop_satellite_inaccessible_time_points")
-                hop_satellite_latencies[hop_id] = hop_satellite_latency_info # {"time_point_0": "[factor_1, factor_2, ...]", ...}
-
-        for circuit in circuits_group:
+        hop_satellite_dataframe, hop_satellite_latencies = read_hops_latency_csv(hop_satellite_latency_csv_filedir + hop_satellite_latency_csv_filename) # shape = (hops, time points, factors)
+        hop_satellite_index = {hop_id: index for index, hop_id in enumerate(hop_satellite_dataframe["hop_id"])}
+
+        # circuits of the same hop number are gathered into one array
+        circuits_hop_ids = [[generate_hop_id(circuit[j], circuit[j + 1]) for j in range(len(circuit) - 1)] for circuit in circuits_group]
+        circuits_statistics = [None] * len(circuits_group)
+        for hop_num in set([len(hop_ids) for hop_ids in circuits_hop_ids]):
+            positions = [position for position, hop_ids in enumerate(circuits_hop_ids) if len(hop_ids) == hop_num]
+            satellite_indices = np.array([[hop_satellite_index[hop_id] for hop_id in circuits_hop_ids[position]] for position in positions], dtype = np.int64).reshape(len(positions), hop_num)
+            terrestrial_indices = np.array([[hop_terrestrial_index[hop_id] for hop_id in circuits_hop_ids[position]] for position in positions], dtype = np.int64).reshape(len(positions), hop_num)
+            statistics = get_circuits_dual_homing_statistics(hop_satellite_latencies[satellite_indices], hop_terrestrial_latencies[terrestrial_indices])
+            for row, position in enumerate(positions):
+                circuits_statistics[position] = (terrestrial_indices[row], statistics[row])
+
+        for circuit, (terrestrial_indices, statistics) in zip(circuits_group, circuits_statistics):
             # each circuit
-            circuit_id = generate_circuit_id(circuit)
-            circuits_csv_info["circuit_id"].append(circuit_id)
-
-            all_three_hops_distances = []
-            all_three_hops_terrstrial_latencies = []
-            all_three_hops_satellite_latencies = []
-            for i in range(len(circuit) - 1):
-                # each hop
-                hop_id = generate_hop_id(circuit[i], circuit[i + 1])
-                hop_terrestrial_info = hop_terrestrial_latencies[hop_id]
-                hop_satellite_info = hop_satellite_latencies[hop_id]
-                # hop distance
-                all_three_hops_distances.append(hop_terrestrial_info["hop_distance (m)"])
-                all_three_hops_terrstrial_latencies.append(hop_terrestrial_info["terrestrial_latency (ms)"])
-                # hop satellite latency
-                this_hop_satellite_latencies = [eval(hop_satellite_info["time_point_" + str(i)], {"inf": np.inf}) for i in range(121)] # shape = (time points, factors)
-                all_three_hops_satellite_latencies.append(this_hop_satellite_latencies)
-            all_three_hops_satellite_latencies = np.array(all_three_hops_satellite_latencies) # shape = (a, b, c). a = 3 hops, b = 121 time points, c = factors
-            all_three_hops_terrstrial_latencies = np.array(all_three_hops_terrstrial_latencies) # shape = (a,). a = 3 hops
-            all_three_hops_optimal_dual_homing_latencies = np.minimum(all_three_hops_satellite_latencies, all_three_hops_terrstrial_latencies[:, np.newaxis, np.newaxis])
-            all_three_hops_optimal_routing_methods = np.where(all_three_hops_satellite_latencies < all_three_hops_terrstrial_latencies[:, np.newaxis, np.newaxis], 1, 0) # 1 means satellite, 0 means terrestrial
+            circuits_csv_info["circuit_id"].append(generate_circuit_id(circuit))
             # distance, circuit level
-            circuit_distance = sum(all_three_hops_distances)
-            circuits_csv_info["circuit_hops_distance (m)"].append(all_three_hops_distances)
-            circuits_csv_info["circuit_distance (m)"].append(circuit_distance)
+            circuits_csv_info["circuit_hops_distance (m)"].append(hop_distances[terrestrial_indices].tolist())
+            circuits_csv_info["circuit_distance (m)"].append(float(np.sum(hop_distances[terrestrial_indices])))
             # terrestrial latency, circuit level
-            circuit_terrestrial_latency = np.sum(all_three_hops_terrstrial_latencies)
-            circuits_csv_info["circuit_hops_terrestrial_latency (ms)"].append(list(all_three_hops_terrstrial_latencies))
-            circuits_csv_info["circuit_terrestrial_latency (ms)"].append(circuit_terrestrial_latency)
+            circuits_csv_info["circuit_hops_terrestrial_latency (ms)"].append(hop_terrestrial_latencies[terrestrial_indices].tolist())
+            circuits_csv_info["circuit_terrestrial_latency (ms)"].append(float(np.sum(hop_terrestrial_latencies[terrestrial_indices])))
             # factor by factor
-            index = 0
-            for loc, factor_num in defined_factors.items():
-                for i in range(factor_num):
-                    # optimal dual-homing satellite latency
-                    circuit_optimal_dual_homing_latency_shortest_over_time = np.min(np.sum(all_three_hops_optimal_dual_homing_latencies, axis = 0), axis = 0)
-                    circuit_optimal_dual_homing_latency_average_over_time = np.mean(np.sum(all_three_hops_optimal_dual_homing_latencies, axis = 0), axis = 0)
-                    circuit_optimal_dual_homing_latency_longest_over_time = np.max(np.sum(all_three_hops_optimal_dual_homing_latencies, axis = 0), axis = 0)
-                    circuit_optiaml_dual_homing_latency_average_improvement_over_time = np.mean(np.sum(all_three_hops_terrstrial_latencies) - np.sum(all_three_hops_optimal_dual_homing_latencies, axis = 0), axis = 0)
-
-                    # fixed dual-homing latency
-                    # 1. determine the average latency of satellite routing and terrestrial routing
-                    # 2. for each hop, if satellite routing is faster, we use satellite routing, otherwise, we use terrestrial routing at each time point
-                    circuit_fixed_satellite_latencies_average_over_time = np.mean(all_three_hops_satellite_latencies, axis = 1)
-                    circuit_fixed_dual_homing_routing_methods = np.where(circuit_fixed_satellite_latencies_average_over_time < all_three_hops_terrstrial_latencies[:, np.newaxis], 1, 0)
-                    circuit_fixed_dual_homing_satellite_hop_num = np.sum(circuit_fixed_dual_homing_routing_methods, axis = 0)
-                    expanded_circuit_fixed_dual_homing_routing_methods = np.tile(circuit_fixed_dual_homing_routing_methods[:, np.newaxis, :], (1, all_three_hops_satellite_latencies.shape[1], 1))
-                    circuit_fixed_dual_homing_latencies = np.where(expanded_circuit_fixed_dual_homing_routing_methods == 1, all_three_hops_satellite_latencies, all_three_hops_terrstrial_latencies[:, np.newaxis, np.newaxis])
-                    circuit_fixed_dual_homing_latency_shortest_over_time = np.min(np.sum(circuit_fixed_dual_homing_latencies, axis = 0), axis = 0)
-                    circuit_fixed_dual_homing_latency_average_over_time = np.mean(np.sum(circuit_fixed_dual_homing_latencies, axis = 0), axis = 0)
-                    circuit_fixed_dual_homing_latency_longest_over_time = np.max(np.sum(circuit_fixed_dual_homing_latencies, axis = 0), axis = 0)
-                    circuit_fixed_dual_homing_latency_average_improvement_over_time = np.mean(np.sum(all_three_hops_terrstrial_latencies) - np.sum(circuit_fixed_dual_homing_latencies, axis = 0), axis = 0)
-
-                    # routing method
-                    circuit_optimal_routing_method = np.sum(all_three_hops_optimal_routing_methods, axis = 0)
-                    circuit_optimal_dual_homing_no_hop_satellite_time_points_num = np.sum(circuit_optimal_routing_method == 0, axis = 0)
-                    circuit_optimal_dual_homing_one_hop_satellite_time_points_num = np.sum(circuit_optimal_routing_method == 1, axis = 0)
-                    circuit_optimal_dual_homing_two_hops_satellite_time_points_num = np.sum(circuit_optimal_routing_method == 2, axis = 0)
-                    circuit_optimal_dual_homing_three_hops_satellite_time_points_num = np.sum(circuit_optimal_routing_method == 3, axis = 0)
-
-
-                    circuits_csv_info[loc + "_" + str(i)].append([
-                        circuit_optimal_dual_homing_latency_shortest_over_time[index],
-                        circuit_optimal_dual_homing_latency_average_over_time[index],
-                        circuit_optimal_dual_homing_latency_longest_over_time[index],
-                        circuit_optiaml_dual_homing_latency_average_improvement_over_time[index],
-                        circuit_fixed_dual_homing_latency_shortest_over_time[index],
-                        circuit_fixed_dual_homing_latency_average_over_time[index],
-                        circuit_fixed_dual_homing_latency_longest_over_time[index],
-                        circuit_fixed_dual_homing_latency_average_improvement_over_time[index],
-                        circuit_optimal_dual_homing_no_hop_satellite_time_points_num[index],
-                        circuit_optimal_dual_homing_one_hop_satellite_time_points_num[index],
-                        circuit_optimal_dual_homing_two_hops_satellite_time_points_num[index],
-                        circuit_optimal_dual_homing_three_hops_satellite_time_points_num[index],
-                        circuit_fixed_dual_homing_satellite_hop_num[index]
-                    ])
-                    index += 1
-
+            for index, factor_column in enumerate(factor_columns):
+                circuits_csv_info[factor_column].append(statistics[index].tolist())
 
     return circuits_csv_info
 
 
+def get_dataset_relays_and_hops(filename_dataset: str):
+    # Stream a circuits dataset
+    # output: (relay fingerprint -> number of appearances, set of hops as unordered fingerprint pairs)
+    relay_frequencies = collections.Counter()
+    hops = set()
+    for circuit in iterate_tor_circuits(filename_dataset):
+        relay_frequencies.update([relay[0] for relay in circuit])
+        for i in range(len(circuit) - 1):
+            hops.add(frozenset([circuit[i][0], circuit[i + 1][0]]))
+    return relay_frequencies, hops
+
 def compare_two_dataset(filename_dataset_1: str, filename_dataset_2: str):
-    with open(filename_dataset_1, 'r') as f_dataset_1:
-        dataset_1 = json.loads(f_dataset_1.read())
-    with open(filename_dataset_2, 'r') as f_dataset_2:
-        dataset_2 = json.loads(f_dataset_2.read())
-
-    relays_in_dataset_1 = list()
-    for circuit in dataset_1:
-        for relay in circuit:
-            if relay[0] not in relays_in_dataset_1:
-                relays_in_dataset_1.append(relay[0])
-
-    relays_in_dataset_2 = list()
-    for circuit in dataset_2:
-        for relay in circuit:
-            if relay[0] not in relays_in_dataset_2:
-                relays_in_dataset_2.append(relay[0])
-
-    print(len(relays_in_dataset_1), len(relays_in_dataset_2))
-    duplicate_relays = list()
-    for relay in relays_in_dataset_1:
-        if relay in relays_in_dataset_2:
-            duplicate_relays.append(relay)
-    for relay in relays_in_dataset_2:
-        if relay in relays_in_dataset_1 and relay not in duplicate_relays:
-            duplicate_relays.append(relay)
-    print("number of duplicate relays", len(duplicate_relays))
-
-    hops_in_dataset_1 = list()
-    for circuit in dataset_1:
-        for i in range(2):
-            hop = [circuit[i][0], circuit[i + 1][0]]
-            if hop not in hops_in_dataset_1:
-                hops_in_dataset_1.append(hop)
-
-    hops_in_dataset_2 = list()
-    for circuit in dataset_2:
-        for i in range(2):
-            hop = [circuit[i][0], circuit[i + 1][0]]
-            if hop not in hops_in_dataset_2:
-                hops_in_dataset_2.append(hop)
-
-    duplicate_hops_count = 0
-    for hop_1 in hops_in_dataset_1:
-        for hop_2 in hops_in_dataset_2:
-            if hop_1[0] in hop_2 and hop_1[1] in hop_2:
-                duplicate_hops_count += 1
-    print("number of duplicate hops", duplicate_hops_count)
+    # Compare the relays and hops of two circuits datasets
+    # a hop is the same in both directions
+    # output: overlap counts and Jaccard similarity of relays and hops, and the frequency delta (dataset 2 - dataset 1) of each relay
+    relay_frequencies_1, hops_1 = get_dataset_relays_and_hops(filename_dataset_1)
+    relay_frequencies_2, hops_2 = get_dataset_relays_and_hops(filename_dataset_2)
+    relays_1, relays_2 = set(relay_frequencies_1.keys()), set(relay_frequencies_2.keys())
+
+    def jaccard_similarity(set_1: set, set_2: set):
+        return len(set_1 & set_2) / len(set_1 | set_2) if len(set_1 | set_2) > 0 else 0
+
+    relay_frequency_deltas = {relay: relay_frequencies_2[relay] - relay_frequencies_1[relay] for relay in relays_1 | relays_2}
+    comparison = {
+        "relay_number": [len(relays_1), len(relays_2)],
+        "duplicate_relay_number": len(relays_1 & relays_2),
+        "relay_jaccard_similarity": jaccard_similarity(relays_1, relays_2),
+        "hop_number": [len(hops_1), len(hops_2)],
+        "duplicate_hop_number": len(hops_1 & hops_2),
+        "hop_jaccard_similarity": jaccard_similarity(hops_1, hops_2),
+        # largest changes first
+        "relay_frequency_deltas": dict(sorted(relay_frequency_deltas.items(), key = lambda x: abs(x[1]), reverse = True))
+    }
+    verbose_print("number of duplicate relays", comparison["duplicate_relay_number"], ", Jaccard similarity", comparison["relay_jaccard_similarity"], level = 1)
+    verbose_print("number of duplicate hops", comparison["duplicate_hop_number"], ", Jaccard similarity", comparison["hop_jaccard_similarity"], level = 1)
+    return comparison
 
 
 # ------------------------------- Practical Measurement ------------------------------- #
@@ -0,0 +1,432 @@
+import os
+import math
+import hashlib
+import ephem
+import numpy as np
+from scipy.spatial import cKDTree
+from scipy.sparse import csr_matrix
+from sgp4.api import Satrec, SatrecArray, WGS72
+from utils import *
+
+## Batched constellation propagation ##
+# Satellite positions are propagated with SGP4 for all satellites (and many time points) at once,
+# and kept as (N, 3) ECEF arrays in meters, so that the graph builders only do array operations per time step.
+
+# ephem.Date counts days from 1899/12/31 12:00 UT (Dublin Julian Date)
+DUBLIN_JULIAN_DATE_OFFSET = 2415020.0
+# SGP4 epochs count days from 1949/12/31 00:00 UT
+SGP4_EPOCH_JULIAN_DATE_OFFSET = 2433281.5
+
+# -------------------- TIME METHODS ----------------------#
+def date_strings_to_julian_dates(date_strings: list):
+    # input: ephem date strings, e.g. "2024/8/12 20:00:00"
+    # output: julian date split into (whole, fraction) arrays, as SGP4 expects
+    julian_dates = np.array([float(ephem.Date(date_string)) for date_string in date_strings]) + DUBLIN_JULIAN_DATE_OFFSET
+    jd = np.floor(julian_dates - 0.5) + 0.5
+    fr = julian_dates - jd
+    return jd, fr
+
+def get_simulation_time_points(time_start: ephem.Date, time_end: ephem.Date, time_step: int):
+    # input: start and end time, time step in seconds
+    # output: ephem date strings of all time points in [time_start, time_end)
+    time_points = list()
+    time_cursor = time_start
+    while time_cursor < time_end:
+        time_points.append(str(ephem.Date(time_cursor)))
+        time_cursor += time_step * ephem.second
+    return time_points
+
+def greenwich_mean_sidereal_time(jd: np.ndarray, fr: np.ndarray):
+    # IAU-82 GMST in radians, same formula as `gstime` in SGP4
+    tut1 = (jd - 2451545.0 + fr) / 36525.0
+    gmst_seconds = (-6.2e-6 * tut1 ** 3 + 0.093104 * tut1 ** 2
+                    + (876600.0 * 3600 + 8640184.812866) * tut1 + 67310.54841)
+    return np.mod(np.radians(gmst_seconds / 240.0), 2 * math.pi)
+
+# -------------------- COORDINATE METHODS ----------------------#
+# `geodetic_to_ecef` is in utils.py
+def ecef_to_geodetic(ecef: np.ndarray):
+    # input: ECEF coordinates in meters, shape = (..., 3)
+    # output: latitudes and longitudes in radians, altitudes in meters (same as ephem's sublat, sublong, elevation)
+    x, y, z = ecef[..., 0], ecef[..., 1], ecef[..., 2]
+    p = np.hypot(x, y)
+    lons = np.arctan2(y, x)
+    lats = np.arctan2(z, p * (1 - EARTH_ECCENTRICITY_SQUARED))
+    # a few fixed-point iterations are enough at LEO altitudes
+    for _ in range(4):
+        sin_lats = np.sin(lats)
+        prime_vertical_radius = EARTH_RADIUS / np.sqrt(1 - EARTH_ECCENTRICITY_SQUARED * sin_lats ** 2)
+        lats = np.arctan2(z + EARTH_ECCENTRICITY_SQUARED * prime_vertical_radius * sin_lats, p)
+    sin_lats = np.sin(lats)
+    prime_vertical_radius = EARTH_RADIUS / np.sqrt(1 - EARTH_ECCENTRICITY_SQUARED * sin_lats ** 2)
+    alts = p * np.cos(lats) + z * sin_lats - prime_vertical_radius * (1 - EARTH_ECCENTRICITY_SQUARED * sin_lats ** 2)
+    return lats, lons, alts
+
+# -------------------- TLE CATALOGUE METHODS ----------------------#
+# A catalogue holds the orbital elements of all satellites of a TLE file in a structured array, one row per satellite,
+# in the units `Satrec.sgp4init` takes; `inc` and `raan` are also kept in degrees, as the attributes of ephem bodies.
+# Catalogues compiled from a TLE file are cached next to it, keyed by the hash of the file content.
+SATELLITE_CATALOGUE_DTYPE = np.dtype([
+    ("name", "U32"),
+    ("catalog_number", np.int64),
+    ("epoch", np.float64), # days since 1949/12/31 00:00 UT
+    ("bstar", np.float64), # B* drag term
+    ("ndot", np.float64), # rad/min^2
+    ("nddot", np.float64), # rad/min^3
+    ("ecco", np.float64), # eccentricity
+    ("argpo", np.float64), # argument of perigee, rad
+    ("inclo", np.float64), # inclination, rad
+    ("mo", np.float64), # mean anomaly, rad
+    ("no_kozai", np.float64), # mean motion, rad/min
+    ("nodeo", np.float64), # right ascension of ascending node, rad
+    ("inc", np.float64), # inclination, degrees
+    ("raan", np.float64) # right ascension of ascending node, degrees
+])
+
+def parse_satellite_tles(tles_lines: list):
+    # Parse the lines of a 3-line TLE file (name, line 1, line 2 of each satellite) into a catalogue
+    tles_lines = [line.strip() for line in tles_lines if len(line.strip()) > 0]
+    satrecs, names = list(), list()
+    for i in range(0, len(tles_lines) - 2, 3):
+        names.append(tles_lines[i])
+        satrecs.append(Satrec.twoline2rv(tles_lines[i + 1], tles_lines[i + 2], WGS72))
+    catalogue = np.zeros(len(satrecs), dtype = SATELLITE_CATALOGUE_DTYPE)
+    catalogue["name"] = names
+    for field in ["bstar", "ndot", "nddot", "ecco", "argpo", "inclo", "mo", "no_kozai", "nodeo"]:
+        catalogue[field] = [getattr(satrec, field) for satrec in satrecs]
+    catalogue["catalog_number"] = [satrec.satnum for satrec in satrecs]
+    catalogue["epoch"] = [satrec.jdsatepoch + satrec.jdsatepochF - SGP4_EPOCH_JULIAN_DATE_OFFSET for satrec in satrecs]
+    catalogue["inc"] = np.degrees(catalogue["inclo"])
+    catalogue["raan"] = np.degrees(catalogue["nodeo"])
+    return catalogue
+
+def read_satellite_catalogue(filename_tles: str):
+    # Read the catalogue of a TLE file, from its cache if the file content has not changed
+    with open(filename_tles, 'rb') as f:
+        tles_content = f.read()
+    tles_hash = hashlib.sha256(tles_content).hexdigest()[:16]
+    filename_catalogue = filename_tles + "." + tles_hash + ".catalogue.npy"
+    if os.path.exists(filename_catalogue):
+        catalogue = np.load(filename_catalogue, mmap_mode = 'r')
+    else:
+        catalogue = parse_satellite_tles(tles_content.decode().splitlines())
+        try:
+            np.save(filename_catalogue, catalogue)
+        except OSError:
+            verbose_print("Cannot cache the satellite catalogue to", filename_catalogue, level = 2)
+    verbose_print("Read", len(catalogue), "satellites.", level = 1)
+    return catalogue
+
+def catalogue_to_satrecs(catalogue: np.ndarray):
+    # Build the SGP4 records of all satellites of a catalogue
+    satrecs = list()
+    for satellite in catalogue:
+        satrec = Satrec()
+        satrec.sgp4init(WGS72, 'i', int(satellite["catalog_number"]), satellite["epoch"], satellite["bstar"], satellite["ndot"], satellite["nddot"],
+                        satellite["ecco"], satellite["argpo"], satellite["inclo"], satellite["mo"], satellite["no_kozai"], satellite["nodeo"])
+        satrecs.append(satrec)
+    return SatrecArray(satrecs)
+
+# -------------------- PROPAGATION METHODS ----------------------#
+def group_values_by_tolerance(values: np.ndarray, tolerance: float):
+    # Greedily group values: a group starts at its smallest value and takes every value within `tolerance` of it
+    # output: group id of each value
+    group_ids = np.empty(len(values), dtype = int)
+    group_id = -1
+    group_anchor = -np.inf
+    for value_index in np.argsort(values, kind = "stable"):
+        if values[value_index] - group_anchor > tolerance:
+            group_id += 1
+            group_anchor = values[value_index]
+        group_ids[value_index] = group_id
+    return group_ids
+
+def group_satellites_into_orbital_planes(incs: np.ndarray, raans: np.ndarray, tolerance: dict = {"inc": 0.1, "raan": 2}):
+    # Group satellites into orbital planes by `Inclination (°)` and `Right Ascension of ascending node (°)`
+    # same empirical tolerance as `get_if_satellite_same_orbit`
+    # output: orbital plane id of each satellite
+    planes = np.empty(len(incs), dtype = int)
+    plane_num = 0
+    inc_group_ids = group_values_by_tolerance(incs, tolerance["inc"])
+    for inc_group_id in np.unique(inc_group_ids):
+        members = np.flatnonzero(inc_group_ids == inc_group_id)
+        raan_group_ids = group_values_by_tolerance(raans[members], tolerance["raan"])
+        # RAAN wraps around at 360°, merge the last group into the first one if they are close
+        if raan_group_ids.max() > 0 and np.min(raans[members]) + 360 - np.max(raans[members][raan_group_ids == raan_group_ids.max()]) <= tolerance["raan"]:
+            raan_group_ids[raan_group_ids == raan_group_ids.max()] = 0
+        planes[members] = plane_num + raan_group_ids
+        plane_num += raan_group_ids.max() + 1
+    return planes
+
+def build_constellation(satellites):
+    # input: a satellite catalogue as read by `read_satellite_catalogue`, or the lines of a 3-line TLE file
+    # output: a constellation dict holding everything needed for batched propagation
+    catalogue = satellites if isinstance(satellites, np.ndarray) else parse_satellite_tles(satellites)
+    constellation = {
+        "names": ["s_" + name for name in catalogue["name"].tolist()],
+        "catalogue": catalogue,
+        "satrecs": catalogue_to_satrecs(catalogue),
+        "inc": np.array(catalogue["inc"], dtype = np.float64), # in degrees
+        "raan": np.array(catalogue["raan"], dtype = np.float64), # in degrees
+        "planes": group_satellites_into_orbital_planes(np.array(catalogue["inc"]), np.array(catalogue["raan"])), # orbital plane id of each satellite
+        "positions": dict(), # date string -> satellite positions at that time, see `get_constellation_positions_at_time_t`
+        "schedule": {"time_points": list(), "indices": dict()} # time points to be asked for, see `schedule_constellation_positions`
+    }
+    verbose_print("Built constellation of", len(constellation["names"]), "satellites in", len(np.unique(constellation["planes"])), "orbital planes.", level = 1)
+    return constellation
+
+def get_constellation_satrecs(constellation: dict):
+    # SGP4 records cannot be pickled: a constellation sent to another process without them rebuilds them from its catalogue
+    if "satrecs" not in constellation:
+        constellation["satrecs"] = catalogue_to_satrecs(constellation["catalogue"])
+    return constellation["satrecs"]
+
+def propagate_constellation(constellation: dict, date_strings: list):
+    # Propagate all satellites at all time points in one SGP4 call
+    # output: ECEF positions in meters, shape = (time points, satellites, 3), NaN where SGP4 fails
+    jd, fr = date_strings_to_julian_dates(date_strings)
+    errors, teme_positions, _ = get_constellation_satrecs(constellation).sgp4(jd, fr) # teme_positions in km, shape = (satellites, time points, 3)
+    teme_positions = np.transpose(teme_positions, (1, 0, 2)) * 1000
+    teme_positions[np.transpose(errors) != 0] = np.nan
+
+    # TEME -> ECEF, rotate by the Greenwich sidereal angle (polar motion ignored)
+    gmst = greenwich_mean_sidereal_time(jd, fr)[:, np.newaxis]
+    cos_gmst, sin_gmst = np.cos(gmst), np.sin(gmst)
+    ecef_positions = np.empty_like(teme_positions)
+    ecef_positions[..., 0] = cos_gmst * teme_positions[..., 0] + sin_gmst * teme_positions[..., 1]
+    ecef_positions[..., 1] = -sin_gmst * teme_positions[..., 0] + cos_gmst * teme_positions[..., 1]
+    ecef_positions[..., 2] = teme_positions[..., 2]
+    return ecef_positions
+
+# Time points propagated by one SGP4 call, bounds the (time points, satellites, 3) temporaries of the propagation
+POSITION_CHUNK_SIZE = 60
+
+def precompute_constellation_positions(constellation: dict, date_strings: list):
+    # Propagate and cache the satellite positions of many time points, POSITION_CHUNK_SIZE time points at once
+    date_strings = [date_string for date_string in date_strings if date_string not in constellation["positions"]]
+    for chunk_start in range(0, len(date_strings), POSITION_CHUNK_SIZE):
+        cache_constellation_positions(constellation, date_strings[chunk_start:chunk_start + POSITION_CHUNK_SIZE])
+
+def cache_constellation_positions(constellation: dict, date_strings: list):
+    ecef_positions = propagate_constellation(constellation, date_strings)
+    for date_string, ecef in zip(date_strings, ecef_positions):
+        valid = ~np.isnan(ecef).any(axis = 1)
+        lats, lons, alts = ecef_to_geodetic(ecef)
+        constellation["positions"][date_string] = {
+            "time": date_string,
+            "names": constellation["names"],
+            "inc": constellation["inc"],
+            "raan": constellation["raan"],
+            "planes": constellation["planes"],
+            "ecef": ecef, # in meters, shape = (satellites, 3)
+            "valid": valid, # False where the position cannot be computed
+            "lat": lats, # in radians
+            "lon": lons, # in radians
+            "alt": alts # in meters
+        }
+        if not valid.all():
+            verbose_print("Cannot compute the position of", int(np.sum(~valid)), "satellites at", date_string, level = 2)
+    verbose_print("Propagated", len(constellation["names"]), "satellites at", len(date_strings), "time points.", level = 0)
+
+def schedule_constellation_positions(constellation: dict, date_strings: list):
+    # Set the time points that will be asked for, in order: positions are then propagated lazily,
+    # a missing scheduled time point is propagated together with the next POSITION_CHUNK_SIZE - 1 scheduled ones
+    constellation["schedule"] = {
+        "time_points": list(date_strings),
+        "indices": {date_string: index for index, date_string in enumerate(date_strings)}
+    }
+
+def get_constellation_positions_at_time_t(constellation: dict, current_date_time_string: str):
+    # Get the (cached) positions of all satellites at a time point
+    if current_date_time_string not in constellation["positions"]:
+        schedule = constellation["schedule"]
+        if current_date_time_string in schedule["indices"]:
+            schedule_index = schedule["indices"][current_date_time_string]
+            precompute_constellation_positions(constellation, schedule["time_points"][schedule_index:schedule_index + POSITION_CHUNK_SIZE])
+        else:
+            precompute_constellation_positions(constellation, [current_date_time_string])
+    return constellation["positions"][current_date_time_string]
+
+def distance_between_ground_points_satellites(g_lats, g_lons, sat_positions: dict):
+    # input: ground latitudes and longitudes in degrees (K points), satellite positions at a time point
+    # output: distances in meters, shape = (K, satellites), inf for satellites without a valid position
+    distances = slant_range_distances(np.atleast_1d(g_lats), np.atleast_1d(g_lons), sat_positions["ecef"], pairwise = True)
+    distances[:, ~sat_positions["valid"]] = np.inf
+    return distances
+
+def distance_between_satellite_and_satellites(sat_index: int, sat_positions: dict):
+    # output: distances in meters from one satellite to all satellites, inf for satellites without a valid position
+    distances = np.linalg.norm(sat_positions["ecef"] - sat_positions["ecef"][sat_index], axis = 1)
+    distances[~sat_positions["valid"]] = np.inf
+    return distances
+
+# -------------------- VISIBILITY METHODS ----------------------#
+# Keys of the per time point caches added to the positions of a time point
+TIME_POINT_CACHE_KEYS = ["spatial_index", "inrange_satellites", "isl_topology"]
+
+def get_satellite_spatial_index(sat_positions: dict):
+    # KD-tree over the ECEF positions of the satellites with a valid position, built once per time point
+    # output: (KD-tree, satellite indices of the tree points)
+    if "spatial_index" not in sat_positions:
+        valid_sat_indices = np.flatnonzero(sat_positions["valid"])
+        sat_positions["spatial_index"] = (cKDTree(sat_positions["ecef"][valid_sat_indices].reshape(-1, 3)), valid_sat_indices)
+    return sat_positions["spatial_index"]
+
+def ground_points_find_inrange_satellites(g_lats, g_lons, sat_positions: dict, in_range: float):
+    # For K ground locations, find all satellites within `in_range` meters at a time point, in one batched query
+    # output: (point indices, satellite indices, distances in meters) of the in-range pairs,
+    #         sorted by point index, then by satellite index
+    ground_ecef = geodetic_to_ecef(np.atleast_1d(g_lats), np.atleast_1d(g_lons)).reshape(-1, 3)
+    kdtree, valid_sat_indices = get_satellite_spatial_index(sat_positions)
+    if len(ground_ecef) == 0 or len(valid_sat_indices) == 0:
+        return np.array([], dtype = int), np.array([], dtype = int), np.array([], dtype = np.float64)
+    neighbours = kdtree.query_ball_point(ground_ecef, r = in_range, return_sorted = True)
+    neighbour_counts = np.array([len(point_neighbours) for point_neighbours in neighbours], dtype = int)
+    point_indices = np.repeat(np.arange(len(ground_ecef)), neighbour_counts)
+    sat_indices = valid_sat_indices[np.concatenate(neighbours).astype(int)] if len(point_indices) > 0 else np.array([], dtype = int)
+    distances = np.linalg.norm(ground_ecef[point_indices] - sat_positions["ecef"][sat_indices], axis = 1)
+    return point_indices, sat_indices, distances
+
+def get_cached_inrange_satellites(g_lats, g_lons, sat_positions: dict, in_range: float):
+    # `ground_points_find_inrange_satellites`, kept with the positions of the time point,
+    # so that all the simulations of a time point (circuit groups, sweep configurations) share it
+    g_lats = np.atleast_1d(np.asarray(g_lats, dtype = np.float64))
+    g_lons = np.atleast_1d(np.asarray(g_lons, dtype = np.float64))
+    key = (g_lats.tobytes(), g_lons.tobytes(), in_range)
+    inrange_satellites = sat_positions.setdefault("inrange_satellites", dict())
+    if key not in inrange_satellites:
+        inrange_satellites[key] = ground_points_find_inrange_satellites(g_lats, g_lons, sat_positions, in_range)
+    return inrange_satellites[key]
+
+def release_time_point_caches(constellation: dict, current_date_time_string: str, if_release_positions: bool = False):
+    # Drop the spatial index, visibility and ISL caches of a time point, and, if asked, its positions
+    if if_release_positions:
+        constellation["positions"].pop(current_date_time_string, None)
+        return
+    sat_positions = constellation["positions"].get(current_date_time_string, dict())
+    for cache_key in TIME_POINT_CACHE_KEYS:
+        sat_positions.pop(cache_key, None)
+
+def ground_points_visibility_time_series(g_lats, g_lons, constellation: dict, date_strings: list, in_range: float, if_return_visible_satellites: bool = False):
+    # For K ground locations and T time points, count the satellites within `in_range` meters, reusing the cached positions
+    # output: counts, shape = (K, T), and, if asked, one sparse (K, satellites) matrix per time point
+    #         holding the distances in meters of the visible satellites (CSR, satellite indices sorted in each row)
+    # positions not cached before are propagated by chunks, and released once counted
+    uncached_date_strings = set(date_strings) - set(constellation["positions"])
+    ground_ecef = geodetic_to_ecef(np.atleast_1d(g_lats), np.atleast_1d(g_lons)).reshape(-1, 3)
+    sat_num = len(constellation["names"])
+    counts = np.zeros((len(ground_ecef), len(date_strings)), dtype = int)
+    visible_satellites = list()
+    for t, date_string in enumerate(date_strings):
+        if t % POSITION_CHUNK_SIZE == 0:
+            precompute_constellation_positions(constellation, date_strings[t:t + POSITION_CHUNK_SIZE])
+        sat_positions = get_constellation_positions_at_time_t(constellation, date_string)
+        if if_return_visible_satellites:
+            point_indices, sat_indices, distances = ground_points_find_inrange_satellites(g_lats, g_lons, sat_positions, in_range)
+            counts[:, t] = np.bincount(point_indices, minlength = len(ground_ecef))
+            indptr = np.concatenate([[0], np.cumsum(counts[:, t])])
+            visible_satellites.append(csr_matrix((distances, sat_indices, indptr), shape = (len(ground_ecef), sat_num)))
+        else:
+            kdtree, valid_sat_indices = get_satellite_spatial_index(sat_positions)
+            if len(ground_ecef) > 0 and len(valid_sat_indices) > 0:
+                counts[:, t] = kdtree.query_ball_point(ground_ecef, r = in_range, return_length = True)
+        if date_string in uncached_date_strings:
+            release_time_point_caches(constellation, date_string, if_release_positions = True)
+    if if_return_visible_satellites:
+        return counts, visible_satellites
+    return counts
+
+# -------------------- ISL TOPOLOGY METHODS ----------------------#
+# Number of nearest satellites first looked at when searching for cross-plane neighbours,
+# doubled for the satellites that do not find enough of them among their nearest satellites
+ISL_CROSS_PLANE_CANDIDATE_NUM = 16
+
+def get_cached_ISL_topology(sat_positions: dict, isl_interface_number: int, max_isl_distance: float):
+    # `get_ISL_topology`, kept with the positions of the time point as `get_cached_inrange_satellites`
+    isl_topologies = sat_positions.setdefault("isl_topology", dict())
+    if (isl_interface_number, max_isl_distance) not in isl_topologies:
+        isl_topologies[(isl_interface_number, max_isl_distance)] = get_ISL_topology(sat_positions, isl_interface_number, max_isl_distance)
+    return isl_topologies[(isl_interface_number, max_isl_distance)]
+
+def get_ISL_topology(sat_positions: dict, isl_interface_number: int, max_isl_distance: float):
+    # add ISL in this way:
+    # 1. connect to the 1-st nearest satellite in the same orbit
+    # 2. connect to the 1-st nearest satellite in the different orbit
+    # 3. connect to the 2-nd nearest satellite in the same orbit
+    # 4. ... until run out of ISL interfaces (or of satellites within `max_isl_distance`)
+    # isl_interface_number: None for no interface limit, every satellite within `max_isl_distance` is connected
+    # output: (source satellite indices, destination satellite indices, distances in meters)
+    sat_num = len(sat_positions["names"])
+    valid_sat_indices = np.flatnonzero(sat_positions["valid"])
+    ecef = sat_positions["ecef"]
+    planes = sat_positions["planes"]
+    kdtree, tree_sat_indices = get_satellite_spatial_index(sat_positions)
+    if isl_interface_number == None:
+        pairs = kdtree.query_pairs(max_isl_distance, output_type = "ndarray")
+        src_sat_indices = tree_sat_indices[np.concatenate([pairs[:, 0], pairs[:, 1]])]
+        dst_sat_indices = tree_sat_indices[np.concatenate([pairs[:, 1], pairs[:, 0]])]
+        order = np.lexsort((dst_sat_indices, src_sat_indices))
+        src_sat_indices, dst_sat_indices = src_sat_indices[order], dst_sat_indices[order]
+        return src_sat_indices, dst_sat_indices, np.linalg.norm(ecef[src_sat_indices] - ecef[dst_sat_indices], axis = 1)
+
+    # nearest satellites in the same orbital plane, from a KD-tree per plane
+    # shape = (satellites, isl_interface_number), padded with -1 / inf
+    same_plane_neighbours = np.full((sat_num, isl_interface_number), -1, dtype = int)
+    same_plane_distances = np.full((sat_num, isl_interface_number), np.inf)
+    for plane in np.unique(planes[valid_sat_indices]):
+        members = valid_sat_indices[planes[valid_sat_indices] == plane]
+        if len(members) < 2:
+            continue
+        k = min(len(members), isl_interface_number + 1)
+        distances, neighbour_positions = cKDTree(ecef[members]).query(ecef[members], k = k, distance_upper_bound = max_isl_distance)
+        # the first neighbour is the satellite itself
+        distances, neighbour_positions = distances[:, 1:], neighbour_positions[:, 1:]
+        found = np.isfinite(distances)
+        same_plane_neighbours[members, :k - 1] = np.where(found, members[np.minimum(neighbour_positions, len(members) - 1)], -1)
+        same_plane_distances[members, :k - 1] = distances
+
+    # alternate same / different plane: ceil(n/2) same-plane and floor(n/2) different-plane interfaces,
+    # and give the spare interfaces of one kind to the other one
+    same_available = np.sum(same_plane_neighbours >= 0, axis = 1)
+    same_wanted = (isl_interface_number + 1) // 2
+    different_wanted = isl_interface_number // 2
+    different_needed = different_wanted + np.maximum(0, same_wanted - same_available)
+
+    # nearest satellites in the other orbital planes, from the KD-tree of the time point
+    # in dense shells the nearest satellites are mostly in the same plane: a satellite without enough
+    # different-plane candidates looks at twice as many nearest satellites, until none is left within range
+    different_plane_neighbours = np.full((sat_num, isl_interface_number), -1, dtype = int)
+    different_plane_distances = np.full((sat_num, isl_interface_number), np.inf)
+    pending_sat_indices = valid_sat_indices[different_needed[valid_sat_indices] > 0]
+    k = ISL_CROSS_PLANE_CANDIDATE_NUM
+    while len(pending_sat_indices) > 0 and len(tree_sat_indices) > 1:
+        k = min(k, len(tree_sat_indices))
+        distances, neighbour_positions = kdtree.query(ecef[pending_sat_indices], k = k, distance_upper_bound = max_isl_distance)
+        found = np.isfinite(distances)
+        candidates = np.where(found, tree_sat_indices[np.minimum(neighbour_positions, len(tree_sat_indices) - 1)], -1)
+        is_different_plane = found & (planes[np.maximum(candidates, 0)] != planes[pending_sat_indices][:, np.newaxis])
+        # keep the nearest different-plane candidates, in distance order
+        order = np.argsort(~is_different_plane, axis = 1, kind = "stable")[:, :isl_interface_number]
+        selected_found = np.take_along_axis(is_different_plane, order, axis = 1)
+        selected_num = order.shape[1]
+        different_plane_neighbours[pending_sat_indices, :selected_num] = np.where(selected_found, np.take_along_axis(candidates, order, axis = 1), -1)
+        different_plane_distances[pending_sat_indices, :selected_num] = np.where(selected_found, np.take_along_axis(distances, order, axis = 1), np.inf)
+        # more satellites may be in range only if all k candidates were
+        if k == len(tree_sat_indices):
+            break
+        starved = (np.sum(is_different_plane, axis = 1) < different_needed[pending_sat_indices]) & found[:, -1]
+        pending_sat_indices = pending_sat_indices[starved]
+        k *= 2
+
+    different_available = np.sum(different_plane_neighbours >= 0, axis = 1)
+    same_taken = np.minimum(same_available, same_wanted + np.maximum(0, different_wanted - different_available))
+    different_taken = np.minimum(different_available, different_needed)
+    columns = np.arange(isl_interface_number)[np.newaxis, :]
+    same_mask = columns < same_taken[:, np.newaxis]
+    different_mask = columns < different_taken[:, np.newaxis]
+
+    src_sat_indices = np.concatenate([np.nonzero(same_mask)[0], np.nonzero(different_mask)[0]])
+    dst_sat_indices = np.concatenate([same_plane_neighbours[same_mask], different_plane_neighbours[different_mask]])
+    distances = np.concatenate([same_plane_distances[same_mask], different_plane_distances[different_mask]])
+    order = np.argsort(src_sat_indices, kind = "stable")
+    return src_sat_indices[order], dst_sat_indices[order], distances[order]
@@ -1,88 +1,455 @@
+import os
+import csv
+import bisect
+import atexit
+import asyncio
+import ipaddress
+import threading
+import heapq
 import traceback
+import collections
 
 from stem.descriptor.remote import DescriptorDownloader
 import xml.etree.ElementTree as ET
-from geopy.geocoders import Photon, Nominatim
+from geopy.geocoders import Photon
 import requests
 import json
 import time
-from utils import read_tor_circuits, read_geoip_dataset, verbose_print, renew_geoip_dataset
+from utils import read_tor_circuits, iterate_tor_circuits, read_geoip_dataset, verbose_print
+try:
+    import maxminddb
+except ImportError:
+    maxminddb = None
 
 ## Some tools to retrieve data from the internet, or parse data from downloaded files ##
 
-def try_request_api_for_coords(ip: str, sleep: int = 2):
-    # input: ip address
-    # output: latitude and longitude, if not found, return None, None
-    query_url = "http://ip-api.com/json/" + ip
-    geoip_response = requests.get(query_url)
-    # don't too fast
-    time.sleep(sleep)
+# -------------------- GEOIP STORE ----------------------#
+# The GeoIP dataset file is loaded once per process into a store dict with O(1) lookups.
+# New records go to an append-only journal next to the dataset (`<dataset>.journal`, one JSON record per line),
+# which is replayed when loading and compacted into the dataset every GEOIP_JOURNAL_COMPACT_SIZE records and on exit.
+GEOIP_JOURNAL_COMPACT_SIZE = 100
+GEOIP_STORES = dict()
+
+def get_geoip_store(filename_geoip_dataset: str):
+    # Get the store of a GeoIP dataset file, loading it on first use
+    filepath = os.path.abspath(filename_geoip_dataset)
+    if filepath not in GEOIP_STORES:
+        geoip_store = {
+            "filename": filename_geoip_dataset,
+            "journal_filename": filename_geoip_dataset + ".journal",
+            "records": read_geoip_dataset(filename_geoip_dataset) if os.path.exists(filename_geoip_dataset) else dict(),
+            "journal_size": 0,
+            "lock": threading.RLock() # records may be added by a background resolver thread
+        }
+        # records journaled by a process that did not compact them
+        if os.path.exists(geoip_store["journal_filename"]):
+            with open(geoip_store["journal_filename"], 'r') as journal_file:
+                for line in journal_file:
+                    try:
+                        new_record = json.loads(line)
+                    except ValueError:
+                        # a record cut by a crash
+                        continue
+                    geoip_store["records"][new_record["ip"]] = [new_record["lat"], new_record["lon"], new_record["address"], new_record["country_code"]]
+                    geoip_store["journal_size"] += 1
+        verbose_print("Loaded", len(geoip_store["records"]), "GeoIP records from", filename_geoip_dataset, level = 1)
+        GEOIP_STORES[filepath] = geoip_store
+    return GEOIP_STORES[filepath]
+
+def geoip_store_lookup(geoip_store: dict, ip: str):
+    # output: [lat, lon, address, country_code], None if the ip is not in the store
+    return geoip_store["records"].get(ip)
+
+def geoip_store_add(geoip_store: dict, new_record: dict):
+    # new record is like: { "ip": xxx, "lat": xxx, "lon": xxx, "address": xxx, "country_code":xxx }
+    with geoip_store["lock"]:
+        geoip_store["records"][new_record["ip"]] = [new_record["lat"], new_record["lon"], new_record["address"], new_record["country_code"]]
+        with open(geoip_store["journal_filename"], 'a') as journal_file:
+            journal_file.write(json.dumps(new_record) + '\n')
+        geoip_store["journal_size"] += 1
+        if geoip_store["journal_size"] >= GEOIP_JOURNAL_COMPACT_SIZE:
+            compact_geoip_store(geoip_store)
+
+def compact_geoip_store(geoip_store: dict):
+    # Write all records to the dataset file and empty the journal
+    with geoip_store["lock"]:
+        if geoip_store["journal_size"] == 0:
+            return
+        # replace the dataset atomically, so that it is never left half-written
+        with open(geoip_store["filename"] + ".tmp", 'w') as geo_dataset_file:
+            geo_dataset_file.write(json.dumps(geoip_store["records"]))
+        os.replace(geoip_store["filename"] + ".tmp", geoip_store["filename"])
+        os.remove(geoip_store["journal_filename"])
+        geoip_store["journal_size"] = 0
+    verbose_print("Saved", len(geoip_store["records"]), "GeoIP records to", geoip_store["filename"], level = 1)
+
+@atexit.register
+def flush_geoip_stores():
+    for geoip_store in GEOIP_STORES.values():
+        compact_geoip_store(geoip_store)
+
+# -------------------- OFFLINE GEOIP DATABASES ----------------------#
+# Local IP databases consulted, in the order they are added, for ips missing from the GeoIP dataset,
+# so that the web APIs are only requested for ips none of them knows.
+# - IP-range CSV files (e.g. DB-IP lite, IP2Location lite), indexed as sorted intervals searched by bisection
+# - MaxMind-style MMDB files, read with the optional `maxminddb` package
+# Offline results are not written to the GeoIP dataset, they can always be looked up again.
+GEOIP_OFFLINE_DATABASES = list()
+
+# Column positions of the IP-range CSV layouts, the address is joined from the `address` columns
+GEOIP_RANGE_CSV_LAYOUTS = {
+    # dbip-city-lite: ip_start, ip_end, continent, country, stateprov, city, latitude, longitude
+    "dbip": {"ip_start": 0, "ip_end": 1, "lat": 6, "lon": 7, "country_code": 3, "address": [5, 4, 3]},
+    # IP2LOCATION-LITE-DB5: ip_from, ip_to (as integers), country_code, country_name, region, city, latitude, longitude
+    "ip2location": {"ip_start": 0, "ip_end": 1, "lat": 6, "lon": 7, "country_code": 2, "address": [5, 4, 3]}
+}
+
+def parse_ip_address(ip: str):
+    # output: (ip version, ip as an integer), ip given as a string or a decimal integer string
+    ip = ip.strip()
+    if ip.isdigit():
+        ip_value = int(ip)
+        return (4 if ip_value < 2 ** 32 else 6), ip_value
+    ip_address = ipaddress.ip_address(ip)
+    return ip_address.version, int(ip_address)
+
+def load_geoip_range_csv_database(filename_geoip_database: str, layout: str = "dbip"):
+    # output: an offline database dict, per ip version: sorted range starts, range ends and [lat, lon, address, country_code] records
+    columns = GEOIP_RANGE_CSV_LAYOUTS[layout]
+    ranges = {4: list(), 6: list()}
+    with open(filename_geoip_database, 'r', newline = '', encoding = "utf-8", errors = "ignore") as database_file:
+        for row in csv.reader(database_file):
+            try:
+                version, ip_start = parse_ip_address(row[columns["ip_start"]])
+                _, ip_end = parse_ip_address(row[columns["ip_end"]])
+                lat, lon = float(row[columns["lat"]]), float(row[columns["lon"]])
+            except (ValueError, IndexError):
+                # header or malformed line
+                continue
+            address = ", ".join([row[column] for column in columns["address"] if row[column] not in ["", "-"]])
+            ranges[version].append((ip_start, ip_end, [lat, lon, address if address != "" else "unknown", row[columns["country_code"]].upper() or "unknown"]))
+    geoip_database = {"type": "range", "filename": filename_geoip_database}
+    for version, version_ranges in ranges.items():
+        version_ranges.sort(key = lambda ip_range: ip_range[0])
+        geoip_database[version] = {
+            "starts": [ip_range[0] for ip_range in version_ranges],
+            "ends": [ip_range[1] for ip_range in version_ranges],
+            "records": [ip_range[2] for ip_range in version_ranges]
+        }
+    verbose_print("Loaded", len(ranges[4]), "IPv4 and", len(ranges[6]), "IPv6 ranges from", filename_geoip_database, level = 1)
+    return geoip_database
+
+def load_geoip_mmdb_database(filename_geoip_database: str):
+    if maxminddb is None:
+        raise ImportError("Reading MMDB files requires the maxminddb package")
+    return {"type": "mmdb", "filename": filename_geoip_database, "reader": maxminddb.open_database(filename_geoip_database)}
+
+def add_geoip_offline_database(filename_geoip_database: str, layout: str = "dbip"):
+    # Add a local IP database, `.mmdb` files are read as MMDB, others as IP-range CSV of the given layout
+    if filename_geoip_database.endswith(".mmdb"):
+        GEOIP_OFFLINE_DATABASES.append(load_geoip_mmdb_database(filename_geoip_database))
+    else:
+        GEOIP_OFFLINE_DATABASES.append(load_geoip_range_csv_database(filename_geoip_database, layout))
+
+def geoip_offline_database_lookup(geoip_database: dict, ip: str):
+    # output: [lat, lon, address, country_code], None if the ip is not in the database
     try:
-        data = json.loads(geoip_response.text)
-        return data["lat"], data["lon"]
-    except:
-        return None, None
-
-def try_request_api_for_detail_address(lat: float, lon: float):
-    # input: latitude and longitude
-    # output: detail address and country code, if not found, return None
+        version, ip_value = parse_ip_address(ip)
+    except ValueError:
+        return None
+    if geoip_database["type"] == "mmdb":
+        data = geoip_database["reader"].get(ip)
+        if data is None or "location" not in data:
+            return None
+        names = [data.get(key, {}).get("names", {}).get("en", "") for key in ["city", "country"]]
+        address = ", ".join([name for name in names if name != ""])
+        return [data["location"]["latitude"], data["location"]["longitude"], address if address != "" else "unknown", data.get("country", {}).get("iso_code", "unknown")]
+    ranges = geoip_database[version]
+    position = bisect.bisect_right(ranges["starts"], ip_value) - 1
+    if position >= 0 and ip_value <= ranges["ends"][position]:
+        return ranges["records"][position]
+    return None
+
+def lookup_geo_location(geoip_store: dict, ip: str):
+    # Look an ip up in the GeoIP dataset, then in the offline databases
+    # output: [lat, lon, address, country_code], None if unknown locally
+    geoip_record = geoip_store_lookup(geoip_store, ip)
+    if geoip_record is not None:
+        return geoip_record
+    for geoip_database in GEOIP_OFFLINE_DATABASES:
+        geoip_record = geoip_offline_database_lookup(geoip_database, ip)
+        if geoip_record is not None:
+            return geoip_record
+    return None
+
+# -------------------- CONCURRENT GEOIP RESOLVER ----------------------#
+# Resolve many uncached ips at once: coordinates come from the ip-api batch endpoint, and are saved to the store
+# as soon as a batch returns; detail addresses are then filled from Nominatim reverse lookups, which may run in the background.
+# Each provider has a token bucket rate limiter shared by the process and a reused HTTP session per thread, failed requests are retried with exponential backoff.
+# URLs can be pointed to a local server for testing.
+GEOIP_PROVIDERS = {
+    "ip-api": {
+        "url": "http://ip-api.com/batch",
+        "batch_size": 100, # ips per request
+        "rate": 15 / 60, # requests per second, the batch endpoint allows 15 requests per minute
+        "burst": 1
+    },
+    "nominatim": {
+        "url": "https://nominatim.openstreetmap.org/reverse",
+        "rate": 1, # requests per second, as asked by the Nominatim usage policy
+        "burst": 1,
+        "user_agent": "measurements"
+    }
+}
+GEOIP_REQUEST_RETRIES = 3
+GEOIP_REQUEST_BACKOFF = 2 # seconds, doubled at every retry
+GEOIP_REQUEST_TIMEOUT = 10 # seconds
+
+# Token buckets of the providers, one per provider for the whole process, so that all threads and event loops
+# resolving at the same time share the rate of a provider
+GEOIP_RATE_LIMITERS = dict()
+GEOIP_RATE_LIMITERS_LOCK = threading.Lock()
+
+def get_geoip_rate_limiter(provider: str, provider_settings: dict):
+    with GEOIP_RATE_LIMITERS_LOCK:
+        key = (provider, provider_settings["url"])
+        if key not in GEOIP_RATE_LIMITERS:
+            GEOIP_RATE_LIMITERS[key] = {
+                "rate": provider_settings["rate"],
+                "burst": provider_settings["burst"],
+                "tokens": provider_settings["burst"],
+                "updated": time.monotonic(),
+                # a threading lock, only held to update the bucket, never while waiting
+                "lock": threading.Lock()
+            }
+        return GEOIP_RATE_LIMITERS[key]
+
+# HTTP sessions are not thread-safe: requests run in the threads of `asyncio.to_thread`, and each thread reuses its own session per provider
+GEOIP_SESSIONS = threading.local()
+
+def get_geoip_session(provider: str, provider_settings: dict):
+    if not hasattr(GEOIP_SESSIONS, "sessions"):
+        GEOIP_SESSIONS.sessions = dict()
+    key = (provider, provider_settings["url"])
+    if key not in GEOIP_SESSIONS.sessions:
+        session = requests.Session()
+        if "user_agent" in provider_settings:
+            session.headers["User-Agent"] = provider_settings["user_agent"]
+        GEOIP_SESSIONS.sessions[key] = session
+    return GEOIP_SESSIONS.sessions[key]
+
+def send_geoip_request(provider: str, provider_settings: dict, method: str, **kwargs):
+    # Run in a worker thread
+    return get_geoip_session(provider, provider_settings).request(method, provider_settings["url"], timeout = GEOIP_REQUEST_TIMEOUT, **kwargs)
+
+def get_geoip_resolver(geoip_store: dict, providers: dict = GEOIP_PROVIDERS):
+    # A resolver belongs to one event loop: create it inside the coroutine that uses it
+    resolver = {
+        "store": geoip_store,
+        "providers": providers,
+        "buckets": dict(),
+        "in_flight": dict() # ip -> future of its coordinates, so that an ip is requested once
+    }
+    for provider, provider_settings in providers.items():
+        resolver["buckets"][provider] = get_geoip_rate_limiter(provider, provider_settings)
+    return resolver
+
+async def acquire_rate_limit_token(bucket: dict):
+    # Wait until the token bucket has a token, and take it
+    while True:
+        with bucket["lock"]:
+            now = time.monotonic()
+            bucket["tokens"] = min(bucket["burst"], bucket["tokens"] + (now - bucket["updated"]) * bucket["rate"])
+            bucket["updated"] = now
+            if bucket["tokens"] >= 1:
+                bucket["tokens"] -= 1
+                return
+            waiting_seconds = (1 - bucket["tokens"]) / bucket["rate"]
+        await asyncio.sleep(waiting_seconds)
+
+async def request_geoip_provider(resolver: dict, provider: str, method: str, **kwargs):
+    # output: the decoded JSON response, None if all attempts failed
+    for attempt in range(GEOIP_REQUEST_RETRIES + 1):
+        await acquire_rate_limit_token(resolver["buckets"][provider])
+        try:
+            response = await asyncio.to_thread(send_geoip_request, provider, resolver["providers"][provider], method, **kwargs)
+            if response.status_code == 200:
+                return response.json()
+            verbose_print("Requesting", provider, "returns status", response.status_code, level = 2)
+        except (requests.RequestException, ValueError) as error:
+            verbose_print("Requesting", provider, "failed:", error, level = 2)
+        if attempt < GEOIP_REQUEST_RETRIES:
+            await asyncio.sleep(GEOIP_REQUEST_BACKOFF * 2 ** attempt)
+    verbose_print("Requesting", provider, "failed after", GEOIP_REQUEST_RETRIES + 1, "attempts.", level = 3)
+    return None
+
+async def request_coords_batch(resolver: dict, ips: list, on_coords = None):
+    # Request the coordinates of a batch of ips, save them and resolve their futures
     try:
-        # geolocator = Photon(user_agent = "measurements")
-        geolocator = Nominatim(user_agent = "measurements")
-        location = geolocator.reverse((lat, lon))
-        address = location.address
-        country_code = location.raw.get('address', {}).get('country_code').upper()
-    except:
-        traceback.print_exc()
-        address = None
-        country_code = None
-    return address, country_code
+        data = await request_geoip_provider(resolver, "ip-api", "POST", json = [{"query": ip, "fields": "status,query,lat,lon,countryCode"} for ip in ips])
+        coords = dict()
+        for ip_info in (data if isinstance(data, list) else []):
+            if ip_info.get("status") == "success" and ip_info.get("query") in resolver["in_flight"]:
+                coords[ip_info["query"]] = (ip_info["lat"], ip_info["lon"], ip_info.get("countryCode", "unknown"))
+        for ip in ips:
+            if ip in coords:
+                lat, lon, country_code = coords[ip]
+                # the detail address is filled later by `request_detail_address`
+                geoip_store_add(resolver["store"], new_record = {
+                    "ip": ip,
+                    "lat": lat,
+                    "lon": lon,
+                    "address": "unknown",
+                    "country_code": country_code
+                })
+                if on_coords is not None:
+                    on_coords(ip, lat, lon)
+                resolver["in_flight"].pop(ip).set_result((lat, lon))
+            else:
+                verbose_print("Requesting api for geo of ip", ip, "failed.", level = 3)
+                resolver["in_flight"].pop(ip).set_result(None)
+    finally:
+        # never leave a waiting caller hanging
+        for ip in ips:
+            if ip in resolver["in_flight"]:
+                resolver["in_flight"].pop(ip).set_result(None)
+
+async def resolve_ips_coords(resolver: dict, ips: list, on_coords = None):
+    # Get the coordinates of the ips that are not in the store, `on_coords(ip, lat, lon)` is called as each arrives
+    # output: the ips whose coordinates are newly resolved
+    loop = asyncio.get_running_loop()
+    waited_ips, new_ips = list(), list()
+    for ip in dict.fromkeys(ips):
+        if lookup_geo_location(resolver["store"], ip) is not None:
+            continue
+        if ip not in resolver["in_flight"]:
+            resolver["in_flight"][ip] = loop.create_future()
+            new_ips.append(ip)
+        waited_ips.append(ip)
+    waited_futures = [resolver["in_flight"][ip] for ip in waited_ips]
+    batch_size = resolver["providers"]["ip-api"]["batch_size"]
+    await asyncio.gather(*[request_coords_batch(resolver, new_ips[i: i + batch_size], on_coords) for i in range(0, len(new_ips), batch_size)])
+    coords = await asyncio.gather(*waited_futures)
+    return [ip for ip, ip_coords in zip(waited_ips, coords) if ip_coords is not None]
+
+async def request_detail_address(resolver: dict, ip: str):
+    lat, lon, address, country_code = geoip_store_lookup(resolver["store"], ip)
+    data = await request_geoip_provider(resolver, "nominatim", "GET", params = {"lat": lat, "lon": lon, "format": "jsonv2"})
+    if data is None or "display_name" not in data:
+        verbose_print("Requesting api for detail address falied.", level = 3)
+        return
+    geoip_store_add(resolver["store"], new_record = {
+        "ip": ip,
+        "lat": lat,
+        "lon": lon,
+        "address": data["display_name"],
+        "country_code": data.get("address", {}).get("country_code", country_code).upper()
+    })
+
+async def resolve_ips_detail_addresses(resolver: dict, ips: list):
+    # Fill the detail addresses of ips with coordinates but no address
+    await asyncio.gather(*[request_detail_address(resolver, ip) for ip in ips
+                           if geoip_store_lookup(resolver["store"], ip) is not None and geoip_store_lookup(resolver["store"], ip)[2] == "unknown"])
+
+# Detail addresses of `wait_for_addresses = False` calls are resolved by a single background worker thread,
+# started when there is work and stopped when there is none left, see `join_geoip_address_worker`
+GEOIP_ADDRESS_JOBS = collections.deque()
+GEOIP_ADDRESS_WORKER = None
+GEOIP_ADDRESS_WORKER_LOCK = threading.Lock()
+
+def submit_geoip_address_job(filename_geoip_dataset: str, ips: list, providers: dict):
+    global GEOIP_ADDRESS_WORKER
+    with GEOIP_ADDRESS_WORKER_LOCK:
+        GEOIP_ADDRESS_JOBS.append((filename_geoip_dataset, ips, providers))
+        if GEOIP_ADDRESS_WORKER is None:
+            # daemon thread: records are journaled one by one, so stopping at exit loses nothing already resolved
+            GEOIP_ADDRESS_WORKER = threading.Thread(target = run_geoip_address_worker, daemon = True)
+            GEOIP_ADDRESS_WORKER.start()
+
+def run_geoip_address_worker():
+    global GEOIP_ADDRESS_WORKER
+    while True:
+        with GEOIP_ADDRESS_WORKER_LOCK:
+            if len(GEOIP_ADDRESS_JOBS) == 0:
+                GEOIP_ADDRESS_WORKER = None
+                return
+            filename_geoip_dataset, ips, providers = GEOIP_ADDRESS_JOBS.popleft()
+        geoip_store = get_geoip_store(filename_geoip_dataset)
+        try:
+            asyncio.run(resolve_ips_detail_addresses(get_geoip_resolver(geoip_store, providers), ips))
+        except Exception:
+            traceback.print_exc()
+
+def join_geoip_address_worker():
+    # Wait until all background detail addresses are resolved, e.g., before forking worker processes,
+    # as forking a process while one of its threads holds a lock may deadlock the children
+    while True:
+        with GEOIP_ADDRESS_WORKER_LOCK:
+            geoip_address_worker = GEOIP_ADDRESS_WORKER
+        if geoip_address_worker is None:
+            return
+        verbose_print("Waiting for the background resolution of detail addresses", level = 1)
+        geoip_address_worker.join()
+
+def resolve_ips_geo_locations(ips: list, filename_geoip_dataset: str, on_coords = None, wait_for_addresses: bool = True, providers: dict = GEOIP_PROVIDERS):
+    # Resolve the geo-location of all uncached ips concurrently, and save them to the GeoIP dataset
+    # with `wait_for_addresses = False`, return once coordinates are resolved, detail addresses are filled by the background worker
+    # output: { ip: [lat, lon, address, country_code] } of the ips found (address may still be "unknown")
+    geoip_store = get_geoip_store(filename_geoip_dataset)
+
+    async def resolve_coords():
+        resolver = get_geoip_resolver(geoip_store, providers)
+        new_ips = await resolve_ips_coords(resolver, ips, on_coords)
+        if wait_for_addresses:
+            await resolve_ips_detail_addresses(resolver, new_ips)
+        return new_ips
+
+    new_ips = asyncio.run(resolve_coords())
+    verbose_print("Resolved the coordinates of", len(new_ips), "new ips.", level = 1)
+    if not wait_for_addresses and len(new_ips) > 0:
+        submit_geoip_address_job(filename_geoip_dataset, new_ips, providers)
+    return {ip: lookup_geo_location(geoip_store, ip) for ip in ips if lookup_geo_location(geoip_store, ip) is not None}
+
+def prefetch_geo_locations(ips: list, filename_geoip_dataset: str):
+    # Resolve all ips unknown locally at once, rather than one by one in `retrieve_relay_geo_location`
+    geoip_store = get_geoip_store(filename_geoip_dataset)
+    unknown_ips = [ip for ip in dict.fromkeys(ips) if lookup_geo_location(geoip_store, ip) is None]
+    if len(unknown_ips) > 0:
+        resolve_ips_geo_locations(unknown_ips, filename_geoip_dataset, wait_for_addresses = False)
+
+# -------------------- WEB APIS ----------------------#
+
+def try_request_api_for_coords(ip: str, providers: dict = GEOIP_PROVIDERS):
+    # input: ip address
+    # output: latitude and longitude, if not found, return None, None
+    # the request shares the ip-api rate limit with the resolver, the ip is not saved to any GeoIP dataset
+    async def request_coords():
+        resolver = get_geoip_resolver(None, providers)
+        return await request_geoip_provider(resolver, "ip-api", "POST", json = [{"query": ip, "fields": "status,lat,lon"}])
+
+    data = asyncio.run(request_coords())
+    if isinstance(data, list) and len(data) > 0 and data[0].get("status") == "success":
+        return data[0]["lat"], data[0]["lon"]
+    return None, None
 
 def retrieve_relay_geo_location(relay: list, ip: str, filename_geoip_dataset: str):
     # input: relays' info, ip address, filename of geoip dataset
     # output: relay info with geo-location, save new info to dataset file
     geo_relay = relay.copy()
     # try to search whether the ip is in current dataset
-    relay_geoip_dataset = read_geoip_dataset(filename_geoip_dataset)
-    if ip in relay_geoip_dataset.keys():
-        lat = relay_geoip_dataset[ip][0]
-        lon = relay_geoip_dataset[ip][1]
-        address = relay_geoip_dataset[ip][2]
-        country_code = relay_geoip_dataset[ip][3]
-        geo_relay += [lat, lon, address, country_code]
+    geoip_store = get_geoip_store(filename_geoip_dataset)
+    geoip_record = lookup_geo_location(geoip_store, ip)
     # if not, request web api for geo
-    else:
+    if geoip_record is None:
         verbose_print("Requesting api for geo of ip", ip, level = 1)
-        maybe_lat, maybe_lon = try_request_api_for_coords(ip, sleep = 2)
-        # request success
-        if maybe_lat != None and maybe_lon != None:
-            geo_relay += [maybe_lat, maybe_lon]
-            # request more information and save to dataset
-            address, country_code = try_request_api_for_detail_address(maybe_lat, maybe_lon)
-            if address != None and country_code != None:
-                geo_relay += [address, country_code]
-                # save new relay info to file
-                renew_geoip_dataset(filename_geoip_dataset, new_record = {
-                    "ip": ip,
-                    "lat": maybe_lat,
-                    "lon": maybe_lon,
-                    "address": address,
-                    "country_code": country_code
-                })
-            else:
-                verbose_print("Requesting api for detail address falied.", level = 3)
-                geo_relay += ["unknown", "unknown"]
-                renew_geoip_dataset(filename_geoip_dataset, new_record = {
-                    "ip": ip,
-                    "lat": maybe_lat,
-                    "lon": maybe_lon,
-                    "address": "unknown",
-                    "country_code": "unknown"
-                })
-        # request failed
-        else:
-            verbose_print("Requesting api falied. Lat and Lon are set to -1", level = 3)
-            geo_relay += [-1, -1, "unknown", "unknown"]
+        geoip_record = resolve_ips_geo_locations([ip], filename_geoip_dataset).get(ip)
+    if geoip_record is not None:
+        lat, lon, address, country_code = geoip_record
+        geo_relay += [lat, lon, address, country_code]
+    # request failed
+    else:
+        verbose_print("Requesting api falied. Lat and Lon are set to -1", level = 3)
+        geo_relay += [-1, -1, "unknown", "unknown"]
     return geo_relay
 
 def retrieve_circuit_geo_location(circuit, filename_geoip_dataset: str):
@@ -166,26 +533,35 @@ def extract_ground_stations_from_kml_file(filename_kml: str):
     verbose_print("Get", len(PoP_info_results), "PoPs.", level = 1)
     verbose_print("Get", len(gs_info_results), "ground stations.", level = 1)
     return PoP_info_results, gs_info_results
-def get_ting_pairs(filename_tor_circuits: list, num_limit: int = -1):
-    # input: filename of tor circuits, number of pairs to get
-    # output: the most frequent pairs of relays
+def get_ting_pairs(filename_tor_circuits: list, num_limit: int = -1, filename_relay_pairs: str = None):
+    # input: filenames of tor circuits, number of pairs to get, and optionally a file to write the pairs to
+    # output: the most frequent pairs of relays, as [("src_fp dst_fp", count)]
     # extract the pairs (actually hops) of relays (src, dst) in circuits
     # exclusively for Ting measurement input
-    pairs = dict()
-    def insert_pair(pair: list, pairs: dict):
-        for p in pairs.keys():
-            if pair[0] in p and pair[1] in p:
-                pairs[p] += 1
-                return
-        pairs[' '.join(pair)] = 1
+    # a pair is counted regardless of its direction, and named after the direction it is first seen in
+    pair_counts = collections.Counter()
+    pair_names = dict()
     for filename in filename_tor_circuits:
-        circuits = read_tor_circuits(filename)
-        for circuit in circuits:
+        # circuits are streamed, one circuit in memory at a time
+        for circuit in iterate_tor_circuits(filename):
             for i in range(len(circuit) - 1):
-                pair = [circuit[i][0], circuit[i + 1][0]]
-                insert_pair(pair, pairs)
-    sorted_pairs = sorted(pairs.items(), key = lambda x: x[1], reverse = True)
-    return sorted_pairs[:num_limit if num_limit != -1 else len(sorted_pairs)]
+                pair = (circuit[i][0], circuit[i + 1][0])
+                canonical_pair = pair if pair[0] <= pair[1] else (pair[1], pair[0])
+                if canonical_pair not in pair_names:
+                    pair_names[canonical_pair] = ' '.join(pair)
+                pair_counts[canonical_pair] += 1
+    if num_limit == -1:
+        top_pairs = sorted(pair_counts.items(), key = lambda x: x[1], reverse = True)
+    else:
+        # same order as a full sort, without sorting all pairs
+        top_pairs = heapq.nlargest(num_limit, pair_counts.items(), key = lambda x: x[1])
+    sorted_pairs = [(pair_names[canonical_pair], count) for canonical_pair, count in top_pairs]
+    if filename_relay_pairs is not None:
+        # the `relay_pairs` input of pure-ting/ting: one "src_fp dst_fp" per line
+        with open(filename_relay_pairs, 'w') as rp_f:
+            rp_f.write('\n'.join([pair_name for pair_name, _ in sorted_pairs]) + '\n')
+    verbose_print("Get", len(sorted_pairs), "Ting pairs out of", len(pair_counts), "relay pairs.", level = 1)
+    return sorted_pairs
 
 
 def get_add_client_or_server_info(add_info: list):
@@ -202,7 +578,7 @@ def get_add_client_or_server_info(add_info: list):
                 res[-1] = maybe_lon
                 if "city" not in info.keys():
                     # reversely get city name using lat, lon
-                    location = geolocator.reverse((lat, lon), exactly_one = True)
+                    location = geolocator.reverse((maybe_lat, maybe_lon), exactly_one = True)
                     if location:
                         address = location.raw.get('address', {})
                         city = address.get('city', None)
@@ -262,6 +638,7 @@ def circuit_add_client_or_server(circuits: list, add_info: list):
 
 def get_extend_circuits_with_geo_client_server(filename_tor_circuits: str, filename_geoip_dataset: str, add_info: list, circuits_range: list):
     raw_circuits = read_tor_circuits(filename_tor_circuits)
+    prefetch_geo_locations([relay_info[2] for circuit in raw_circuits[circuits_range[0]: circuits_range[1]] for relay_info in circuit], filename_geoip_dataset)
     geo_circuits = [retrieve_circuit_geo_location(circuit, filename_geoip_dataset) for circuit in raw_circuits[circuits_range[0]: circuits_range[1]]]
     extended_geo_circuits = circuit_add_client_or_server(geo_circuits, add_info)
     return extended_geo_circuits
@@ -0,0 +1,373 @@
+import os
+import ast
+import json
+import hashlib
+import numpy as np
+from utils import *
+try:
+    import orjson as fast_json
+except ImportError:
+    fast_json = json
+
+## Columnar simulation records ##
+# A simulation record is a directory:
+# - metadata.json: the simulation settings, as structured fields
+# - times.txt, hops.txt, nodes.txt: interned time points, hop ids and node names, one JSON string per line
+# - *.bin: raw little-endian columns, appended at every time point and memory-mapped when loading
+#   path level: time point id, hop id, first node position, node number, path latency and distance
+#   node level: node id, lat, lon of every node of every path
+#   segment level: latency and distance of every segment of every path
+# A path with `n` nodes has `n - 1` segments, so the first segment position of path `p` is `path_node_start[p] - p`.
+
+SIMULATION_RECORD_METADATA_FILENAME = "metadata.json"
+SIMULATION_RECORD_COLUMNS = {
+    "path_time": np.int32,
+    "path_hop": np.int32,
+    "path_node_start": np.int64,
+    "path_node_num": np.int32,
+    "path_latency": np.float32,
+    "path_distance": np.float32,
+    "node_id": np.int32,
+    "node_lat": np.float32,
+    "node_lon": np.float32,
+    "segment_latency": np.float32,
+    "segment_distance": np.float32
+}
+
+def is_columnar_simulation_record(sim_record_path: str):
+    return os.path.isdir(sim_record_path) and os.path.exists(os.path.join(sim_record_path, SIMULATION_RECORD_METADATA_FILENAME))
+
+def read_simulation_record_table(sim_record_path: str, table: str):
+    table_filepath = os.path.join(sim_record_path, table + ".txt")
+    if not os.path.exists(table_filepath):
+        return []
+    with open(table_filepath, 'r') as table_file:
+        return [json.loads(line) for line in table_file]
+
+def create_columnar_simulation_record(sim_record_path: str, metadata: dict):
+    # Create an empty record directory, or reopen an existing one to append more time points
+    # output: a writer dict for `append_columnar_simulation_record`
+    os.makedirs(sim_record_path, exist_ok = True)
+    metadata_filepath = os.path.join(sim_record_path, SIMULATION_RECORD_METADATA_FILENAME)
+    if not os.path.exists(metadata_filepath):
+        with open(metadata_filepath, 'w') as metadata_file:
+            metadata_file.write(json.dumps(metadata, indent = 2))
+    record_writer = {
+        "path": sim_record_path,
+        "time_num": len(read_simulation_record_table(sim_record_path, "times")),
+        "hop_index": {hop_id: index for index, hop_id in enumerate(read_simulation_record_table(sim_record_path, "hops"))},
+        "node_index": {node_name: index for index, node_name in enumerate(read_simulation_record_table(sim_record_path, "nodes"))}
+    }
+    # drop the columns of a time point that was not completely written
+    columns = load_simulation_record_columns(sim_record_path, record_writer["time_num"], mmap_mode = None)
+    for column, dtype in SIMULATION_RECORD_COLUMNS.items():
+        column_filepath = os.path.join(sim_record_path, column + ".bin")
+        if not os.path.exists(column_filepath) or os.path.getsize(column_filepath) != columns[column].nbytes:
+            columns[column].astype(dtype).tofile(column_filepath)
+    record_writer["path_num"] = len(columns["path_time"])
+    record_writer["node_num"] = len(columns["node_id"])
+    return record_writer
+
+def intern_simulation_record_names(record_writer: dict, table: str, names: list):
+    # Get the ids of names, appending unseen names to the table
+    name_index = record_writer[table[:-1] + "_index"]
+    new_names = list()
+    ids = list()
+    for name in names:
+        if name not in name_index:
+            name_index[name] = len(name_index)
+            new_names.append(name)
+        ids.append(name_index[name])
+    if len(new_names) > 0:
+        with open(os.path.join(record_writer["path"], table + ".txt"), 'a') as table_file:
+            table_file.write(''.join([json.dumps(name) + '\n' for name in new_names]))
+    return ids
+
+def append_columnar_simulation_record(record_writer: dict, simulation_results_time_t: dict):
+    # Append the results of one time point, as returned by `path_simulate_one_time_many_hops`
+    hop_ids = intern_simulation_record_names(record_writer, "hops", list(simulation_results_time_t["results"].keys()))
+    path_hops, paths = list(), list()
+    for hop_id, hop_paths in zip(hop_ids, simulation_results_time_t["results"].values()):
+        path_hops += [hop_id] * len(hop_paths)
+        paths += hop_paths
+    path_node_nums = np.array([len(path["path"]) for path in paths], dtype = np.int64)
+    columns = {
+        "path_time": np.full(len(paths), record_writer["time_num"]),
+        "path_hop": np.array(path_hops),
+        "path_node_start": record_writer["node_num"] + np.concatenate([[0], np.cumsum(path_node_nums)[:-1]]).astype(np.int64) if len(paths) > 0 else np.array([]),
+        "path_node_num": path_node_nums,
+        "path_latency": np.array([path["path_latency"] for path in paths], dtype = np.float64),
+        "path_distance": np.array([path["path_distance"] for path in paths], dtype = np.float64),
+        "node_id": np.array(intern_simulation_record_names(record_writer, "nodes", [node for path in paths for node in path["path"]])),
+        "node_lat": np.array([np.nan if lat is None else lat for path in paths for lat in path["lats"]], dtype = np.float64),
+        "node_lon": np.array([np.nan if lon is None else lon for path in paths for lon in path["lons"]], dtype = np.float64),
+        "segment_latency": np.array([latency for path in paths for latency in path["latencies"]], dtype = np.float64),
+        "segment_distance": np.array([distance for path in paths for distance in path["distances"]], dtype = np.float64)
+    }
+    for column, dtype in SIMULATION_RECORD_COLUMNS.items():
+        with open(os.path.join(record_writer["path"], column + ".bin"), 'ab') as column_file:
+            columns[column].astype(dtype).tofile(column_file)
+    # the time point is complete only once its time is written
+    with open(os.path.join(record_writer["path"], "times.txt"), 'a') as times_file:
+        times_file.write(json.dumps(simulation_results_time_t["time"]) + '\n')
+    record_writer["time_num"] += 1
+    record_writer["path_num"] += len(paths)
+    record_writer["node_num"] += int(np.sum(path_node_nums))
+
+def load_simulation_record_columns(sim_record_path: str, time_num: int, mmap_mode: str = 'r'):
+    # Memory-map the columns of a record, keeping only the time points listed in times.txt
+    columns = dict()
+    for column, dtype in SIMULATION_RECORD_COLUMNS.items():
+        column_filepath = os.path.join(sim_record_path, column + ".bin")
+        if not os.path.exists(column_filepath) or os.path.getsize(column_filepath) < np.dtype(dtype).itemsize:
+            columns[column] = np.array([], dtype = dtype)
+        elif mmap_mode is None:
+            columns[column] = np.fromfile(column_filepath, dtype = dtype)
+        else:
+            columns[column] = np.memmap(column_filepath, dtype = dtype, mode = mmap_mode)
+    path_num = int(np.searchsorted(columns["path_time"], time_num))
+    node_num = int(columns["path_node_start"][path_num - 1] + columns["path_node_num"][path_num - 1]) if path_num > 0 else 0
+    for column in columns.keys():
+        if column.startswith("path_"):
+            columns[column] = columns[column][:path_num]
+        elif column.startswith("node_"):
+            columns[column] = columns[column][:node_num]
+        else:
+            columns[column] = columns[column][:node_num - path_num]
+    return columns
+
+def load_columnar_simulation_record(sim_record_path: str):
+    # output: a record dict with metadata, the interned tables and the memory-mapped columns
+    with open(os.path.join(sim_record_path, SIMULATION_RECORD_METADATA_FILENAME), 'r') as metadata_file:
+        metadata = json.loads(metadata_file.read())
+    simulation_record = {
+        "metadata": metadata,
+        "times": read_simulation_record_table(sim_record_path, "times"),
+        "hops": read_simulation_record_table(sim_record_path, "hops"),
+        "nodes": read_simulation_record_table(sim_record_path, "nodes")
+    }
+    simulation_record["columns"] = load_simulation_record_columns(sim_record_path, len(simulation_record["times"]))
+    return simulation_record
+
+def get_columnar_simulation_record_time_point(simulation_record: dict, time_point_index: int):
+    # Rebuild one time point in the same format as a line of a text simulation record
+    columns = simulation_record["columns"]
+    nodes = simulation_record["nodes"]
+    path_start = int(np.searchsorted(columns["path_time"], time_point_index, side = "left"))
+    path_end = int(np.searchsorted(columns["path_time"], time_point_index, side = "right"))
+    results = {hop_id: [] for hop_id in simulation_record["hops"]}
+    for path_index in range(path_start, path_end):
+        node_start = int(columns["path_node_start"][path_index])
+        node_end = node_start + int(columns["path_node_num"][path_index])
+        segment_start = node_start - path_index
+        segment_end = node_end - path_index - 1
+        results[simulation_record["hops"][columns["path_hop"][path_index]]].append({
+            "path": [nodes[node_id] for node_id in columns["node_id"][node_start: node_end].tolist()],
+            "lats": columns["node_lat"][node_start: node_end].tolist(),
+            "lons": columns["node_lon"][node_start: node_end].tolist(),
+            "distances": columns["segment_distance"][segment_start: segment_end].tolist(),
+            "latencies": columns["segment_latency"][segment_start: segment_end].tolist(),
+            "path_distance": float(columns["path_distance"][path_index]),
+            "path_latency": float(columns["path_latency"][path_index])
+        })
+    return {
+        "time": simulation_record["times"][time_point_index],
+        "results": results
+    }
+
+def get_columnar_simulation_record_path_segment_sums(simulation_record: dict, node_flags: np.ndarray):
+    # Split the latency of every path into the segments touching a flagged node and the other segments
+    # input: a flag per interned node
+    # output: (flagged segment latency sums, other segment latency sums) per path
+    columns = simulation_record["columns"]
+    path_num = len(columns["path_time"])
+    segment_paths = np.repeat(np.arange(path_num), np.asarray(columns["path_node_num"], dtype = np.int64) - 1)
+    # the first node of segment `k` of path `p` is node `k + p`
+    segment_first_nodes = np.arange(len(segment_paths)) + segment_paths
+    node_ids = np.asarray(columns["node_id"])
+    segment_flags = node_flags[node_ids[segment_first_nodes]] | node_flags[node_ids[segment_first_nodes + 1]]
+    segment_latencies = np.asarray(columns["segment_latency"], dtype = np.float64)
+    flagged_sums = np.bincount(segment_paths, weights = np.where(segment_flags, segment_latencies, 0), minlength = path_num)
+    other_sums = np.bincount(segment_paths, weights = np.where(segment_flags, 0, segment_latencies), minlength = path_num)
+    return flagged_sums, other_sums
+
+## Text simulation records ##
+# A text simulation record is a few metadata lines followed by one JSON time point per line.
+# Time points are parsed one at a time, and a byte-offset index of the time point lines is kept
+# next to the record so that any time point can be read without scanning the file.
+
+SIMULATION_RECORD_INDEX_SUFFIX = ".index.npy"
+
+def is_simulation_record_time_point_line(line: bytes):
+    # metadata lines are free text, time point lines are JSON objects
+    return line.startswith(b'{')
+
+def parse_simulation_record_time_point(line: bytes):
+    try:
+        return fast_json.loads(line)
+    except ValueError:
+        pass
+    try:
+        # orjson rejects the Infinity / NaN that json.dumps may write
+        return json.loads(line)
+    except ValueError:
+        # records written by older versions may hold Python literals rather than JSON
+        return ast.literal_eval(line.decode(errors = "ignore"))
+
+def read_text_simulation_record_metadata(sim_record_filename: str):
+    # output: metadata lines of a text simulation record
+    metadata = list()
+    with open(sim_record_filename, 'rb') as sim_rf:
+        for line in sim_rf:
+            if is_simulation_record_time_point_line(line):
+                break
+            metadata.append(line.decode(errors = "ignore"))
+    return metadata
+
+def create_text_simulation_record(sim_record_filename: str, metadata_lines: list):
+    # Start a new text record with its metadata lines, dropping the offset index of a former record of the same name
+    if os.path.exists(sim_record_filename + SIMULATION_RECORD_INDEX_SUFFIX):
+        os.remove(sim_record_filename + SIMULATION_RECORD_INDEX_SUFFIX)
+    with open(sim_record_filename, 'w') as sim_record_file:
+        sim_record_file.write(''.join(metadata_lines))
+
+def get_simulation_record_fingerprint(sim_record_filename: str, offsets: list, indexed_size: int):
+    # Hash of the first and the last indexed time point lines (of the metadata lines if none), as an int64,
+    # a record written again under the same name has other lines there, or other offsets
+    with open(sim_record_filename, 'rb') as sim_rf:
+        if len(offsets) == 0:
+            content = sim_rf.read(indexed_size)
+        else:
+            sim_rf.seek(offsets[0])
+            content = sim_rf.readline()
+            sim_rf.seek(offsets[-1])
+            content += sim_rf.read(indexed_size - offsets[-1])
+    return int.from_bytes(hashlib.sha256(content).digest()[:8], "little", signed = True)
+
+def get_simulation_record_offset_index(sim_record_filename: str, if_return_indexed_size: bool = False):
+    # Byte offsets of the time point lines of a text simulation record, and, if asked, the size of its complete lines
+    # the index is saved as `<record>.index.npy`: the record fingerprint, the offsets, then the indexed file size,
+    # and only the bytes appended since then are scanned when the record has grown
+    index_filename = sim_record_filename + SIMULATION_RECORD_INDEX_SUFFIX
+    file_size = os.path.getsize(sim_record_filename)
+    offsets, indexed_size = [], 0
+    if os.path.exists(index_filename):
+        saved_index = np.load(index_filename)
+        # an index of another record of the same name is scanned again
+        if len(saved_index) > 1 and saved_index[-1] <= file_size and \
+           saved_index[0] == get_simulation_record_fingerprint(sim_record_filename, saved_index[1:-1].tolist(), int(saved_index[-1])):
+            offsets, indexed_size = saved_index[1:-1].tolist(), int(saved_index[-1])
+    if indexed_size < file_size:
+        with open(sim_record_filename, 'rb') as sim_rf:
+            sim_rf.seek(indexed_size)
+            position = indexed_size
+            for line in sim_rf:
+                # an incomplete last line is left for the next scan
+                if not line.endswith(b'\n'):
+                    break
+                if is_simulation_record_time_point_line(line):
+                    offsets.append(position)
+                position += len(line)
+            indexed_size = position
+        try:
+            fingerprint = get_simulation_record_fingerprint(sim_record_filename, offsets, indexed_size)
+            np.save(index_filename, np.array([fingerprint] + offsets + [indexed_size], dtype = np.int64))
+        except OSError:
+            verbose_print("Cannot save the offset index of", sim_record_filename, level = 2)
+    if if_return_indexed_size:
+        return np.array(offsets, dtype = np.int64), indexed_size
+    return np.array(offsets, dtype = np.int64)
+
+def read_text_simulation_record_time_point(sim_record_filename: str, time_point_index: int):
+    offsets = get_simulation_record_offset_index(sim_record_filename)
+    with open(sim_record_filename, 'rb') as sim_rf:
+        sim_rf.seek(offsets[time_point_index])
+        return parse_simulation_record_time_point(sim_rf.readline())
+
+def iterate_simulation_record_time_points(sim_record_filenames: list):
+    # Yield the time points of text or columnar simulation records one by one, in file order
+    for sim_record_filename in sim_record_filenames:
+        if is_columnar_simulation_record(sim_record_filename):
+            simulation_record = load_columnar_simulation_record(sim_record_filename)
+            for time_point_index in range(len(simulation_record["times"])):
+                yield get_columnar_simulation_record_time_point(simulation_record, time_point_index)
+            continue
+        with open(sim_record_filename, 'rb') as sim_rf:
+            for line in sim_rf:
+                if not is_simulation_record_time_point_line(line):
+                    continue
+                try:
+                    simulation_record_at_time_t = parse_simulation_record_time_point(line)
+                except (ValueError, SyntaxError):
+                    verbose_print("Simulation record fails to load. Record content is", line[:200], level = 3)
+                    continue
+                yield simulation_record_at_time_t
+
+## Simulation checkpoints ##
+# A run of run_simulation.py is split into units, one per (circuit group, time point).
+# Its manifest, next to the records, holds the run settings, the seed and the completed units.
+# Every unit reseeds the sampling from (seed, group, time point), so the seed is all the random state a resumed run needs.
+# Records are appended before their unit is marked completed, a resumed run truncates them back to the completed units.
+
+def get_simulation_run_key(settings: dict):
+    # Deterministic id of a run, from the settings that change its results
+    return hashlib.sha256(json.dumps(settings, sort_keys = True).encode()).hexdigest()[:12]
+
+def get_simulation_manifest_filename(sim_result_filedir: str, run_key: str):
+    return os.path.join(sim_result_filedir, "sim_" + run_key + "_manifest.json")
+
+def read_simulation_manifest(manifest_filename: str):
+    # output: the manifest dict, None if the run has no manifest yet
+    if not os.path.exists(manifest_filename):
+        return None
+    with open(manifest_filename, 'r') as manifest_file:
+        return json.loads(manifest_file.read())
+
+def write_simulation_manifest(manifest_filename: str, manifest: dict):
+    # replace the manifest atomically, so that it is never left half-written
+    with open(manifest_filename + ".tmp", 'w') as manifest_file:
+        manifest_file.write(json.dumps(manifest, indent = 2))
+    os.replace(manifest_filename + ".tmp", manifest_filename)
+
+def mark_simulation_unit_completed(manifest_filename: str, manifest: dict, group_index: int, t_index: int):
+    manifest["completed"].setdefault(str(group_index), []).append(t_index)
+    write_simulation_manifest(manifest_filename, manifest)
+
+def get_simulation_completed_time_num(manifest: dict, group_index: int):
+    # Number of time points completed from the first one on, for a circuit group
+    completed_t_indices = set(manifest["completed"].get(str(group_index), []))
+    completed_time_num = 0
+    while completed_time_num in completed_t_indices:
+        completed_time_num += 1
+    return completed_time_num
+
+def get_simulation_record_time_num(sim_record_path: str):
+    # Number of complete time points in a text or columnar simulation record
+    if is_columnar_simulation_record(sim_record_path):
+        return len(read_simulation_record_table(sim_record_path, "times"))
+    if not os.path.exists(sim_record_path):
+        return 0
+    return len(get_simulation_record_offset_index(sim_record_path))
+
+def truncate_simulation_record(sim_record_path: str, time_num: int):
+    # Keep the first `time_num` time points of a text or columnar simulation record, and drop anything after them
+    if is_columnar_simulation_record(sim_record_path):
+        times = read_simulation_record_table(sim_record_path, "times")
+        if len(times) > time_num:
+            with open(os.path.join(sim_record_path, "times.txt.tmp"), 'w') as times_file:
+                times_file.write(''.join([json.dumps(time_point) + '\n' for time_point in times[:time_num]]))
+            os.replace(os.path.join(sim_record_path, "times.txt.tmp"), os.path.join(sim_record_path, "times.txt"))
+        # reopening drops the columns of the time points not in times.txt
+        create_columnar_simulation_record(sim_record_path, dict())
+        return
+    if not os.path.exists(sim_record_path):
+        return
+    offsets, indexed_size = get_simulation_record_offset_index(sim_record_path, if_return_indexed_size = True)
+    truncated_size = int(offsets[time_num]) if time_num < len(offsets) else indexed_size
+    if truncated_size < os.path.getsize(sim_record_path):
+        verbose_print("Truncate", sim_record_path, "to", min(time_num, len(offsets)), "time points", level = 1)
+        with open(sim_record_path, 'r+b') as sim_rf:
+            sim_rf.truncate(truncated_size)
+        # the offset index may cover the removed lines
+        if os.path.exists(sim_record_path + SIMULATION_RECORD_INDEX_SUFFIX):
+            os.remove(sim_record_path + SIMULATION_RECORD_INDEX_SUFFIX)
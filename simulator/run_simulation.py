@@ -1,12 +1,331 @@
 from simulation import *
 from analyses import *
+import math
 import argparse
+import itertools
+import multiprocessing
 
 CITIES = ["Berlin", "Moscow", "Los Angeles", "Sydney", "Tehran", "Jakarta", "Tokyo", "Rio de Janeiro"]
 CITIES_LATS = [52.5200, 55.7558, 34.0522, -33.8688, 35.6895, -6.2088, 35.6895, -22.9068]
 CITIES_LONS = [13.4050, 37.6176, -118.2437, 151.2093, 51.3890, 106.8456, 139.6917, -43.1729]
 CITIES_COUNTRY_CODES = ["DE", "RU", "US", "AU", "IR", "ID", "JP", "BR"]
 
+# Settings a sweep may vary, with their allowed values (None if any value is allowed)
+SWEEP_PARAMETERS = {
+    "routing_strategy": ["single-bent-pipe", "ISL-enabled"],
+    "gs_satellite_link_mode": ["all-visible", "closest-only"],
+    "satellite_speed_samples": None,
+    "terrestrial_speed_samples": None,
+    "dataset": ["snapshot", "timespanning"],
+    "max_path_limit": None,
+    "terrestrial_latency_mode": TERRESTRIAL_LATENCY_MODES,
+    "graph_backend": ["networkx", "csgraph"]
+}
+
+# Read-only inputs of all simulation tasks, set once per worker process by `init_simulation_worker`
+SIMULATION_SHARED_INPUTS = None
+# Temporal topology of every (run, circuit group) simulated by this worker process, with `--temporal_topology`
+# tasks are blocks of consecutive time points, so that a topology is carried over consecutive time points
+SIMULATION_TEMPORAL_TOPOLOGIES = dict()
+
+def init_simulation_worker(shared_inputs: dict):
+    # Pool initializer: workers get the shared inputs once (inherited when forked), not with every task
+    global SIMULATION_SHARED_INPUTS
+    SIMULATION_SHARED_INPUTS = shared_inputs
+
+def simulate_time_points(task: tuple):
+    # Simulate a circuit group of a run (sweep configuration) at a block of consecutive time points, see `get_simulation_tasks`
+    # input: (run index, circuit group index, [(time point index, time point)])
+    # output: (run index, circuit group index, [(time point index, simulation results at the time point, elapsed seconds)])
+    run_index, group_index, time_point_tasks = task
+    release_simulated_time_points(time_point_tasks[0][0])
+    return run_index, group_index, [(t_index, *simulate_one_time_point(run_index, group_index, t_index, time_point)) for t_index, time_point in time_point_tasks]
+
+def release_simulated_time_points(t_index: int):
+    # The tasks of a worker come in time order: the positions and caches of the time points before the block of a task are not needed anymore,
+    # those of the block are kept, so that the other runs and groups of the block the worker gets reuse them
+    constellation = SIMULATION_SHARED_INPUTS["constellation"]
+    block_start = t_index - t_index % SIMULATION_SHARED_INPUTS["time_block_size"]
+    for date_string in list(constellation["positions"].keys()):
+        if constellation["schedule"]["indices"].get(date_string, -1) < block_start:
+            release_time_point_caches(constellation, date_string, if_release_positions = True)
+
+def simulate_one_time_point(run_index: int, group_index: int, t_index: int, time_point: str):
+    # Simulate a circuit group of a run at a time point
+    # tasks of a time point running in the same worker share its satellite positions, visibility and ISL topology
+    # output: (simulation results at the time point, elapsed seconds)
+    shared_inputs = SIMULATION_SHARED_INPUTS
+    run = shared_inputs["runs"][run_index]
+    # every (group, time point) of a run has its own random stream, whichever worker runs it
+    set_sampling_seed([run["seed"], group_index, t_index])
+    verbose_print("Simulating the", t_index, "th time point of circuit group", group_index, "of run", run_index, ", time is", time_point, level = 1)
+    time_point_start = time.time()
+    temporal_topology = None
+    if shared_inputs["temporal_topology"]:
+        temporal_topology = SIMULATION_TEMPORAL_TOPOLOGIES.setdefault((run_index, group_index), create_temporal_topology())
+    simulation_results_time_t = path_simulate_one_time_many_hops(hops = run["hops"][group_index],
+                                                                 constellation = shared_inputs["constellation"],
+                                                                 ground_stations = shared_inputs["ground_stations"],
+                                                                 point_of_presences = shared_inputs["point_of_presences"],
+                                                                 current_date_time_string = time_point,
+                                                                 link_connectivity = run["link_connectivity"],
+                                                                 gs_satellite_link_mode = run["gs_satellite_link_mode"],
+                                                                 sat_ecdf = run["sat_ecdf"],
+                                                                 ter_ecdf = run["ter_ecdf"],
+                                                                 max_path_limit = run["max_path_limit"],
+                                                                 graph_backend = run["graph_backend"],
+                                                                 terrestrial_edge_cache = run["terrestrial_edge_cache"],
+                                                                 temporal_topology = temporal_topology)
+    return simulation_results_time_t, time.time() - time_point_start
+
+def get_simulation_tasks(runs: list, time_points: list, time_block_size: int):
+    # One task per block of `time_block_size` consecutive time points, circuit group and run, with the time points the run misses,
+    # blocks in time order, so that runs and groups at the same time points are simulated together and can share a worker's caches
+    group_num = len(runs[0]["circuit_groups"])
+    simulation_tasks = list()
+    for block_start in range(0, len(time_points), time_block_size):
+        for group_index in range(group_num):
+            for run_index, run in enumerate(runs):
+                completed_time_num = run["circuit_groups"][group_index]["completed_time_num"]
+                time_point_tasks = [(t_index, time_points[t_index]) for t_index in range(max(block_start, completed_time_num), min(block_start + time_block_size, len(time_points)))]
+                if len(time_point_tasks) > 0:
+                    simulation_tasks.append((run_index, group_index, time_point_tasks))
+    return simulation_tasks
+
+def get_link_connectivity(routing_strategy: str):
+    # Link availability of a routing strategy
+    if routing_strategy == "single-bent-pipe":
+        return {
+            "SRC_DST_LINK": False,
+            "SRC_SAT_LINK": True,
+            "SAT_SAT_LINK": False,
+            "SAT_GS_LINK": True,
+            "GS_POP_LINK": True,
+            "GS_SAT_LINK": False,
+            "GS_DST_LINK": False,
+            "POP_DST_LINK": True
+        }
+    elif routing_strategy == "ISL-enabled":
+        return {
+            "SRC_DST_LINK": False,
+            "SRC_SAT_LINK": True,
+            "SAT_SAT_LINK": True,
+            "SAT_GS_LINK": True,
+            "GS_POP_LINK": True,
+            "GS_SAT_LINK": False,
+            "GS_DST_LINK": False,
+            "POP_DST_LINK": True
+        }
+    else:
+        raise ValueError("Unknown routing strategy")
+
+def read_speed_ecdf(speed_samples: str, default_speed_samples: str, default_speed: float):
+    # input: a JSON file of speed samples, or `default_speed_samples` for a single `default_speed`
+    if speed_samples != default_speed_samples:
+        with open(speed_samples, 'r') as f:
+            return get_speed_ECDF(json.load(f))
+    return get_speed_ECDF([default_speed])
+
+def read_sweep_grid(filename_sweep_grid: str, default_config: dict):
+    # input: grid spec, a JSON file of { parameter: [values] } over SWEEP_PARAMETERS
+    # output: a configuration per combination of values, in grid order, other parameters as in `default_config`
+    with open(filename_sweep_grid, 'r') as sweep_grid_file:
+        sweep_grid = json.load(sweep_grid_file)
+    for parameter, values in sweep_grid.items():
+        if parameter not in SWEEP_PARAMETERS:
+            raise ValueError("Unknown sweep parameter " + parameter + ", choose from " + str(list(SWEEP_PARAMETERS.keys())))
+        if not isinstance(values, list) or len(values) == 0:
+            raise ValueError("Sweep parameter " + parameter + " should have a non-empty list of values")
+        if SWEEP_PARAMETERS[parameter] is not None and any([value not in SWEEP_PARAMETERS[parameter] for value in values]):
+            raise ValueError("Values of sweep parameter " + parameter + " should be in " + str(SWEEP_PARAMETERS[parameter]))
+    configs = list()
+    for values in itertools.product(*sweep_grid.values()):
+        config = dict(default_config)
+        config.update(zip(sweep_grid.keys(), values))
+        configs.append(config)
+    return configs
+
+def prepare_simulation_run(config: dict, run_inputs: dict):
+    # Set up the records, the checkpoint manifest and the circuit groups of one configuration
+    # input: run_inputs, the inputs shared by all runs, see the main program
+    # output: a run dict, "worker_inputs" being what the simulation workers need
+    if config["routing_strategy"] is None:
+        raise ValueError("the following arguments are required: -rs/--routing_strategy")
+    routing_strategy = config["routing_strategy"]
+    gs_satellite_link_mode = config["gs_satellite_link_mode"]
+    dataset = config["dataset"]
+    link_connectivity = get_link_connectivity(routing_strategy)
+    satellite_speed_ecdf = read_speed_ecdf(config["satellite_speed_samples"], "lightspeed", LIGHT_SPEED)
+    terrestrial_speed_ecdf = read_speed_ecdf(config["terrestrial_speed_samples"], "fiberspeed", TERRESTRIAL_TRANS_SPEED)
+    filename_tor_circuits = run_inputs["filenames_tor_circuits"][dataset]
+    sim_result_filedir = run_inputs["sim_result_filedir"]
+    if_record_sim_result = run_inputs["if_record_sim_result"]
+    seed = config["seed"]
+
+    # Checkpoint: records are named after the settings changing the results, and the manifest of
+    # completed (circuit group, time point) units lets `--resume` continue an interrupted run
+    run_settings = {
+        "tles": run_inputs["filename_tles"],
+        "tor_circuits": filename_tor_circuits,
+        "geoip_dataset": run_inputs["filename_geoip_dataset"],
+        "geoip_database": config["geoip_database"],
+        "ground_stations": run_inputs["filename_ground_stations"],
+        "point_of_presences": run_inputs["filename_point_of_presences"],
+        "start_time": str(run_inputs["time_start"]),
+        "end_time": str(run_inputs["time_end"]),
+        "time_step": run_inputs["time_step"],
+        "circuit_range": list(run_inputs["circuit_range"]),
+        "circuit_group_size": run_inputs["circuit_group_size"],
+        "routing_strategy": routing_strategy,
+        "gs_satellite_link_mode": gs_satellite_link_mode,
+        "satellite_speed_samples": config["satellite_speed_samples"],
+        "terrestrial_speed_samples": config["terrestrial_speed_samples"],
+        "terrestrial_latency_mode": config["terrestrial_latency_mode"],
+        "max_path_limit": config["max_path_limit"],
+        # latencies are float32 with csgraph and float64 with networkx, a record must not mix both
+        "graph_backend": config["graph_backend"],
+        "record_format": config["record_format"]
+    }
+    run_key = get_simulation_run_key(run_settings)
+    manifest_filename = get_simulation_manifest_filename(sim_result_filedir, run_key)
+    manifest = read_simulation_manifest(manifest_filename) if if_record_sim_result else None
+    if manifest is not None and not config["resume"]:
+        raise ValueError("a run with these settings exists (" + manifest_filename + "), pass --resume to continue it, or remove its records")
+    if manifest is not None:
+        if seed is not None and seed != manifest["seed"]:
+            raise ValueError("the run to resume (" + manifest_filename + ") has seed " + str(manifest["seed"]))
+        seed = manifest["seed"]
+        verbose_print("Resume run", run_key, "with seed", seed, level = 1)
+    else:
+        if config["resume"]:
+            verbose_print("No run to resume in", manifest_filename, ", start a new one", level = 2)
+        if seed is None:
+            seed = int(np.random.SeedSequence().entropy % (2 ** 63))
+        manifest = {
+            "run_key": run_key,
+            "settings": run_settings,
+            "seed": seed,
+            "completed": dict()
+        }
+        if if_record_sim_result:
+            write_simulation_manifest(manifest_filename, manifest)
+
+    # Prepare circuit groups
+    circuit_range = run_inputs["circuit_range"]
+    circuit_group_size = run_inputs["circuit_group_size"]
+    circuit_groups = list()
+    for i in range(circuit_range[0], circuit_range[1], circuit_group_size):
+        group_index = len(circuit_groups)
+        circuit_group_range = (i, i + circuit_group_size)
+        record_file_name = ("sim_" + run_key +
+                            "_" + gs_satellite_link_mode +
+                            "_" + routing_strategy +
+                            "_" + dataset +
+                            "_" + str(circuit_group_range[0]) + "-" + str(circuit_group_range[1]) +
+                            (".txt" if config["record_format"] == "text" else ""))
+        tor_client_server_info = [
+            {
+                "role": "client",
+                "city": CITIES[i // circuit_group_size],
+                "lat": CITIES_LATS[i // circuit_group_size],
+                "lon": CITIES_LONS[i // circuit_group_size],
+                "country_code": CITIES_COUNTRY_CODES[i // circuit_group_size]
+            }
+        ]
+
+        # time points recorded and marked completed, anything recorded after them is dropped
+        completed_time_num = 0
+        if if_record_sim_result:
+            completed_time_num = min(get_simulation_completed_time_num(manifest, group_index),
+                                     get_simulation_record_time_num(sim_result_filedir + record_file_name))
+            truncate_simulation_record(sim_result_filedir + record_file_name, completed_time_num)
+            manifest["completed"][str(group_index)] = list(range(completed_time_num))
+            verbose_print("Circuit group", group_index, "has", completed_time_num, "completed time points", level = 1)
+
+        record_writer = None
+        if if_record_sim_result and config["record_format"] == "columnar":
+            record_writer = create_columnar_simulation_record(sim_result_filedir + record_file_name, {
+                "start_time": str(run_inputs["time_start"]),
+                "end_time": str(run_inputs["time_end"]),
+                "time_step": run_inputs["time_step"],
+                "satellite_number": len(run_inputs["satellites"]),
+                "ground_station_number": len(run_inputs["ground_stations"]),
+                "pop_number": len(run_inputs["point_of_presences"]),
+                "client_server_info": tor_client_server_info,
+                "routing_strategy": routing_strategy,
+                "gs_satellite_link_mode": gs_satellite_link_mode,
+                "satellite_speed_samples": config["satellite_speed_samples"],
+                "terrestrial_speed_samples": config["terrestrial_speed_samples"],
+                "dataset": dataset,
+                "circuit_range": list(circuit_group_range),
+                "max_path_limit": config["max_path_limit"],
+                "terrestrial_latency_mode": config["terrestrial_latency_mode"],
+                "run_key": run_key,
+                "seed": seed
+            })
+        elif if_record_sim_result and not os.path.exists(sim_result_filedir + record_file_name):
+            create_text_simulation_record(sim_result_filedir + record_file_name, [
+                "simulation starts at " + str(run_inputs["time_start"]) + "\n",
+                "simulation ends at " + str(run_inputs["time_end"]) + "\n",
+                "simulation time step is " + str(run_inputs["time_step"]) + " seconds \n",
+                "simulation satellite number is " + str(len(run_inputs["satellites"])) + "\n",
+                "simulation ground station number is " + str(len(run_inputs["ground_stations"])) + "\n",
+                "simulation PoP number is " + str(len(run_inputs["point_of_presences"])) + "\n",
+                "Simulation client/server information is " + str(tor_client_server_info) + "\n",
+                "Simulation routing strategy is " + routing_strategy + "\n",
+                "Simulation gs-satellite link mode is " + gs_satellite_link_mode + "\n",
+                "Simulation dataset is " + dataset + "\n",
+                "Simulation max path limit is " + str(config["max_path_limit"]) + "\n"
+            ])
+
+        # circuits of a dataset are read and located once for all runs
+        if (dataset, group_index) not in run_inputs["hops"]:
+            extended_geo_circuits = get_extend_circuits_with_geo_client_server(filename_tor_circuits,
+                                                                               run_inputs["filename_geoip_dataset"],
+                                                                               tor_client_server_info,
+                                                                               circuit_group_range)
+            run_inputs["hops"][(dataset, group_index)], _ = parse_hops_in_circuits(extended_geo_circuits)
+        circuit_groups.append({
+            "record_file_name": record_file_name,
+            "record_writer": record_writer,
+            "hops": run_inputs["hops"][(dataset, group_index)],
+            "completed_time_num": completed_time_num
+        })
+    if if_record_sim_result:
+        write_simulation_manifest(manifest_filename, manifest)
+
+    # Terrestrial distances of all groups are computed once, and shared by the runs of a dataset,
+    # fixed latencies are drawn from their own random stream
+    terrestrial_edge_cache_key = (dataset,) if config["terrestrial_latency_mode"] == "resample" else (dataset, config["terrestrial_speed_samples"], seed)
+    if terrestrial_edge_cache_key not in run_inputs["terrestrial_edge_caches"]:
+        set_sampling_seed([seed])
+        all_hops = dict()
+        for circuit_group in circuit_groups:
+            all_hops.update(circuit_group["hops"])
+        run_inputs["terrestrial_edge_caches"][terrestrial_edge_cache_key] = build_terrestrial_edge_cache(run_inputs["ground_stations"],
+                                                                                                         run_inputs["point_of_presences"],
+                                                                                                         all_hops,
+                                                                                                         config["terrestrial_latency_mode"],
+                                                                                                         terrestrial_speed_ecdf)
+
+    return {
+        "run_key": run_key,
+        "manifest_filename": manifest_filename,
+        "manifest": manifest,
+        "circuit_groups": circuit_groups,
+        "worker_inputs": {
+            "seed": seed,
+            "hops": [circuit_group["hops"] for circuit_group in circuit_groups],
+            "link_connectivity": link_connectivity,
+            "gs_satellite_link_mode": gs_satellite_link_mode,
+            "sat_ecdf": satellite_speed_ecdf,
+            "ter_ecdf": terrestrial_speed_ecdf,
+            "max_path_limit": config["max_path_limit"],
+            "graph_backend": config["graph_backend"],
+            "terrestrial_edge_cache": run_inputs["terrestrial_edge_caches"][terrestrial_edge_cache_key]
+        }
+    }
+
 if __name__ == "__main__":
     #### Do simulation ####
     parser = argparse.ArgumentParser(description = "SaTor simulator parameters.")
@@ -15,14 +334,14 @@ if __name__ == "__main__":
         '--routing_strategy',
         type = str,
         help = "Choose between single-bent-pipe and ISL-enabled",
-        choices = ["single-bent-pipe", "ISL-enabled"],
-        required = True
+        choices = SWEEP_PARAMETERS["routing_strategy"],
+        required = False
     )
     parser.add_argument(
         '-lm',
         '--gs_satellite_link_mode',
         type = str,
-        choices = ["all-visible", "closest-only"],
+        choices = SWEEP_PARAMETERS["gs_satellite_link_mode"],
         help = "Choose between all-visible and closest-only",
         default = "all-visible",
         required = False
@@ -48,137 +367,218 @@ if __name__ == "__main__":
         '--dataset',
         type = str,
         help = "Choose between snapshot and timespanning",
-        choices = ["snapshot", "timespanning"],
+        choices = SWEEP_PARAMETERS["dataset"],
         default = "snapshot",
         required = False
     )
+    parser.add_argument(
+        '-pl',
+        '--max_path_limit',
+        type = int,
+        help = "Number of shortest paths recorded per hop, 1 routes all hops from a relay with a single Dijkstra run, more than 1 searches k-shortest paths hop by hop",
+        default = 10,
+        required = False
+    )
+    parser.add_argument(
+        '-gb',
+        '--graph_backend',
+        type = str,
+        help = "Choose between networkx and csgraph (compressed sparse graph with scipy shortest paths)",
+        choices = SWEEP_PARAMETERS["graph_backend"],
+        default = "networkx",
+        required = False
+    )
+    parser.add_argument(
+        '-w',
+        '--workers',
+        type = int,
+        help = "Number of worker processes simulating time points in parallel",
+        default = 1,
+        required = False
+    )
+    parser.add_argument(
+        '-sd',
+        '--seed',
+        type = int,
+        help = "Seed of the latency sampling, a random one if not given",
+        default = None,
+        required = False
+    )
+    parser.add_argument(
+        '-rf',
+        '--record_format',
+        type = str,
+        help = "Choose between text (one JSON line per time point) and columnar (directory of memory-mappable float32 columns)",
+        choices = ["text", "columnar"],
+        default = "text",
+        required = False
+    )
+    parser.add_argument(
+        '-gd',
+        '--geoip_database',
+        type = str,
+        help = "Local IP database (.mmdb, or IP-range CSV) resolving relays missing from the GeoIP dataset before any web API",
+        default = None,
+        required = False
+    )
+    parser.add_argument(
+        '-gl',
+        '--geoip_database_layout',
+        type = str,
+        help = "Column layout of an IP-range CSV database",
+        choices = list(GEOIP_RANGE_CSV_LAYOUTS.keys()),
+        default = "dbip",
+        required = False
+    )
+    parser.add_argument(
+        '-tl',
+        '--terrestrial_latency_mode',
+        type = str,
+        help = "Choose between resample (terrestrial latencies drawn at every time point) and fixed (drawn once per run)",
+        choices = SWEEP_PARAMETERS["terrestrial_latency_mode"],
+        default = "resample",
+        required = False
+    )
+    parser.add_argument(
+        '-st',
+        '--time_step',
+        type = int,
+        help = "Seconds between two simulated time points",
+        default = 120,
+        required = False
+    )
+    parser.add_argument(
+        '-tt',
+        '--temporal_topology',
+        action = "store_true",
+        help = "Carry the routing graph over consecutive time points and update only the links that changed, same results, faster with fine time steps (and with -pl 1, the previous paths bound the Dijkstra runs)"
+    )
+    parser.add_argument(
+        '-r',
+        '--resume',
+        action = "store_true",
+        help = "Continue the interrupted run with the same settings, simulating only the time points missing from its records"
+    )
+    parser.add_argument(
+        '-sw',
+        '--sweep',
+        type = str,
+        help = "Grid spec (JSON file of { parameter: [values] }) of the configurations to simulate together, parameters out of the grid take their command line value",
+        default = None,
+        required = False
+    )
     args = parser.parse_args()
-    routing_strategy = args.routing_strategy
-    gs_satellite_link_mode = args.gs_satellite_link_mode
-    if args.satellite_speed_samples != "lightspeed":
-        with open(args.satellite_speed_samples, 'r') as f:
-            satellite_speed_samples = json.load(f)
-    else:
-        satellite_speed_samples = [LIGHT_SPEED]
-    if args.terrestrial_speed_samples != "fiberspeed":
-        with open(args.terrestrial_speed_samples, 'r') as f:
-            terrestrial_speed_samples = json.load(f)
-    else:
-        terrestrial_speed_samples = [TERRESTRIAL_TRANS_SPEED]
-    satellite_speed_ecdf = get_speed_ECDF(satellite_speed_samples)
-    terrestrial_speed_ecdf = get_speed_ECDF(terrestrial_speed_samples)
-    dataset = args.dataset
-    if_record_sim_result = True
-    sim_result_filedir = "data/simulation/"
-
-    # Read necessary data
-    filename_geoip_dataset = "data/tor/tor_relays_geoip_dataset.json"
-    filename_tles = "data/constellation/starlink_satellite_TLEs_06-09-2024.txt"
-    filename_tor_circuits = "data/tor/tor_circuits_snapshot-13-04-2024.txt" if dataset == "snapshot" else "data/tor/tor_circuits_timespanning.txt"
-    filename_ground_stations = "data/constellation/starlink_ground_stations.json"
-    filename_point_of_presences = "data/constellation/starlink_pops.json"
-    satellites = read_satellite_tles(filename_tles)
-    ground_stations = read_ground_stations(filename_ground_stations)
-    point_of_presences = read_point_of_presences(filename_point_of_presences)
+    config = {
+        "routing_strategy": args.routing_strategy,
+        "gs_satellite_link_mode": args.gs_satellite_link_mode,
+        "satellite_speed_samples": args.satellite_speed_samples,
+        "terrestrial_speed_samples": args.terrestrial_speed_samples,
+        "dataset": args.dataset,
+        "max_path_limit": args.max_path_limit,
+        "terrestrial_latency_mode": args.terrestrial_latency_mode,
+        "record_format": args.record_format,
+        "graph_backend": args.graph_backend,
+        "geoip_database": args.geoip_database,
+        "seed": args.seed,
+        "resume": args.resume
+    }
+    try:
+        configs = read_sweep_grid(args.sweep, config) if args.sweep is not None else [config]
+    except ValueError as error:
+        parser.error(str(error))
+
+    # Read necessary data, once for all configurations
+    if args.geoip_database is not None:
+        add_geoip_offline_database(args.geoip_database, args.geoip_database_layout)
+    run_inputs = {
+        "if_record_sim_result": True,
+        "sim_result_filedir": "data/simulation/",
+        "filename_geoip_dataset": "data/tor/tor_relays_geoip_dataset.json",
+        "filename_tles": "data/constellation/starlink_satellite_TLEs_06-09-2024.txt",
+        "filenames_tor_circuits": {
+            "snapshot": "data/tor/tor_circuits_snapshot-13-04-2024.txt",
+            "timespanning": "data/tor/tor_circuits_timespanning.txt"
+        },
+        "filename_ground_stations": "data/constellation/starlink_ground_stations.json",
+        "filename_point_of_presences": "data/constellation/starlink_pops.json",
+        # circuit hops per (dataset, circuit group index) and terrestrial edge caches, filled by `prepare_simulation_run`
+        "hops": dict(),
+        "terrestrial_edge_caches": dict()
+    }
+    run_inputs["satellites"] = read_satellite_catalogue(run_inputs["filename_tles"])
+    constellation = build_constellation(run_inputs["satellites"])
+    run_inputs["ground_stations"] = read_ground_stations(run_inputs["filename_ground_stations"])
+    run_inputs["point_of_presences"] = read_point_of_presences(run_inputs["filename_point_of_presences"])
 
     # Simulation time settings
     time_start = ephem.Date("2024/08/12 20:00:00")
     verbose_print("simulation starts at", time_start, level = 1)
     time_end = ephem.Date(time_start + 4 * ephem.hour)
     verbose_print("simulation ends at", time_end, level = 1)
-    time_step = 120
+    time_step = args.time_step
     verbose_print("simulation time step is", time_step, "seconds", level = 1)
+    # satellite positions are shared by all circuit groups and configurations,
+    # each worker propagates them by chunks of time points when first asked, and releases them once simulated
+    time_points = get_simulation_time_points(time_start, time_end, time_step)
+    schedule_constellation_positions(constellation, time_points)
     circuit_range = (0, 20000)
     verbose_print("simulation circuit number is", circuit_range, level = 1)
     circuit_group_size = 2500
+    run_inputs.update({
+        "time_start": time_start,
+        "time_end": time_end,
+        "time_step": time_step,
+        "circuit_range": circuit_range,
+        "circuit_group_size": circuit_group_size
+    })
 
-    # Link availability settings
-    if routing_strategy == "single-bent-pipe":
-        link_connectivity = {
-            "SRC_DST_LINK": False,
-            "SRC_SAT_LINK": True,
-            "SAT_SAT_LINK": False,
-            "SAT_GS_LINK": True,
-            "GS_POP_LINK": True,
-            "GS_SAT_LINK": False,
-            "GS_DST_LINK": False,
-            "POP_DST_LINK": True
-        }
-    elif routing_strategy == "ISL-enabled":
-        link_connectivity = {
-            "SRC_DST_LINK": False,
-            "SRC_SAT_LINK": True,
-            "SAT_SAT_LINK": True,
-            "SAT_GS_LINK": True,
-            "GS_POP_LINK": True,
-            "GS_SAT_LINK": False,
-            "GS_DST_LINK": False,
-            "POP_DST_LINK": True
-        }
-    else:
-        raise ValueError("Unknown routing strategy")
+    # Prepare runs, one per configuration
+    runs = list()
+    for config in configs:
+        verbose_print("Prepare run of configuration", config, level = 1)
+        try:
+            runs.append(prepare_simulation_run(config, run_inputs))
+        except ValueError as error:
+            parser.error(str(error))
 
     # Start simulation
-    for i in range(circuit_range[0], circuit_range[1], circuit_group_size):
-        circuit_group_range = (i, i + circuit_group_size)
-        record_file_name = ("sim_" + str(time.time()) +
-                            "_" + gs_satellite_link_mode +
-                            "_" + routing_strategy +
-                            "_" + dataset +
-                            "_" + str(circuit_group_range[0]) + "-" + str(circuit_group_range[1]) +
-                            ".txt")
-        tor_client_server_info = [
-            {
-                "role": "client",
-                "city": CITIES[i // circuit_group_size],
-                "lat": CITIES_LATS[i // circuit_group_size],
-                "lon": CITIES_LONS[i // circuit_group_size],
-                "country_code": CITIES_COUNTRY_CODES[i // circuit_group_size]
-            }
-        ]
+    # the temporal topology is carried over consecutive time points only: each worker then gets a contiguous block of them
+    time_block_size = math.ceil(len(time_points) / args.workers) if args.temporal_topology else 1
+    # workers rebuild the (unpicklable) SGP4 records from the catalogue
+    shared_inputs = {
+        "constellation": {key: value for key, value in constellation.items() if key != "satrecs"},
+        "ground_stations": run_inputs["ground_stations"],
+        "point_of_presences": run_inputs["point_of_presences"],
+        "temporal_topology": args.temporal_topology,
+        "time_block_size": time_block_size,
+        "runs": [run["worker_inputs"] for run in runs]
+    }
+    simulation_tasks = get_simulation_tasks(runs, time_points, time_block_size)
+    group_num = len(runs[0]["circuit_groups"])
+    verbose_print(sum([len(task[2]) for task in simulation_tasks]), "of", len(runs) * group_num * len(time_points), "time points to simulate", level = 1)
+    if args.workers > 1:
+        # no background thread may be running when the workers are forked
+        join_geoip_address_worker()
+        simulation_pool = multiprocessing.Pool(args.workers, initializer = init_simulation_worker, initargs = (shared_inputs,))
+        # `imap` yields in task order, so this process is the only writer and writes each group in time order
+        simulation_results = simulation_pool.imap(simulate_time_points, simulation_tasks)
+    else:
+        init_simulation_worker(shared_inputs)
+        simulation_results = map(simulate_time_points, simulation_tasks)
 
-        if if_record_sim_result:
-            with open(sim_result_filedir + record_file_name, 'a') as sim_record_file:
-                sim_record_file.write("simulation starts at " + str(time_start) + "\n")
-                sim_record_file.write("simulation ends at " + str(time_end) + "\n")
-                sim_record_file.write("simulation time step is " + str(time_step) + " seconds \n")
-                sim_record_file.write("simulation satellite number is " + str(len(satellites)) + "\n")
-                sim_record_file.write("simulation ground station number is " + str(len(ground_stations)) + "\n")
-                sim_record_file.write("simulation PoP number is " + str(len(point_of_presences)) + "\n")
-                sim_record_file.write("Simulation client/server information is " + str(tor_client_server_info) + "\n")
-                sim_record_file.write("Simulation routing strategy is " + routing_strategy + "\n")
-                sim_record_file.write("Simulation gs-satellite link mode is " + gs_satellite_link_mode + "\n")
-                sim_record_file.write("Simulation dataset is " + dataset + "\n")
-
-        extended_geo_circuits = get_extend_circuits_with_geo_client_server(filename_tor_circuits,
-                                                                           filename_geoip_dataset,
-                                                                           tor_client_server_info,
-                                                                           circuit_group_range)
-        hops, hops_count = parse_hops_in_circuits(extended_geo_circuits)
-
-        time_cursor = time_start
-        t_index = 0
-        while time_cursor < time_end:
-            verbose_print("Simulating the", t_index, "th time point, time is", str(ephem.Date(time_cursor)), level = 1)
-            time_point_start = time.time()
-            simulation_results_time_t = path_simulate_one_time_many_hops(hops = hops,
-                                                                         satellites = satellites,
-                                                                         ground_stations = ground_stations,
-                                                                         point_of_presences = point_of_presences,
-                                                                         current_date_time_string = str(ephem.Date(time_cursor)),
-                                                                         link_connectivity = link_connectivity,
-                                                                         gs_satellite_link_mode = gs_satellite_link_mode,
-                                                                         sat_ecdf = satellite_speed_ecdf,
-                                                                         ter_ecdf = terrestrial_speed_ecdf)
-            if if_record_sim_result:
-                with open(sim_result_filedir + record_file_name, 'a') as sim_record_file:
+    for run_index, group_index, time_points_results in simulation_results:
+        for t_index, simulation_results_time_t, time_point_seconds in time_points_results:
+            run = runs[run_index]
+            circuit_group = run["circuit_groups"][group_index]
+            if run_inputs["if_record_sim_result"] and circuit_group["record_writer"] is not None:
+                append_columnar_simulation_record(circuit_group["record_writer"], simulation_results_time_t)
+            elif run_inputs["if_record_sim_result"]:
+                with open(run_inputs["sim_result_filedir"] + circuit_group["record_file_name"], 'a') as sim_record_file:
                     sim_record_file.write(json.dumps(simulation_results_time_t) + '\n')
-            time_point_end = time.time()
-            verbose_print("Simulation time point", t_index, "takes", time_point_end - time_point_start, "seconds", level = 1)
-
-            time_cursor += time_step * ephem.second
-            t_index += 1
-
-
-
+            if run_inputs["if_record_sim_result"]:
+                mark_simulation_unit_completed(run["manifest_filename"], run["manifest"], group_index, t_index)
+            verbose_print("Simulation time point", t_index, "of circuit group", group_index, "of run", run_index, "takes", time_point_seconds, "seconds", level = 1)
 
+    if args.workers > 1:
+        simulation_pool.close()
+        simulation_pool.join()
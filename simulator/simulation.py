@@ -1,6 +1,8 @@
 import networkx as nx
 from utils import *
 from dataget import *
+from constellation import *
+from sparse_graph import *
 from statsmodels.distributions.empirical_distribution import ECDF
 
 ## ------------------- SIMULATION CONFIGS ------------------- ##
@@ -30,32 +32,38 @@ def calculate_latency_with_distance(distance: float, scope: float, intercept: fl
 
 def sample_latency_with_distance(distance: float, ecdf: ECDF):
     # input: distance in meters, ecdf of speed
-    # output: latency in milliseconds
-    sampled_speed = sample_speed(ecdf) # in m/s
-    return distance / sampled_speed # in seconds
+    # output: latency in seconds
+    return sample_latencies_with_distances([distance], ecdf)[0]
 
-def satellite_location(satellite, current_time_date_string: str):
-    # Simulate the location (lat, lon, alt) of a satellite at a time point
-    try:
-        observer = ephem.Observer()
-        observer.date = current_time_date_string
-        satellite.compute(observer)
-        lat = satellite.sublat
-        lon = satellite.sublong
-        alt = satellite.elevation
-        return lat, lon, alt
-    except:
-        print("ERROR: In FUNC satellite_location, cannot compute the position of sat", satellite.name)
-        return None, None, None
+def get_edges_with_sampled_latency(srcs: list, dsts: list, distances, ecdf: ECDF):
+    # Build edge records, sampling the latencies of all edges in one call
+    distances = np.asarray(distances, dtype = np.float64)
+    latencies = sample_latencies_with_distances(distances, ecdf) # in seconds
+    return get_edges_with_latency(srcs, dsts, distances, latencies)
+
+def get_edges_with_latency(srcs: list, dsts: list, distances: np.ndarray, latencies: np.ndarray):
+    # Build edge records from distances in meters and latencies in seconds
+    return [{"src": src, "dst": dst, "distance": d, "latency": latency}
+            for src, dst, d, latency in zip(srcs, dsts, distances.tolist(), latencies.tolist())]
 
-def ground_find_inrange_satellites(g_lat: float, g_lon: float, date_str: str, satellites: list, in_range: int):
+def ground_find_inrange_satellites(g_lat: float, g_lon: float, sat_positions: dict, in_range: int):
     # For a ground location, find its accessible satellite at a time point
-    results = list()
-    for s in satellites:
-        d = distance_between_ground_satellite(g_lat, g_lon, date_str, s)
-        if d < in_range:
-            results.append([s, d])
-    return results
+    _, sat_indices, distances = ground_points_find_inrange_satellites(g_lat, g_lon, sat_positions, in_range)
+    return [[sat_positions["names"][sat_index], d] for sat_index, d in zip(sat_indices, distances) if d < in_range]
+
+def select_visible_links(link_src_indices: np.ndarray, link_distances: np.ndarray, gs_satellite_link_mode: str):
+    # input: the link source of each visible link (links grouped by source), link distances in meters
+    # output: positions of the links kept under `gs_satellite_link_mode`
+    if gs_satellite_link_mode == "all-visible":
+        return np.arange(len(link_src_indices))
+    elif gs_satellite_link_mode == "closest-only":
+        # sort by source, then by distance, and keep the first link of each source
+        order = np.lexsort((link_distances, link_src_indices))
+        _, first_positions = np.unique(link_src_indices[order], return_index = True)
+        return np.sort(order[first_positions])
+    else:
+        verbose_print("gs_satellite_link_mode should be either 'all-visible' or 'closest-only'", level = 3)
+        return np.array([], dtype = int)
 
 # ------------------------- Simulation Functions ------------------------- #
 
@@ -72,16 +80,18 @@ def parse_hops_in_circuits(circuits: list):
             hops_count[hop_id] = hops_count.get(hop_id, 0) + 1
     return hops, hops_count
 
-def get_graph_sat_gs_nodes_at_time_t(satellites: list,
+def get_graph_sat_gs_nodes_at_time_t(sat_positions: dict,
                                     ground_stations: list,
-                                    point_of_presences: list,
-                                    current_date_time_string: str):
+                                    point_of_presences: list):
     # Get the [latitudes, longitudes, altitudes] of all satellites and ground stations at a time point
+    # satellite latitudes and longitudes are in radians, as ephem's sublat and sublong
     satellite_nodes_at_time_t = dict()
-    for satellite in satellites:
-        sat_lat, sat_lon, sat_alt = satellite_location(satellite, current_date_time_string)
-        sat_name = "s_" + satellite.name
-        satellite_nodes_at_time_t[sat_name] = [sat_lat, sat_lon, sat_alt]
+    for sat_name, sat_lat, sat_lon, sat_alt, sat_valid in zip(sat_positions["names"],
+                                                              sat_positions["lat"].tolist(),
+                                                              sat_positions["lon"].tolist(),
+                                                              sat_positions["alt"].tolist(),
+                                                              sat_positions["valid"].tolist()):
+        satellite_nodes_at_time_t[sat_name] = [sat_lat, sat_lon, sat_alt] if sat_valid else [None, None, None]
 
     gs_nodes_at_time_t = dict()
     for gs in ground_stations:
@@ -99,184 +109,266 @@ def get_graph_sat_gs_nodes_at_time_t(satellites: list,
 
     return satellite_nodes_at_time_t, gs_nodes_at_time_t, pop_nodes_at_time_t
 
+def get_relay_node_name(relay: list):
+    # Name of a relay in the routing graph
+    return "r_" + relay[0] + '(' + relay[1] + ')'
+
 def get_graph_relay_nodes(s_relay: list, d_relay: list):
     # Get all the attributes of the relays for routing graph
     relay_nodes = dict()
-    s_relay_name = "r_" + s_relay[0] + '(' + s_relay[1] + ')'
-    d_relay_name = "r_" + d_relay[0] + '(' + d_relay[1] + ')'
+    s_relay_name = get_relay_node_name(s_relay)
+    d_relay_name = get_relay_node_name(d_relay)
     relay_nodes[s_relay_name] = [s_relay[2], s_relay[3], s_relay[4], s_relay[5]]
     relay_nodes[d_relay_name] = [d_relay[2], d_relay[3], d_relay[4], d_relay[5]]
     return relay_nodes
 
-def get_ISL_edges(src_sat, satellites: list, current_date_time_string: str, isl_interface_number: int, mode: str, sat_ecdf: ECDF):
-    # add ISL in this way:
-    # 1. connect to the 1-st nearest satellite in the same orbit
-    # 2. connect to the 1-st nearest satellite in the different orbit
-    # 3. connect to the 2-nd nearest satellite in the same orbit
-    # 4. ... until run out of ISL interfaces
-    isl_edges = list()
-    satellites_in_range_same_orbit = list()
-    satellites_in_range_different_orbit = list()
-    for dst_sat in satellites:
-        d = distance_between_satellites(src_sat, dst_sat, current_date_time_string)
-        if d <= MAX_ISL_DISTANCE:
-            if get_if_satellite_same_orbit(src_sat, dst_sat):
-                satellites_in_range_same_orbit.append(dst_sat)
-            else:
-                satellites_in_range_different_orbit.append(dst_sat)
-        if len(satellites_in_range_same_orbit) >= isl_interface_number / 2 and len(satellites_in_range_different_orbit) >= isl_interface_number / 2:
-            break
-
-    if isl_interface_number == None or isl_interface_number > len(satellites_in_range_same_orbit) + len(satellites_in_range_different_orbit):
-        isl_interface_number = len(satellites_in_range_same_orbit) + len(satellites_in_range_different_orbit)
-
-    flag = 1
-    same_orbit_sat_index = 0
-    different_orbit_sat_index = 0
-    for i in range(isl_interface_number):
-        if flag == 1:
-            dst_sat = satellites_in_range_same_orbit[same_orbit_sat_index if same_orbit_sat_index < len(satellites_in_range_same_orbit) else -1]
-            same_orbit_sat_index += 1
-        else:
-            dst_sat = satellites_in_range_different_orbit[different_orbit_sat_index if different_orbit_sat_index < len(satellites_in_range_different_orbit) else -1]
-            different_orbit_sat_index += 1
-        d = distance_between_satellites(src_sat, dst_sat, current_date_time_string)
-        isl_edge = {
-            "src": "s_" + src_sat.name,
-            "dst": "s_" + dst_sat.name,
-            "distance": d,
-            "latency": sample_latency_with_distance(d, sat_ecdf) # in seconds
+def get_ISL_edges(sat_positions: dict, isl_interface_number: int, sat_ecdf: ECDF):
+    # ISL of all satellites at a time point, see `get_ISL_topology` for how neighbours are picked
+    src_sat_indices, dst_sat_indices, distances = get_cached_ISL_topology(sat_positions, isl_interface_number, MAX_ISL_DISTANCE)
+    return get_edges_with_sampled_latency([sat_positions["names"][sat_index] for sat_index in src_sat_indices],
+                                          [sat_positions["names"][sat_index] for sat_index in dst_sat_indices],
+                                          distances,
+                                          sat_ecdf)
+
+# ------------------------- Terrestrial edge cache ------------------------- #
+# Terrestrial links (GS-PoP, GS/PoP-destination relay, source-destination relay) join fixed locations,
+# so their distances are computed once per run, and only their latencies are sampled at every time point.
+# A cache is a dict:
+# - "gs_pop": the GS x PoP edges, flattened in ground station order, with the "gs_indices" and "pop_indices" of their ends
+# - "relays": { relay_name: {"gs": GS -> relay edges, "pop": PoP -> relay edges} }
+# - "relay_pairs": { (s_relay_name, d_relay_name): source -> destination relay edge }
+# every edge group holds "srcs", "dsts", "distances", and "latencies" once sampled in "fixed" latency mode.
+# terrestrial_latency_mode: "resample" draws new latencies at every time point,
+#                           "fixed" draws them once and keeps them for the whole run
+
+TERRESTRIAL_LATENCY_MODES = ["resample", "fixed"]
+# Caches of `get_terrestrial_edge_cache`, for callers that do not build one per run
+TERRESTRIAL_EDGE_CACHES = dict()
+
+def build_terrestrial_edge_cache(ground_stations: list,
+                                 point_of_presences: list,
+                                 hops: dict = None,
+                                 terrestrial_latency_mode: str = "resample",
+                                 ter_ecdf: ECDF = None):
+    # input: hops { hop_id: [s_relay, d_relay] } whose relay edges are computed now, other relays are added when first used
+    #        ter_ecdf is needed in "fixed" mode, to draw the latencies of the edges computed now
+    if terrestrial_latency_mode not in TERRESTRIAL_LATENCY_MODES:
+        raise ValueError("terrestrial_latency_mode should be one of " + str(TERRESTRIAL_LATENCY_MODES))
+    gs_names = ["g_" + gs["name"] for gs in ground_stations]
+    pop_names = ["p_" + pop["name"] for pop in point_of_presences]
+    terrestrial_edge_cache = {
+        "latency_mode": terrestrial_latency_mode,
+        "gs_names": gs_names,
+        "pop_names": pop_names,
+        "gs_lats": np.array([gs["lat"] for gs in ground_stations], dtype = np.float64),
+        "gs_lons": np.array([gs["lng"] for gs in ground_stations], dtype = np.float64),
+        "pop_lats": np.array([pop["lat"] for pop in point_of_presences], dtype = np.float64),
+        "pop_lons": np.array([pop["lng"] for pop in point_of_presences], dtype = np.float64),
+        "relays": dict(),
+        "relay_pairs": dict()
+    }
+    terrestrial_edge_cache["gs_pop"] = {
+        "srcs": [gs_name for gs_name in gs_names for _ in pop_names],
+        "dsts": [pop_name for _ in gs_names for pop_name in pop_names],
+        "gs_indices": np.repeat(np.arange(len(gs_names)), len(pop_names)),
+        "pop_indices": np.tile(np.arange(len(pop_names)), len(gs_names)),
+        "distances": great_circle_distances(terrestrial_edge_cache["gs_lats"], terrestrial_edge_cache["gs_lons"],
+                                            terrestrial_edge_cache["pop_lats"], terrestrial_edge_cache["pop_lons"],
+                                            pairwise = True).ravel()
+    }
+    if hops is not None:
+        add_terrestrial_relay_edges(terrestrial_edge_cache, [hop[1] for hop in hops.values()])
+        for hop in hops.values():
+            get_terrestrial_relay_pair_edges(terrestrial_edge_cache, hop[0], hop[1])
+    if terrestrial_latency_mode == "fixed":
+        edge_groups = [terrestrial_edge_cache["gs_pop"]] + list(terrestrial_edge_cache["relay_pairs"].values())
+        for relay_edges in terrestrial_edge_cache["relays"].values():
+            edge_groups += [relay_edges["gs"], relay_edges["pop"]]
+        for edge_group in edge_groups:
+            edge_group["latencies"] = sample_latencies_with_distances(edge_group["distances"], ter_ecdf)
+    verbose_print("Terrestrial edge cache built for", len(terrestrial_edge_cache["relays"]), "relays and",
+                  len(terrestrial_edge_cache["relay_pairs"]), "relay pairs", level = 1)
+    return terrestrial_edge_cache
+
+def get_terrestrial_edge_cache(ground_stations: list, point_of_presences: list):
+    # A "resample" cache per set of ground stations and PoPs, kept for the lifetime of the process
+    key = (tuple([(gs["name"], gs["lat"], gs["lng"]) for gs in ground_stations]),
+           tuple([(pop["name"], pop["lat"], pop["lng"]) for pop in point_of_presences]))
+    if key not in TERRESTRIAL_EDGE_CACHES:
+        TERRESTRIAL_EDGE_CACHES[key] = build_terrestrial_edge_cache(ground_stations, point_of_presences)
+    return TERRESTRIAL_EDGE_CACHES[key]
+
+def add_terrestrial_relay_edges(terrestrial_edge_cache: dict, relays: list):
+    # Compute the GS -> relay and PoP -> relay distances of the relays not in the cache yet, all at once
+    new_relays = dict()
+    for relay in relays:
+        relay_name = get_relay_node_name(relay)
+        if relay_name not in terrestrial_edge_cache["relays"]:
+            new_relays[relay_name] = relay
+    if len(new_relays) == 0:
+        return
+    relay_lats = [relay[4] for relay in new_relays.values()]
+    relay_lons = [relay[5] for relay in new_relays.values()]
+    # shape = (relays, ground stations) and (relays, PoPs)
+    gs_distances = great_circle_distances(relay_lats, relay_lons, terrestrial_edge_cache["gs_lats"], terrestrial_edge_cache["gs_lons"], pairwise = True)
+    pop_distances = great_circle_distances(relay_lats, relay_lons, terrestrial_edge_cache["pop_lats"], terrestrial_edge_cache["pop_lons"], pairwise = True)
+    for relay_index, relay_name in enumerate(new_relays.keys()):
+        terrestrial_edge_cache["relays"][relay_name] = {
+            "gs": {
+                "srcs": terrestrial_edge_cache["gs_names"],
+                "dsts": [relay_name] * len(terrestrial_edge_cache["gs_names"]),
+                "distances": gs_distances[relay_index]
+            },
+            "pop": {
+                "srcs": terrestrial_edge_cache["pop_names"],
+                "dsts": [relay_name] * len(terrestrial_edge_cache["pop_names"]),
+                "distances": pop_distances[relay_index]
+            }
         }
-        isl_edges.append(isl_edge)
-        flag = -flag
-    return isl_edges
 
-def get_graph_edges_no_relay(satellites: list,
+def get_terrestrial_relay_edges(terrestrial_edge_cache: dict, relay: list):
+    add_terrestrial_relay_edges(terrestrial_edge_cache, [relay])
+    return terrestrial_edge_cache["relays"][get_relay_node_name(relay)]
+
+def get_terrestrial_relay_pair_edges(terrestrial_edge_cache: dict, s_relay: list, d_relay: list):
+    key = (get_relay_node_name(s_relay), get_relay_node_name(d_relay))
+    if key not in terrestrial_edge_cache["relay_pairs"]:
+        terrestrial_edge_cache["relay_pairs"][key] = {
+            "srcs": [key[0]],
+            "dsts": [key[1]],
+            "distances": np.array([distance_between_ground_stations([s_relay[4], s_relay[5]], [d_relay[4], d_relay[5]])])
+        }
+    return terrestrial_edge_cache["relay_pairs"][key]
+
+def get_terrestrial_latencies(terrestrial_edge_cache: dict, edge_group: dict, ter_ecdf: ECDF):
+    # Latencies of a cached edge group, sampled now or, in "fixed" mode, sampled once
+    if terrestrial_edge_cache["latency_mode"] == "fixed":
+        if "latencies" not in edge_group:
+            # edges first used after the cache was built
+            edge_group["latencies"] = sample_latencies_with_distances(edge_group["distances"], ter_ecdf)
+        return edge_group["latencies"]
+    return sample_latencies_with_distances(edge_group["distances"], ter_ecdf)
+
+def get_terrestrial_edges(terrestrial_edge_cache: dict, edge_group: dict, ter_ecdf: ECDF):
+    # Edge records of a cached edge group
+    return get_edges_with_latency(edge_group["srcs"], edge_group["dsts"], edge_group["distances"], get_terrestrial_latencies(terrestrial_edge_cache, edge_group, ter_ecdf))
+
+def get_graph_node_names(sat_positions: dict, ground_stations: list, point_of_presences: list):
+    # Names of the nodes without relays, in the order of their indices: satellites, ground stations, then PoPs
+    # ground stations may share a name, they are then a single node in the graphs, keyed by name
+    return list(sat_positions["names"]) + ["g_" + gs["name"] for gs in ground_stations] + ["p_" + pop["name"] for pop in point_of_presences]
+
+def get_graph_edges_no_relay(sat_positions: dict,
                              ground_stations: list,
                              point_of_presences: list,
-                             current_date_time_string: str,
                              link_connectivity: dict,
                              gs_satellite_link_mode: str,
                              sat_ecdf: ECDF,
-                             ter_ecdf: ECDF):
-    edges = []
+                             ter_ecdf: ECDF,
+                             terrestrial_edge_cache: dict = None):
+    src_indices, dst_indices, distances, latencies = get_graph_edge_columns_no_relay(sat_positions, ground_stations, point_of_presences, link_connectivity,
+                                                                                     gs_satellite_link_mode, sat_ecdf, ter_ecdf, terrestrial_edge_cache)
+    node_names = get_graph_node_names(sat_positions, ground_stations, point_of_presences)
+    return get_edges_with_latency([node_names[node] for node in src_indices.tolist()],
+                                  [node_names[node] for node in dst_indices.tolist()],
+                                  distances,
+                                  latencies)
+
+def get_graph_edge_columns_no_relay(sat_positions: dict,
+                                    ground_stations: list,
+                                    point_of_presences: list,
+                                    link_connectivity: dict,
+                                    gs_satellite_link_mode: str,
+                                    sat_ecdf: ECDF,
+                                    ter_ecdf: ECDF,
+                                    terrestrial_edge_cache: dict = None):
+    # The edges of `get_graph_edges_no_relay` as columns, in the same order and with latencies sampled in the same order
+    # output: (source node indices, destination node indices, distances in meters, latencies in seconds),
+    #         nodes indexed as in `get_graph_node_names`
+    if terrestrial_edge_cache is None:
+        terrestrial_edge_cache = get_terrestrial_edge_cache(ground_stations, point_of_presences)
+    sat_num = len(sat_positions["names"])
+    gs_num = len(ground_stations)
+    edge_columns = [(np.array([], dtype = int), np.array([], dtype = int), np.array([], dtype = np.float64), np.array([], dtype = np.float64))]
     if link_connectivity["SAT_SAT_LINK"]:
-        for src_sat in satellites:
-            edges += get_ISL_edges(src_sat, satellites, current_date_time_string, MAX_ISL_INTERFACE_NUM)
+        # see `get_ISL_topology` for how neighbours are picked
+        src_sat_indices, dst_sat_indices, distances = get_cached_ISL_topology(sat_positions, MAX_ISL_INTERFACE_NUM, MAX_ISL_DISTANCE)
+        edge_columns.append((src_sat_indices, dst_sat_indices, distances, sample_latencies_with_distances(distances, sat_ecdf)))
+    if link_connectivity["SAT_GS_LINK"] or link_connectivity["GS_SAT_LINK"]:
+        # all ground station - satellite pairs within MAX_GSL_DISTANCE, grouped by ground station
+        gsl_gs_indices, gsl_sat_indices, gsl_distances = get_cached_inrange_satellites([gs["lat"] for gs in ground_stations],
+                                                                                       [gs["lng"] for gs in ground_stations],
+                                                                                       sat_positions,
+                                                                                       MAX_GSL_DISTANCE)
     if link_connectivity["SAT_GS_LINK"]:
-        for sat in satellites:
-            all_visible_edges = list()
-            for gs in ground_stations:
-                dis_sat_gs = distance_between_ground_satellite(gs["lat"], gs["lng"], current_date_time_string, sat)
-                if dis_sat_gs <= MAX_GSL_DISTANCE:
-                    all_visible_edges.append({
-                        "src": "s_" + sat.name,
-                        "dst": "g_" + gs["name"],
-                        "distance": dis_sat_gs,
-                        "latency": sample_latency_with_distance(dis_sat_gs, sat_ecdf)
-                    })
-            if gs_satellite_link_mode == "all-visible":
-                edges += all_visible_edges
-            elif gs_satellite_link_mode == "closest-only":
-                if len(all_visible_edges) > 0:
-                    edges.append(min(all_visible_edges, key = lambda x: x["distance"]))
-            else:
-                verbose_print("gs_satellite_link_mode should be either 'all-visible' or 'closest-only'", level = 3)
+        # group by satellite
+        order = np.lexsort((gsl_gs_indices, gsl_sat_indices))
+        sat_indices, gs_indices, distances = gsl_sat_indices[order], gsl_gs_indices[order], gsl_distances[order]
+        link_indices = select_visible_links(sat_indices, distances, gs_satellite_link_mode)
+        edge_columns.append((sat_indices[link_indices], sat_num + gs_indices[link_indices], distances[link_indices],
+                             sample_latencies_with_distances(distances[link_indices], sat_ecdf)))
 
     if link_connectivity["GS_POP_LINK"]:
-        for gs in ground_stations:
-            for pop in point_of_presences:
-                dis_gs_pop = distance_between_ground_stations([gs["lat"], gs["lng"]],
-                                                              [pop["lat"], pop["lng"]])
-                edges.append({
-                    "src": "g_" + gs["name"],
-                    "dst": "p_" + pop["name"],
-                    "distance": dis_gs_pop,
-                    "latency": sample_latency_with_distance(dis_gs_pop, ter_ecdf)
-                })
+        edge_group = terrestrial_edge_cache["gs_pop"]
+        edge_columns.append((sat_num + edge_group["gs_indices"], sat_num + gs_num + edge_group["pop_indices"], edge_group["distances"],
+                             get_terrestrial_latencies(terrestrial_edge_cache, edge_group, ter_ecdf)))
     if link_connectivity["GS_SAT_LINK"]:
-        for gs in ground_stations:
-            all_visible_edges = list()
-            for sat in satellites:
-                dis_gs_sat = distance_between_ground_satellite(gs["lat"], gs["lng"], current_date_time_string, sat)
-                if dis_gs_sat <= MAX_GSL_DISTANCE:
-                    all_visible_edges.append({
-                        "src": "g_" + gs["name"],
-                        "dst": "s_" + sat.name,
-                        "distance": dis_gs_sat,
-                        "latency": sample_latency_with_distance(dis_gs_sat, sat_ecdf)
-                    })
-            if gs_satellite_link_mode == "all-visible":
-                edges += all_visible_edges
-            elif gs_satellite_link_mode == "closest-only":
-                if len(all_visible_edges) > 0:
-                    edges.append(min(all_visible_edges, key = lambda x: x["distance"]))
-            else:
-                verbose_print("gs_satellite_link_mode should be either 'all-visible' or 'closest-only'", level = 3)
-    return edges
+        link_indices = select_visible_links(gsl_gs_indices, gsl_distances, gs_satellite_link_mode)
+        edge_columns.append((sat_num + gsl_gs_indices[link_indices], gsl_sat_indices[link_indices], gsl_distances[link_indices],
+                             sample_latencies_with_distances(gsl_distances[link_indices], sat_ecdf)))
+    return tuple([np.concatenate(column) for column in zip(*edge_columns)])
 
 def get_graph_edges_with_relay(s_relay: list,
                                d_relay: list,
-                               satellites: list,
+                               sat_positions: dict,
                                ground_stations: list,
                                point_of_presences: list,
-                               current_date_time_string: str,
                                link_connectivity: dict,
                                gs_satellite_link_mode: str,
                                sat_ecdf: ECDF,
-                               ter_ecdf: ECDF):
-    edges = []
-    if link_connectivity["SRC_DST_LINK"]:
-        dis_src_dst = distance_between_ground_stations([s_relay[4], s_relay[5]],
-                                                       [d_relay[4], d_relay[5]])
-        edges.append({
-            "src": "r_" + s_relay[0] + '(' + s_relay[1] + ')',
-            "dst": "r_" + d_relay[0] + '(' + d_relay[1] + ')',
-            "distance": dis_src_dst,
-            "latency": sample_latency_with_distance(dis_src_dst, ter_ecdf)
-        })
+                               ter_ecdf: ECDF,
+                               terrestrial_edge_cache: dict = None):
+    edges = get_graph_edges_from_src_relay(s_relay, sat_positions, link_connectivity, gs_satellite_link_mode, sat_ecdf)
+    edges += get_graph_edges_to_dst_relay(s_relay, d_relay, ground_stations, point_of_presences, link_connectivity, ter_ecdf, terrestrial_edge_cache)
+    return edges
 
+def get_graph_edges_from_src_relay(s_relay: list,
+                                   sat_positions: dict,
+                                   link_connectivity: dict,
+                                   gs_satellite_link_mode: str,
+                                   sat_ecdf: ECDF):
+    # Edges leaving the source relay of a hop, shared by all hops from this relay
+    edges = []
     if link_connectivity["SRC_SAT_LINK"]:
-        all_visible_edges = list()
-        for sat in satellites:
-            dis_src_sat = distance_between_ground_satellite(s_relay[4], s_relay[5], current_date_time_string, sat)
-            if dis_src_sat <= MAX_GSL_DISTANCE:
-                all_visible_edges.append({
-                    "src": "r_" + s_relay[0] + '(' + s_relay[1] + ')',
-                    "dst": "s_" + sat.name,
-                    "distance": dis_src_sat,
-                    "latency": sample_latency_with_distance(dis_src_sat, sat_ecdf)
-                })
-        if len(all_visible_edges) == 0:
-            verbose_print("No satellite is in range of", s_relay[1], "at time", current_date_time_string, level = 2)
-        if gs_satellite_link_mode == "all-visible":
-            edges += all_visible_edges
-        elif gs_satellite_link_mode == "closest-only":
-            if len(all_visible_edges) > 0:
-                edges.append(min(all_visible_edges, key = lambda x: x["distance"]))
-        else:
-            verbose_print("gs_satellite_link_mode should be either 'all-visible' or 'closest-only'", level = 3)
+        src_indices, sat_indices, distances = get_cached_inrange_satellites(s_relay[4], s_relay[5], sat_positions, MAX_GSL_DISTANCE)
+        if len(sat_indices) == 0:
+            verbose_print("No satellite is in range of", s_relay[1], "at time", sat_positions["time"], level = 2)
+        link_indices = select_visible_links(src_indices, distances, gs_satellite_link_mode)
+        edges += get_edges_with_sampled_latency([get_relay_node_name(s_relay)] * len(link_indices),
+                                                [sat_positions["names"][sat_index] for sat_index in sat_indices[link_indices]],
+                                                distances[link_indices],
+                                                sat_ecdf)
+    return edges
 
+def get_graph_edges_to_dst_relay(s_relay: list,
+                                 d_relay: list,
+                                 ground_stations: list,
+                                 point_of_presences: list,
+                                 link_connectivity: dict,
+                                 ter_ecdf: ECDF,
+                                 terrestrial_edge_cache: dict = None):
+    # Edges entering the destination relay of a hop
+    if terrestrial_edge_cache is None:
+        terrestrial_edge_cache = get_terrestrial_edge_cache(ground_stations, point_of_presences)
+    edges = []
+    if link_connectivity["SRC_DST_LINK"]:
+        edges += get_terrestrial_edges(terrestrial_edge_cache, get_terrestrial_relay_pair_edges(terrestrial_edge_cache, s_relay, d_relay), ter_ecdf)
+    if link_connectivity["GS_DST_LINK"] or link_connectivity["POP_DST_LINK"]:
+        relay_edges = get_terrestrial_relay_edges(terrestrial_edge_cache, d_relay)
     if link_connectivity["GS_DST_LINK"]:
-        for gs in ground_stations:
-            dis_gs_dst = distance_between_ground_stations([gs["lat"], gs["lng"]],
-                                                          [d_relay[4], d_relay[5]])
-            edges.append({
-                "src": "g_" + gs["name"],
-                "dst": "r_" + d_relay[0] + '(' + d_relay[1] + ')',
-                "distance": dis_gs_dst,
-                "latency": sample_latency_with_distance(dis_gs_dst, ter_ecdf)
-            })
+        edges += get_terrestrial_edges(terrestrial_edge_cache, relay_edges["gs"], ter_ecdf)
     if link_connectivity["POP_DST_LINK"]:
-        for pop in point_of_presences:
-            dis_pop_dst = distance_between_ground_stations([pop["lat"], pop["lng"]],
-                                                           [d_relay[4], d_relay[5]])
-            edges.append({
-                "src": "p_" + pop["name"],
-                "dst": "r_" + d_relay[0] + '(' + d_relay[1] + ')',
-                "distance": dis_pop_dst,
-                "latency": sample_latency_with_distance(dis_pop_dst, ter_ecdf)
-            })
+        edges += get_terrestrial_edges(terrestrial_edge_cache, relay_edges["pop"], ter_ecdf)
     return edges
 
 def generate_sat_graph(relay_nodes: dict,
@@ -292,8 +384,6 @@ def generate_sat_graph(relay_nodes: dict,
     # pop nodes: { pop_name: [lat, lon, alt] }
 
     G = nx.DiGraph()
-    for node_name, node_info in relay_nodes.items():
-        G.add_node(node_name, ip = node_info[0], port = node_info[1], lat = node_info[2], lon = node_info[3])
     for node_name, node_info in sat_nodes.items():
         G.add_node(node_name, lat = node_info[0], lon = node_info[1], alt = node_info[2])
     for node_name, node_info in gs_nodes.items():
@@ -304,16 +394,148 @@ def generate_sat_graph(relay_nodes: dict,
     # add no-relay edges
     for edge in edges_no_relays:
         G.add_edge(edge["src"], edge["dst"], distance = edge["distance"], latency = edge["latency"])
-    # add relay edges
-    for edge in edges_with_relays:
-        G.add_edge(edge["src"], edge["dst"], distance = edge["distance"], latency = edge["latency"])
+    # add relay nodes and edges
+    attach_relays_to_sat_graph(G, relay_nodes, edges_with_relays)
     return G
 
+def attach_relays_to_sat_graph(sat_graph, relay_nodes: dict, edges_with_relays: list):
+    # Overlay the relay nodes of a hop, and their edges, onto a (per time step) satellite graph in place
+    for node_name, node_info in relay_nodes.items():
+        sat_graph.add_node(node_name, ip = node_info[0], port = node_info[1], lat = node_info[2], lon = node_info[3])
+    for edge in edges_with_relays:
+        sat_graph.add_edge(edge["src"], edge["dst"], distance = edge["distance"], latency = edge["latency"])
+
+def detach_relays_from_sat_graph(sat_graph, relay_nodes: dict):
+    # Remove the relay nodes of a hop, and all their edges, restoring the graph before `attach_relays_to_sat_graph`
+    for node_name in relay_nodes.keys():
+        if node_name in sat_graph:
+            sat_graph.remove_node(node_name)
+
+# ------------------------- Temporal topology ------------------------- #
+# Consecutive time points share most of the graph without relays: the ISL grid, the GS-PoP links and most GSLs.
+# A temporal topology carries this graph from one time point to the next:
+# - edges crossing the MAX_GSL_DISTANCE / MAX_ISL_DISTANCE boundary are removed / added,
+#   the edges kept are updated in place with the distances and latencies of the new time point
+#   (in the sparse graph, the data of the CSR matrices is overwritten when no edge appears or disappears)
+# - the shortest paths of the previous time point, priced with the new latencies, are upper bounds of the new ones,
+#   so the single-source Dijkstra runs stop at these bounds rather than exploring the whole constellation
+# The paths found are the same as without a temporal topology, which pays off more as time steps get finer.
+# The edges themselves (ISL topology, satellites in range) are still looked up at every time point,
+# once for all runs and circuit groups, as they are cached with the positions of the time point.
+
+SHORTEST_PATH_CUTOFF_MARGIN = 1e-9
+
+def create_temporal_topology():
+    # output: an empty temporal topology, passed to `path_simulate_one_time_many_hops` at every time point of a run
+    return {
+        "time": None,
+        "graph_backend": None,
+        "graph": None,
+        "node_names": None,
+        "column_node_names": None,
+        "column_nodes": None,
+        "edge_keys": np.array([], dtype = np.int64),
+        "hops_paths": dict()
+    }
+
+def update_temporal_sat_graph(temporal_topology: dict,
+                              current_date_time_string: str,
+                              sat_nodes: dict,
+                              gs_nodes: dict,
+                              pop_nodes: dict,
+                              edge_columns: tuple,
+                              column_node_names: list,
+                              graph_backend: str):
+    # Bring the graph without relays of a temporal topology to a new time point
+    # edge_columns: the edges without relays from `get_graph_edge_columns_no_relay`, with the node names of its indices, `column_node_names`
+    # output: the graph, a nx.DiGraph or a sparse graph dict as for `graph_backend`
+    node_names = list(sat_nodes.keys()) + list(gs_nodes.keys()) + list(pop_nodes.keys())
+    node_num = len(node_names)
+    if temporal_topology["column_node_names"] != column_node_names:
+        # graph node of every column node, the same for all time points of a run
+        node_index = {node_name: index for index, node_name in enumerate(node_names)}
+        temporal_topology["column_node_names"] = column_node_names
+        temporal_topology["column_nodes"] = np.array([node_index[node_name] for node_name in column_node_names], dtype = np.int64)
+    column_src_indices, column_dst_indices, distances, latencies = edge_columns
+    src_indices = temporal_topology["column_nodes"][column_src_indices]
+    dst_indices = temporal_topology["column_nodes"][column_dst_indices]
+    # distinct edges by key (src * node_num + dst), the keys of both time points are sorted
+    edge_keys, positions = get_sorted_unique_edges(node_num, src_indices, dst_indices)
+    previous_edge_keys = temporal_topology["edge_keys"]
+    if_reused = temporal_topology["graph_backend"] == graph_backend and temporal_topology["node_names"] == node_names
+    if if_reused:
+        appeared_edge_keys = edge_keys[~np.isin(edge_keys, previous_edge_keys, assume_unique = True)]
+        disappeared_edge_keys = previous_edge_keys[~np.isin(previous_edge_keys, edge_keys, assume_unique = True)]
+        verbose_print("From", temporal_topology["time"], "to", current_date_time_string, len(appeared_edge_keys), "edges appear,",
+                      len(disappeared_edge_keys), "edges disappear,", len(edge_keys) - len(appeared_edge_keys), "edges are kept", level = 1)
+
+    if graph_backend == "networkx" and if_reused:
+        sat_graph = temporal_topology["graph"]
+        for node_name, node_info in sat_nodes.items():
+            sat_graph.nodes[node_name].update(lat = node_info[0], lon = node_info[1], alt = node_info[2])
+        sat_graph.remove_edges_from([(node_names[edge_key // node_num], node_names[edge_key % node_num]) for edge_key in disappeared_edge_keys.tolist()])
+        # `add_edge` updates the attributes of an existing edge in place
+        for src, dst, distance, latency in zip(src_indices[positions].tolist(), dst_indices[positions].tolist(),
+                                               distances[positions].tolist(), latencies[positions].tolist()):
+            sat_graph.add_edge(node_names[src], node_names[dst], distance = distance, latency = latency)
+    elif graph_backend == "networkx":
+        edges_no_relays = get_edges_with_latency([node_names[node] for node in src_indices.tolist()], [node_names[node] for node in dst_indices.tolist()],
+                                                 distances, latencies)
+        sat_graph = generate_sat_graph(dict(), sat_nodes, gs_nodes, pop_nodes, edges_no_relays, [])
+    else:
+        node_locations = list(sat_nodes.values()) + list(gs_nodes.values()) + list(pop_nodes.values())
+        sat_graph = {
+            "node_names": node_names,
+            "node_index": temporal_topology["graph"]["node_index"] if if_reused else {node_name: index for index, node_name in enumerate(node_names)},
+            "lats": [node_location[0] for node_location in node_locations],
+            "lons": [node_location[1] for node_location in node_locations]
+        }
+        edge_latencies = latencies[positions].astype(np.float32)
+        edge_distances = distances[positions].astype(np.float32)
+        if if_reused and np.array_equal(edge_keys, previous_edge_keys):
+            # same sparsity structure, the edges are in the same order in the data of the matrices
+            sat_graph["latency_matrix"] = temporal_topology["graph"]["latency_matrix"]
+            sat_graph["distance_matrix"] = temporal_topology["graph"]["distance_matrix"]
+            sat_graph["latency_matrix"].data[:] = edge_latencies
+            sat_graph["distance_matrix"].data[:] = edge_distances
+        else:
+            sat_graph["latency_matrix"] = get_sparse_matrix_of_sorted_edges(node_num, edge_keys, edge_latencies)
+            sat_graph["distance_matrix"] = get_sparse_matrix_of_sorted_edges(node_num, edge_keys, edge_distances)
+    temporal_topology["time"] = current_date_time_string
+    temporal_topology["graph_backend"] = graph_backend
+    temporal_topology["graph"] = sat_graph
+    temporal_topology["node_names"] = node_names
+    temporal_topology["edge_keys"] = edge_keys
+    return sat_graph
+
+def get_path_record(G, path: list):
+    # Get the per-segment and total distances / latencies, and node locations of a path in the routing graph
+    latencies = list()
+    distances = list()
+    path_latency = 0
+    path_distance = 0
+    for i in range(len(path) - 1):
+        distances.append(G[path[i]][path[i + 1]]['distance'])
+        latencies.append(G[path[i]][path[i + 1]]['latency'])
+        path_distance += G[path[i]][path[i + 1]]['distance']
+        path_latency += G[path[i]][path[i + 1]]['latency']
+    lats = [G.nodes[node]['lat'] for node in path]
+    lons = [G.nodes[node]['lon'] for node in path]
+    return {
+        "path": path,
+        "lats": lats,
+        "lons": lons,
+        "distances": distances,
+        "latencies": latencies,
+        "path_distance": path_distance,
+        "path_latency": path_latency
+    }
+
 def get_shortest_paths(sat_graph, s_relay: list, d_relay: list, max_path_limit: int = 10):
     # Get the shortest paths from src_relay to dst_relay
     # According to the provided routing graph
-    source = "r_" + s_relay[0] + '(' + s_relay[1] + ')'
-    target = "r_" + d_relay[0] + '(' + d_relay[1] + ')'
+    source = get_relay_node_name(s_relay)
+    target = get_relay_node_name(d_relay)
     all_shortest_paths = nx.shortest_simple_paths(sat_graph,
                                                   source = source,
                                                   target = target,
@@ -321,36 +543,9 @@ def get_shortest_paths(sat_graph, s_relay: list, d_relay: list, max_path_limit:
 
     # `all_shortest_paths` is a generator
     top_n_shortest_paths = list()
-
-    def get_path_distance_latency(G, path):
-        latencies = list()
-        distances = list()
-        path_latency = 0
-        path_distance = 0
-        for i in range(len(path) - 1):
-            distances.append(G[path[i]][path[i + 1]]['distance'])
-            latencies.append(G[path[i]][path[i + 1]]['latency'])
-            path_distance += G[path[i]][path[i + 1]]['distance']
-            path_latency += G[path[i]][path[i + 1]]['latency']
-        return distances, latencies, path_distance, path_latency
-
-    def get_path_node_location(G, path):
-        lats = [G.nodes[node]['lat'] for node in path]
-        lons = [G.nodes[node]['lon'] for node in path]
-        return lats, lons
     try:
         for path in all_shortest_paths:
-            distances, latencies, path_distance, path_latency = get_path_distance_latency(sat_graph, path)
-            lats, lons = get_path_node_location(sat_graph, path)
-            top_n_shortest_paths.append({
-                "path": path,
-                "lats": lats,
-                "lons": lons,
-                "distances": distances,
-                "latencies": latencies,
-                "path_distance": path_distance,
-                "path_latency": path_latency
-            })
+            top_n_shortest_paths.append(get_path_record(sat_graph, path))
             if len(top_n_shortest_paths) >= max_path_limit:
                 break
     except:
@@ -359,8 +554,113 @@ def get_shortest_paths(sat_graph, s_relay: list, d_relay: list, max_path_limit:
 
     return top_n_shortest_paths
 
+def get_path_latency(sat_graph, path: list):
+    # Latency of a path on the routing graph, None if an edge of the path is not in the graph
+    latency = 0
+    for i in range(len(path) - 1):
+        if not sat_graph.has_edge(path[i], path[i + 1]):
+            return None
+        latency += sat_graph[path[i]][path[i + 1]]['latency']
+    return latency
+
+def get_shortest_paths_from_one_source(sat_graph, s_relay: list, d_relays: list, previous_paths: list = None):
+    # Get the shortest path from src_relay to every dst_relay with a single Dijkstra run
+    # previous_paths: a path (node names) to every dst_relay, e.g., the ones of the previous time point,
+    #                 if they are all still in the graph, the search stops beyond the latency of the longest one
+    # output: { dst_relay_name: [path record] }, an empty list if dst_relay is unreachable
+    source = get_relay_node_name(s_relay)
+    cutoff = None
+    if previous_paths is not None:
+        previous_latencies = [get_path_latency(sat_graph, path) for path in previous_paths]
+        if None not in previous_latencies:
+            # margin for latency sums rounded in another order
+            cutoff = max(previous_latencies) * (1 + SHORTEST_PATH_CUTOFF_MARGIN)
+    predecessors, _ = nx.dijkstra_predecessor_and_distance(sat_graph, source, cutoff = cutoff, weight = "latency")
+    shortest_paths = dict()
+    for d_relay in d_relays:
+        target = get_relay_node_name(d_relay)
+        if target not in predecessors:
+            verbose_print("It seems that there are not enough paths between", source, "and", target, level = 0)
+            shortest_paths[target] = []
+            continue
+        # walk back the predecessor tree
+        path = [target]
+        while path[-1] != source:
+            path.append(predecessors[path[-1]][0])
+        shortest_paths[target] = [get_path_record(sat_graph, path[::-1])]
+    return shortest_paths
+
+def route_hops_from_one_source(sat_graph,
+                               hops_from_source: dict,
+                               sat_positions: dict,
+                               ground_stations: list,
+                               point_of_presences: list,
+                               link_connectivity: dict,
+                               gs_satellite_link_mode: str,
+                               sat_ecdf: ECDF,
+                               ter_ecdf: ECDF,
+                               max_path_limit: int,
+                               graph_backend: str = "networkx",
+                               terrestrial_edge_cache: dict = None,
+                               previous_hops_paths: dict = None):
+    # Route all hops sharing the same source relay on the (per time step) satellite graph
+    # max_path_limit == 1: one Dijkstra from the source for all destinations
+    # max_path_limit > 1: k-shortest paths hop by hop
+    # graph_backend: "networkx" for a nx.DiGraph from `generate_sat_graph`, "csgraph" for a sparse graph from `build_sparse_sat_graph`
+    # previous_hops_paths: { hop_id: top_n_shortest_paths } of the previous time point, bounding the single Dijkstra run
+    # output: { hop_id: top_n_shortest_paths }
+    s_relay = next(iter(hops_from_source.values()))[0]
+    previous_paths = None
+    if previous_hops_paths is not None and all([len(previous_hops_paths.get(hop_id, [])) > 0 for hop_id in hops_from_source.keys()]):
+        previous_paths = [previous_hops_paths[hop_id][0]["path"] for hop_id in hops_from_source.keys()]
+    edges_from_source = get_graph_edges_from_src_relay(s_relay, sat_positions, link_connectivity, gs_satellite_link_mode, sat_ecdf)
+    hops_paths = dict()
+    if graph_backend == "csgraph":
+        if max_path_limit == 1:
+            relay_nodes = dict()
+            edges_with_relays = list(edges_from_source)
+            for hop in hops_from_source.values():
+                relay_nodes.update(get_graph_relay_nodes(hop[0], hop[1]))
+                edges_with_relays += get_graph_edges_to_dst_relay(hop[0], hop[1], ground_stations, point_of_presences, link_connectivity, ter_ecdf, terrestrial_edge_cache)
+            sparse_graph_with_relays = get_sparse_sat_graph_with_relays(sat_graph, relay_nodes, edges_with_relays)
+            shortest_paths = get_sparse_shortest_paths_from_one_source(sparse_graph_with_relays,
+                                                                       get_relay_node_name(s_relay),
+                                                                       [get_relay_node_name(hop[1]) for hop in hops_from_source.values()],
+                                                                       previous_paths)
+            for hop_id, hop in hops_from_source.items():
+                hops_paths[hop_id] = shortest_paths[get_relay_node_name(hop[1])]
+        else:
+            for hop_id, hop in hops_from_source.items():
+                relay_nodes = get_graph_relay_nodes(hop[0], hop[1])
+                edges_with_relays = edges_from_source + get_graph_edges_to_dst_relay(hop[0], hop[1], ground_stations, point_of_presences, link_connectivity, ter_ecdf, terrestrial_edge_cache)
+                sparse_graph_with_relays = get_sparse_sat_graph_with_relays(sat_graph, relay_nodes, edges_with_relays)
+                hops_paths[hop_id] = get_sparse_k_shortest_paths(sparse_graph_with_relays, get_relay_node_name(hop[0]), get_relay_node_name(hop[1]), max_path_limit)
+    elif max_path_limit == 1:
+        relay_nodes = dict()
+        edges_with_relays = list(edges_from_source)
+        for hop in hops_from_source.values():
+            relay_nodes.update(get_graph_relay_nodes(hop[0], hop[1]))
+            edges_with_relays += get_graph_edges_to_dst_relay(hop[0], hop[1], ground_stations, point_of_presences, link_connectivity, ter_ecdf, terrestrial_edge_cache)
+        attach_relays_to_sat_graph(sat_graph, relay_nodes, edges_with_relays)
+        try:
+            shortest_paths = get_shortest_paths_from_one_source(sat_graph, s_relay, [hop[1] for hop in hops_from_source.values()], previous_paths)
+        finally:
+            detach_relays_from_sat_graph(sat_graph, relay_nodes)
+        for hop_id, hop in hops_from_source.items():
+            hops_paths[hop_id] = shortest_paths[get_relay_node_name(hop[1])]
+    else:
+        for hop_id, hop in hops_from_source.items():
+            relay_nodes = get_graph_relay_nodes(hop[0], hop[1])
+            edges_with_relays = edges_from_source + get_graph_edges_to_dst_relay(hop[0], hop[1], ground_stations, point_of_presences, link_connectivity, ter_ecdf, terrestrial_edge_cache)
+            attach_relays_to_sat_graph(sat_graph, relay_nodes, edges_with_relays)
+            try:
+                hops_paths[hop_id] = get_shortest_paths(sat_graph, hop[0], hop[1], max_path_limit)
+            finally:
+                detach_relays_from_sat_graph(sat_graph, relay_nodes)
+    return hops_paths
+
 def path_simulate_one_time_many_hops(hops: dict,
-                                     satellites: list,
+                                     constellation: dict,
                                      ground_stations: list,
                                      point_of_presences: list,
                                      current_date_time_string: str,
@@ -368,10 +668,58 @@ def path_simulate_one_time_many_hops(hops: dict,
                                      gs_satellite_link_mode: str,
                                      sat_ecdf: ECDF,
                                      ter_ecdf: ECDF,
-                                     if_path_print: bool = False):
+                                     if_path_print: bool = False,
+                                     max_path_limit: int = 10,
+                                     graph_backend: str = "networkx",
+                                     terrestrial_edge_cache: dict = None,
+                                     temporal_topology: dict = None):
+    # terrestrial_edge_cache: from `build_terrestrial_edge_cache`, once per run; a "resample" cache is used if not given
+    # temporal_topology: from `create_temporal_topology`, carried over the time points of a run, see "Temporal topology"
+    if terrestrial_edge_cache is None:
+        terrestrial_edge_cache = get_terrestrial_edge_cache(ground_stations, point_of_presences)
+    sat_positions = get_constellation_positions_at_time_t(constellation, current_date_time_string)
+    sat_nodes_in_graph, gs_nodes_in_graph, pop_nodes_in_graph = get_graph_sat_gs_nodes_at_time_t(sat_positions, ground_stations, point_of_presences)
+    # the graph without relays is the same for all hops at this time point, build it once
+    graph_time_start = time.time()
+    previous_hops_paths = None
+    if temporal_topology is not None:
+        edge_columns = get_graph_edge_columns_no_relay(sat_positions, ground_stations, point_of_presences, link_connectivity, gs_satellite_link_mode, sat_ecdf, ter_ecdf, terrestrial_edge_cache)
+        sat_graph_this_time = update_temporal_sat_graph(temporal_topology, current_date_time_string, sat_nodes_in_graph, gs_nodes_in_graph, pop_nodes_in_graph,
+                                                        edge_columns, get_graph_node_names(sat_positions, ground_stations, point_of_presences), graph_backend)
+        previous_hops_paths = temporal_topology["hops_paths"]
+    elif graph_backend == "csgraph":
+        edges_no_relays = get_graph_edges_no_relay(sat_positions, ground_stations, point_of_presences, link_connectivity, gs_satellite_link_mode, sat_ecdf, ter_ecdf, terrestrial_edge_cache)
+        sat_graph_this_time = build_sparse_sat_graph(sat_nodes_in_graph, gs_nodes_in_graph, pop_nodes_in_graph, edges_no_relays)
+    else:
+        edges_no_relays = get_graph_edges_no_relay(sat_positions, ground_stations, point_of_presences, link_connectivity, gs_satellite_link_mode, sat_ecdf, ter_ecdf, terrestrial_edge_cache)
+        sat_graph_this_time = generate_sat_graph(dict(), sat_nodes_in_graph, gs_nodes_in_graph, pop_nodes_in_graph, edges_no_relays, [])
+    verbose_print("Graph generation time", time.time() - graph_time_start, "seconds.", level = 0)
+
+    # many hops share the same source relay, e.g., all first hops from the client
+    hops_by_source = dict()
+    for hop_id, hop in hops.items():
+        hops_by_source.setdefault(get_relay_node_name(hop[0]), dict())[hop_id] = hop
+
+    hops_paths = dict()
+    for source, hops_from_source in hops_by_source.items():
+        path_time_start = time.time()
+        hops_paths.update(route_hops_from_one_source(sat_graph_this_time,
+                                                     hops_from_source,
+                                                     sat_positions,
+                                                     ground_stations,
+                                                     point_of_presences,
+                                                     link_connectivity,
+                                                     gs_satellite_link_mode,
+                                                     sat_ecdf,
+                                                     ter_ecdf,
+                                                     max_path_limit,
+                                                     graph_backend,
+                                                     terrestrial_edge_cache,
+                                                     previous_hops_paths))
+        verbose_print("Relay attachment and path finding time for", len(hops_from_source), "hops from", source, time.time() - path_time_start, "seconds.", level = 0)
+    if temporal_topology is not None:
+        temporal_topology["hops_paths"] = hops_paths
 
-    sat_nodes_in_graph, gs_nodes_in_graph, pop_nodes_in_graph = get_graph_sat_gs_nodes_at_time_t(satellites, ground_stations, point_of_presences, current_date_time_string)
-    edges_no_relays = get_graph_edges_no_relay(satellites, ground_stations, point_of_presences, current_date_time_string, link_connectivity, gs_satellite_link_mode, sat_ecdf, ter_ecdf)
     hops_simulation_results_at_time_t = {
         "time": current_date_time_string,
         "results": dict()
@@ -383,23 +731,7 @@ def path_simulate_one_time_many_hops(hops: dict,
         d_relay = hop[1]
         verbose_print("THIS HOP FROM", s_relay[1], s_relay[2], '(' + str(s_relay[4]) + ',' + str(s_relay[5]) + ')',
               "TO", d_relay[1], d_relay[2], '(' + str(d_relay[4]) + ',' + str(d_relay[5]) + ')', level = 0)
-
-        relay_nodes = get_graph_relay_nodes(s_relay, d_relay)
-        edges_with_relays = get_graph_edges_with_relay(s_relay,
-                                                       d_relay,
-                                                       satellites,
-                                                       ground_stations,
-                                                       point_of_presences,
-                                                       current_date_time_string,
-                                                       link_connectivity,
-                                                       gs_satellite_link_mode,
-                                                       sat_ecdf,
-                                                       ter_ecdf)
-        graph_path_time_start = time.time()
-        sat_graph_this_time_hop = generate_sat_graph(relay_nodes, sat_nodes_in_graph, gs_nodes_in_graph, pop_nodes_in_graph, edges_no_relays, edges_with_relays)
-        top_n_shortest_paths = get_shortest_paths(sat_graph_this_time_hop, s_relay, d_relay)
-        graph_path_time_end = time.time()
-        verbose_print("Graph generation and path finding time", graph_path_time_end - graph_path_time_start, "seconds.", level = 0)
+        top_n_shortest_paths = hops_paths[hop_id]
 
         if len(top_n_shortest_paths) == 0:
             no_path_count += 1
@@ -424,16 +756,16 @@ def path_simulate_one_time_many_hops(hops: dict,
     return hops_simulation_results_at_time_t
 
 def get_hops_distance_in_circuits(geo_extended_circuits: list):
-    hops_info = dict()
+    hops_coordinates = dict()
     for circuit in geo_extended_circuits:
         for i in range(len(circuit) - 1):
             s_relay = circuit[i]
             d_relay = circuit[i + 1]
             hop_id = generate_hop_id(s_relay, d_relay)
-            dis = distance_between_ground_stations([s_relay[4], s_relay[5]],
-                                                   [d_relay[4], d_relay[5]])
-            hops_info[hop_id] = dis
-    return hops_info
+            hops_coordinates[hop_id] = [s_relay[4], s_relay[5], d_relay[4], d_relay[5]]
+    hops_coordinates_array = np.array(list(hops_coordinates.values()), dtype = np.float64).reshape(-1, 4)
+    distances = great_circle_distances(hops_coordinates_array[:, 0], hops_coordinates_array[:, 1], hops_coordinates_array[:, 2], hops_coordinates_array[:, 3])
+    return dict(zip(hops_coordinates.keys(), distances.tolist()))
 
 def calculate_hops_terrestrial_latency(circuits: list, latency_mode: str):
     # break circuits into hops, and calculate the terrestrial latency of each hop
@@ -0,0 +1,187 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra, yen
+from utils import *
+
+## Compressed sparse routing graph ##
+# An alternative to the networkx routing graph: nodes are indexed (satellites, ground stations, PoPs, then relays),
+# edges are kept as float32 CSR latency / distance matrices, and paths are searched with scipy.sparse.csgraph.
+# Path records are the same as the ones of `get_path_record` in simulation.py.
+
+SPARSE_SHORTEST_PATH_LIMIT_MARGIN = 1e-6
+
+def build_sparse_sat_graph(sat_nodes: dict, gs_nodes: dict, pop_nodes: dict, edges_no_relays: list):
+    # input: the same nodes and no-relay edges as `generate_sat_graph`
+    # output: a sparse graph dict with its CSR matrices, built once per time point,
+    #         relays are overlaid per source with `get_sparse_sat_graph_with_relays`
+    node_names = list(sat_nodes.keys()) + list(gs_nodes.keys()) + list(pop_nodes.keys())
+    node_locations = list(sat_nodes.values()) + list(gs_nodes.values()) + list(pop_nodes.values())
+    node_index = {node_name: index for index, node_name in enumerate(node_names)}
+    latency_matrix, distance_matrix = get_sparse_sat_graph_matrices(len(node_names),
+                                                                    np.array([node_index[edge["src"]] for edge in edges_no_relays], dtype = np.int32),
+                                                                    np.array([node_index[edge["dst"]] for edge in edges_no_relays], dtype = np.int32),
+                                                                    np.array([edge["latency"] for edge in edges_no_relays], dtype = np.float32),
+                                                                    np.array([edge["distance"] for edge in edges_no_relays], dtype = np.float32))
+    sparse_graph = {
+        "node_names": node_names,
+        "node_index": node_index,
+        "lats": [node_location[0] for node_location in node_locations],
+        "lons": [node_location[1] for node_location in node_locations],
+        "latency_matrix": latency_matrix,
+        "distance_matrix": distance_matrix
+    }
+    return sparse_graph
+
+def get_sparse_sat_graph_with_relays(sparse_graph: dict, relay_nodes: dict, edges_with_relays: list):
+    # Overlay relay nodes and their edges on the graph without relays, the latter is left untouched
+    # relay nodes: { relay_name: [ip, port, lat, lon] }
+    # relays get the last node indices, and every relay edge has a relay end: the relay edges are the relay rows,
+    # appended to the matrices, and the relay columns, appended to the rows of the graph without relays (keeping them sorted)
+    node_names = sparse_graph["node_names"] + [relay_name for relay_name in relay_nodes.keys() if relay_name not in sparse_graph["node_index"]]
+    node_index = dict(sparse_graph["node_index"])
+    lats = list(sparse_graph["lats"])
+    lons = list(sparse_graph["lons"])
+    for relay_name, relay_info in relay_nodes.items():
+        if relay_name not in node_index:
+            node_index[relay_name] = len(node_index)
+            lats.append(relay_info[2])
+            lons.append(relay_info[3])
+    relay_matrices = get_sparse_sat_graph_matrices(len(node_names),
+                                                   np.array([node_index[edge["src"]] for edge in edges_with_relays], dtype = np.int32),
+                                                   np.array([node_index[edge["dst"]] for edge in edges_with_relays], dtype = np.int32),
+                                                   np.array([edge["latency"] for edge in edges_with_relays], dtype = np.float32),
+                                                   np.array([edge["distance"] for edge in edges_with_relays], dtype = np.float32))
+    base_node_num = len(sparse_graph["node_names"])
+    latency_matrix, distance_matrix = [overlay_sparse_relay_edges(base_matrix, relay_matrix, base_node_num)
+                                       for base_matrix, relay_matrix in zip([sparse_graph["latency_matrix"], sparse_graph["distance_matrix"]], relay_matrices)]
+    return {
+        "node_names": node_names,
+        "node_index": node_index,
+        "lats": lats,
+        "lons": lons,
+        "latency_matrix": latency_matrix,
+        "distance_matrix": distance_matrix
+    }
+
+def get_sorted_unique_edges(node_num: int, src: np.ndarray, dst: np.ndarray):
+    # output: the keys (src * node_num + dst) of the distinct edges in ascending order, i.e., in CSR order,
+    #         and the column position of each of them
+    # as in nx.DiGraph, an edge added again replaces the previous one (the last one is kept)
+    edge_keys = src.astype(np.int64) * node_num + dst
+    sorted_edge_keys, last_positions = np.unique(edge_keys[::-1], return_index = True)
+    return sorted_edge_keys, len(edge_keys) - 1 - last_positions
+
+def get_sparse_matrix_of_sorted_edges(node_num: int, sorted_edge_keys: np.ndarray, data: np.ndarray):
+    # CSR matrix of the distinct edges of `get_sorted_unique_edges`, with their data in the same order, without sorting them again
+    indptr = np.searchsorted(sorted_edge_keys, np.arange(node_num + 1, dtype = np.int64) * node_num)
+    matrix = csr_matrix((data, sorted_edge_keys % node_num, indptr), shape = (node_num, node_num))
+    # edges are looked up by bisection in their row, see `get_sparse_path_record`; rows are sorted, `sort_indices` only checks it
+    matrix.sort_indices()
+    return matrix
+
+def get_sparse_sat_graph_matrices(node_num: int, src: np.ndarray, dst: np.ndarray, latency: np.ndarray, distance: np.ndarray):
+    # CSR latency and distance matrices of edge columns, column indices sorted in each row
+    sorted_edge_keys, positions = get_sorted_unique_edges(node_num, src, dst)
+    return (get_sparse_matrix_of_sorted_edges(node_num, sorted_edge_keys, latency[positions]),
+            get_sparse_matrix_of_sorted_edges(node_num, sorted_edge_keys, distance[positions]))
+
+def overlay_sparse_relay_edges(base_matrix: csr_matrix, relay_matrix: csr_matrix, base_node_num: int):
+    # input: the (base nodes, base nodes) matrix without relays, the (all nodes, all nodes) matrix of the relay edges
+    # output: the (all nodes, all nodes) matrix of both, in a linear pass without sorting the edges again
+    node_num = relay_matrix.shape[0]
+    relay_indptr = relay_matrix.indptr.astype(np.int64)
+    # relay columns of the base rows go after the base columns of their row, as their indices are larger
+    relay_column_counts = np.diff(relay_indptr[:base_node_num + 1])
+    insert_positions = np.repeat(base_matrix.indptr[1:], relay_column_counts)
+    base_relay_num = relay_indptr[base_node_num]
+    indices = np.concatenate([np.insert(base_matrix.indices, insert_positions, relay_matrix.indices[:base_relay_num]), relay_matrix.indices[base_relay_num:]])
+    data = np.concatenate([np.insert(base_matrix.data, insert_positions, relay_matrix.data[:base_relay_num]), relay_matrix.data[base_relay_num:]])
+    indptr = np.concatenate([base_matrix.indptr + relay_indptr[:base_node_num + 1], base_matrix.nnz + relay_indptr[base_node_num + 1:]])
+    # rows stay sorted if both inputs are, `sort_indices` only checks it then
+    matrix = csr_matrix((data, indices, indptr), shape = (node_num, node_num))
+    matrix.sort_indices()
+    return matrix
+
+def get_sparse_path_record(sparse_graph: dict, latency_matrix: csr_matrix, distance_matrix: csr_matrix, path_indices: list):
+    # Same record as `get_path_record`, from node indices of a path
+    # the matrices have sorted column indices in each row, as built by `get_sparse_sat_graph_matrices`
+    assert latency_matrix.has_sorted_indices and distance_matrix.has_sorted_indices
+    latencies = list()
+    distances = list()
+    for i in range(len(path_indices) - 1):
+        row_start = latency_matrix.indptr[path_indices[i]]
+        row_end = latency_matrix.indptr[path_indices[i] + 1]
+        position = row_start + np.searchsorted(latency_matrix.indices[row_start: row_end], path_indices[i + 1])
+        latencies.append(float(latency_matrix.data[position]))
+        distances.append(float(distance_matrix.data[position]))
+    return {
+        "path": [sparse_graph["node_names"][node] for node in path_indices],
+        "lats": [sparse_graph["lats"][node] for node in path_indices],
+        "lons": [sparse_graph["lons"][node] for node in path_indices],
+        "distances": distances,
+        "latencies": latencies,
+        "path_distance": sum(distances),
+        "path_latency": sum(latencies)
+    }
+
+def walk_back_predecessors(predecessors: np.ndarray, source_index: int, target_index: int):
+    # output: node indices of the path from source to target, None if target is unreachable
+    if target_index != source_index and predecessors[target_index] < 0:
+        return None
+    path_indices = [target_index]
+    while path_indices[-1] != source_index:
+        path_indices.append(int(predecessors[path_indices[-1]]))
+    return path_indices[::-1]
+
+def get_sparse_path_latency(sparse_graph: dict, latency_matrix: csr_matrix, path: list):
+    # Latency of a path (node names), None if a node or an edge of the path is not in the graph
+    assert latency_matrix.has_sorted_indices
+    latency = 0
+    for i in range(len(path) - 1):
+        if path[i] not in sparse_graph["node_index"] or path[i + 1] not in sparse_graph["node_index"]:
+            return None
+        src, dst = sparse_graph["node_index"][path[i]], sparse_graph["node_index"][path[i + 1]]
+        row_start, row_end = latency_matrix.indptr[src], latency_matrix.indptr[src + 1]
+        position = row_start + np.searchsorted(latency_matrix.indices[row_start: row_end], dst)
+        if position >= row_end or latency_matrix.indices[position] != dst:
+            return None
+        latency += float(latency_matrix.data[position])
+    return latency
+
+def get_sparse_shortest_paths_from_one_source(sparse_graph: dict, source: str, targets: list, previous_paths: list = None):
+    # Shortest path from source to every target with a single Dijkstra run
+    # previous_paths: as in `get_shortest_paths_from_one_source`, bounding the search when they are all still in the graph
+    # output: { target: [path record] }, an empty list if target is unreachable
+    latency_matrix, distance_matrix = sparse_graph["latency_matrix"], sparse_graph["distance_matrix"]
+    source_index = sparse_graph["node_index"][source]
+    limit = np.inf
+    if previous_paths is not None:
+        previous_latencies = [get_sparse_path_latency(sparse_graph, latency_matrix, path) for path in previous_paths]
+        if None not in previous_latencies:
+            # margin for float32 latencies summed in another order
+            limit = max(previous_latencies) * (1 + SPARSE_SHORTEST_PATH_LIMIT_MARGIN)
+    _, predecessors = dijkstra(latency_matrix, directed = True, indices = source_index, return_predecessors = True, limit = limit)
+    shortest_paths = dict()
+    for target in targets:
+        path_indices = walk_back_predecessors(predecessors, source_index, sparse_graph["node_index"][target])
+        if path_indices is None:
+            verbose_print("It seems that there are not enough paths between", source, "and", target, level = 0)
+            shortest_paths[target] = []
+        else:
+            shortest_paths[target] = [get_sparse_path_record(sparse_graph, latency_matrix, distance_matrix, path_indices)]
+    return shortest_paths
+
+def get_sparse_k_shortest_paths(sparse_graph: dict, source: str, target: str, max_path_limit: int):
+    # Up to `max_path_limit` loopless shortest paths from source to target (Yen's algorithm)
+    latency_matrix, distance_matrix = sparse_graph["latency_matrix"], sparse_graph["distance_matrix"]
+    source_index = sparse_graph["node_index"][source]
+    target_index = sparse_graph["node_index"][target]
+    _, predecessors = yen(latency_matrix, source_index, target_index, K = max_path_limit, directed = True, return_predecessors = True)
+    top_n_shortest_paths = list()
+    for path_predecessors in predecessors:
+        path_indices = walk_back_predecessors(path_predecessors, source_index, target_index)
+        if path_indices is not None:
+            top_n_shortest_paths.append(get_sparse_path_record(sparse_graph, latency_matrix, distance_matrix, path_indices))
+    if len(top_n_shortest_paths) < max_path_limit:
+        verbose_print("It seems that there are not enough paths between", source, "and", target, level = 0)
+    return top_n_shortest_paths
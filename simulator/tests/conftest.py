@@ -0,0 +1,31 @@
+import pytest
+from small_fixtures import *
+
+@pytest.fixture(scope = "session")
+def constellation():
+    return build_constellation(read_satellite_catalogue(FILENAME_TLES))
+
+@pytest.fixture(scope = "session")
+def ground_stations():
+    return read_ground_stations(os.path.join(SIMULATOR_DIR, "data/constellation/starlink_ground_stations.json"))
+
+@pytest.fixture(scope = "session")
+def point_of_presences():
+    return read_point_of_presences(os.path.join(SIMULATOR_DIR, "data/constellation/starlink_pops.json"))
+
+@pytest.fixture(scope = "session")
+def hops():
+    hops, _ = parse_hops_in_circuits(CIRCUITS)
+    return hops
+
+@pytest.fixture(scope = "session")
+def simulation_results(constellation, ground_stations, point_of_presences, hops):
+    # Results of the fixture hops at all fixture time points, with sampled speeds and 3 k-shortest paths per hop
+    sat_ecdf = get_speed_ECDF([LIGHT_SPEED * 0.9, LIGHT_SPEED * 0.95, LIGHT_SPEED])
+    ter_ecdf = get_speed_ECDF([TERRESTRIAL_TRANS_SPEED * 0.8, TERRESTRIAL_TRANS_SPEED])
+    simulation_results = list()
+    for t_index, time_point in enumerate(TIME_POINTS):
+        set_sampling_seed([0, 0, t_index])
+        simulation_results.append(path_simulate_one_time_many_hops(hops, constellation, ground_stations, point_of_presences, time_point,
+                                                                   get_link_connectivity("single-bent-pipe"), "all-visible", sat_ecdf, ter_ecdf, max_path_limit = 3))
+    return simulation_results
@@ -0,0 +1,34 @@
+import os
+import sys
+
+# the simulator modules are flat and import each other by name
+SIMULATOR_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SIMULATOR_DIR not in sys.path:
+    sys.path.insert(0, SIMULATOR_DIR)
+
+from simulation import *
+from run_simulation import get_link_connectivity
+import utils
+utils.GLOBAL_VERBOSE_LEVEL = 3
+
+FILENAME_TLES = os.path.join(SIMULATOR_DIR, "data/constellation/starlink_satellite_TLEs_06-09-2024.txt")
+
+# -------------------- SMALL FIXTURES ----------------------#
+# A client and a few relays, hops and latencies are derived from them by fixed formulas (no random generator),
+# so that the pinned values do not depend on the numpy version
+TIME_POINTS = ["2024/8/12 20:00:00", "2024/8/12 20:01:00"]
+CLIENT = ["unknown", "Berlin", "0.0.0.0", 0, 52.52, 13.405]
+RELAYS = [
+    ["FP0", "relay0", "1.0.0.0", 9001, 48.8566, 2.3522],
+    ["FP1", "relay1", "1.0.0.1", 9001, 50.1109, 8.6821],
+    ["FP2", "relay2", "1.0.0.2", 9001, 52.3676, 4.9041],
+    ["FP3", "relay3", "1.0.0.3", 9001, 40.7128, -74.006],
+    ["FP4", "relay4", "1.0.0.4", 9001, 59.3293, 18.0686],
+    ["FP5", "relay5", "1.0.0.5", 9001, 45.5017, -73.5673]
+]
+CIRCUITS = [
+    [CLIENT, RELAYS[0], RELAYS[1], RELAYS[3]],
+    [CLIENT, RELAYS[2], RELAYS[4], RELAYS[5]],
+    [CLIENT, RELAYS[1], RELAYS[0], RELAYS[2]],
+    [CLIENT, RELAYS[4], RELAYS[3], RELAYS[1]]
+]
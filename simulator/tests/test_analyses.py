@@ -0,0 +1,147 @@
+import json
+import math
+import numpy as np
+import pandas as pd
+import pytest
+import dataget
+from small_fixtures import *
+from analyses import *
+
+HOP_IDS = [generate_hop_id(circuit[i], circuit[i + 1]) for circuit in CIRCUITS[:2] for i in range(len(circuit) - 1)]
+
+def get_path_record(latencies: list):
+    # a path relay -> satellite -> ground station -> PoP -> relay: two satellite segments, then two terrestrial ones
+    nodes = ["r_a", "s_0", "g_0", "p_0", "r_b"]
+    return {
+        "path": nodes,
+        "lats": [0.0] * len(nodes),
+        "lons": [0.0] * len(nodes),
+        "distances": [latency * 2e8 for latency in latencies],
+        "latencies": latencies,
+        "path_distance": sum(latencies) * 2e8,
+        "path_latency": sum(latencies)
+    }
+
+def get_time_points():
+    # hop 0 has two paths, of satellite latencies 3 and 5 and terrestrial latencies 7 and 9, then one path
+    # hop 1 has no path, then one; the other hops have no path
+    return [
+        {"time": TIME_POINTS[0], "results": {HOP_IDS[0]: [get_path_record([1, 2, 3, 4]), get_path_record([2, 3, 4, 5])], HOP_IDS[1]: []}},
+        {"time": TIME_POINTS[1], "results": {HOP_IDS[0]: [get_path_record([1, 1, 1, 1])], HOP_IDS[1]: [get_path_record([0.5, 0.5, 2, 2])]}}
+    ]
+
+def write_text_simulation_record(sim_record_filename: str, time_points: list):
+    with open(sim_record_filename, 'w') as sim_record_file:
+        sim_record_file.write("Simulation starts at " + TIME_POINTS[0] + "\n")
+        for time_point in time_points:
+            sim_record_file.write(json.dumps(time_point) + '\n')
+
+@pytest.mark.parametrize("record_format", ["text", "columnar"])
+def test_hops_latency_tensor(tmp_path, record_format):
+    sim_record_path = str(tmp_path / "sim")
+    if record_format == "text":
+        write_text_simulation_record(sim_record_path, get_time_points())
+    else:
+        record_writer = create_columnar_simulation_record(sim_record_path, dict())
+        for time_point in get_time_points():
+            append_columnar_simulation_record(record_writer, time_point)
+    hop_latencies = get_hops_latency_tensor(HOP_IDS, [sim_record_path], [1, 2])
+    assert hop_latencies.shape == (len(HOP_IDS), 2, 2)
+    # mean over the paths of factor * satellite latency + terrestrial latency
+    assert hop_latencies[0, 0].tolist() == [12, 16]
+    assert hop_latencies[0, 1].tolist() == [4, 6]
+    assert hop_latencies[1, 0].tolist() == [math.inf, math.inf]
+    assert hop_latencies[1, 1].tolist() == [5, 6]
+    assert np.all(np.isinf(hop_latencies[2:]))
+
+def test_hops_raw_simulation_data_round_trips_through_csv(tmp_path):
+    sim_record_filename = str(tmp_path / "sim.txt")
+    write_text_simulation_record(sim_record_filename, get_time_points())
+    csv_hops_info = extract_hops_raw_simulation_data(CIRCUITS[:2], [sim_record_filename], [1, 2])
+    assert csv_hops_info["hop_id"] == HOP_IDS
+    assert csv_hops_info["hop_satellite_inaccessible_time_points"] == [0, 1] + [2] * (len(HOP_IDS) - 2)
+    assert csv_hops_info["hop_distance (m)"][0] == pytest.approx(distance_between_ground_stations(CLIENT[4:6], RELAYS[0][4:6]))
+    pd.DataFrame(csv_hops_info).to_csv(str(tmp_path / "hops.csv"), index = False)
+    hops_dataframe, hop_latencies = read_hops_latency_csv(str(tmp_path / "hops.csv"))
+    assert hops_dataframe["hop_id"].tolist() == HOP_IDS
+    assert np.array_equal(hop_latencies, get_hops_latency_tensor(HOP_IDS, [sim_record_filename], [1, 2]))
+
+def write_terrestrial_csv(filename: str, hop_ids: list, latencies: list):
+    pd.DataFrame({"hop_id": hop_ids, "hop_distance (m)": [1e6] * len(hop_ids), "terrestrial_latency (ms)": latencies}).to_csv(filename, index = False)
+
+def test_hops_terrestrial_dataframe_reads_the_range_files(tmp_path):
+    # ranges of any size, sorted by range start rather than by name
+    for range_start, range_end in [(1000, 10000), (0, 100), (100, 1000)]:
+        write_terrestrial_csv(str(tmp_path / ("hops_" + str(range_start) + "-" + str(range_end) + ".csv")), ["h" + str(range_start)], [float(range_start)])
+    # other files, e.g., hop groups of the satellite latencies, are not read
+    write_terrestrial_csv(str(tmp_path / "hops_stale.csv"), ["h0"], [100.0])
+    write_terrestrial_csv(str(tmp_path / "hops_0-100.csv.bak"), ["h0"], [100.0])
+    assert get_terrestrial_csv_filenames(str(tmp_path) + "/") == ["hops_0-100.csv", "hops_100-1000.csv", "hops_1000-10000.csv"]
+    terrestrial_dataframe = get_hops_terrestrial_dataframe(str(tmp_path) + "/")
+    assert terrestrial_dataframe["hop_id"].tolist() == ["h0", "h100", "h1000"]
+    assert terrestrial_dataframe["terrestrial_latency (ms)"].tolist() == [0, 100, 1000]
+    # a directory without range files
+    os.makedirs(str(tmp_path / "empty"))
+    with pytest.raises(ValueError):
+        get_hops_terrestrial_dataframe(str(tmp_path / "empty") + "/")
+
+def test_hops_terrestrial_dataframe_overlaps(tmp_path):
+    write_terrestrial_csv(str(tmp_path / "a.csv"), ["h0", "h1"], [1.0, 2.0])
+    write_terrestrial_csv(str(tmp_path / "b.csv"), ["h1", "h2"], [2.0, 3.0])
+    write_terrestrial_csv(str(tmp_path / "c.csv"), ["h2"], [4.0])
+    assert get_hops_terrestrial_dataframe(str(tmp_path) + "/", ["a.csv", "b.csv"])["hop_id"].tolist() == ["h0", "h1", "h2"]
+    with pytest.raises(ValueError):
+        get_hops_terrestrial_dataframe(str(tmp_path) + "/", ["b.csv", "c.csv"])
+
+def test_circuits_dual_homing_statistics():
+    # one circuit of four hops, two time points, one factor: satellite is faster on all hops, then on one
+    satellite_latencies = np.array([[[[1.0], [1.0]], [[1.0], [9.0]], [[1.0], [9.0]], [[1.0], [9.0]]]])
+    terrestrial_latencies = np.array([[2.0, 2.0, 2.0, 2.0]])
+    statistics = get_circuits_dual_homing_statistics(satellite_latencies, terrestrial_latencies)
+    assert statistics.shape == (1, 1, 13)
+    # optimal dual-homing latencies are 4 and 7 against a terrestrial latency of 8
+    assert statistics[0, 0, :4].tolist() == [4, 5.5, 7, 2.5]
+    # fixed dual-homing takes the satellite on the first hop only, 5 on average per hop for the others
+    assert statistics[0, 0, 4:8].tolist() == [7, 7, 7, 1]
+    # one time point with one satellite hop, one with four, counted in the last bucket
+    assert statistics[0, 0, 8:].tolist() == [0, 1, 0, 1, 1]
+
+def test_compare_two_dataset(tmp_path, capsys):
+    filenames = [str(tmp_path / "circuits_0.json"), str(tmp_path / "circuits_1.json")]
+    for filename, circuits in zip(filenames, [CIRCUITS[:2], CIRCUITS[1:]]):
+        with open(filename, 'w') as tc_file:
+            tc_file.write(json.dumps(circuits))
+    comparison = compare_two_dataset(*filenames)
+    assert comparison["relay_number"] == [7, 7]
+    assert comparison["duplicate_relay_number"] == 7
+    assert comparison["relay_jaccard_similarity"] == 1
+    # hops are the same in both directions, e.g., FP0 -> FP1 and FP1 -> FP0
+    assert comparison["hop_number"] == [6, 9]
+    assert comparison["duplicate_hop_number"] == 5
+    assert comparison["hop_jaccard_similarity"] == 0.5
+    assert {relay: delta for relay, delta in comparison["relay_frequency_deltas"].items() if delta != 0} == {"unknown": 1, "FP1": 1, "FP2": 1, "FP4": 1}
+    assert list(comparison["relay_frequency_deltas"].values())[:4] == [1, 1, 1, 1]
+    # the summary is printed only as verbose as asked
+    assert capsys.readouterr().out == ""
+
+def test_relay_accessible_satellites_num(tmp_path, constellation):
+    # relay locations come from the GeoIP dataset, without any request
+    filename_geoip_dataset = str(tmp_path / "geoip.json")
+    with open(filename_geoip_dataset, 'w') as geo_dataset_file:
+        geo_dataset_file.write(json.dumps({relay[2]: [relay[4], relay[5], relay[1], "unknown"] for relay in RELAYS}))
+    tor_relays = {relay[0]: {"nickname": relay[1], "ip": relay[2], "or_port": relay[3]} for relay in RELAYS}
+    time_start = ephem.Date("2024/8/12 21:00:00")
+    relay_accessible_satellites_num = get_relay_accessible_satellites_num(tor_relays, constellation, filename_geoip_dataset, time_start, time_start + 3 * ephem.minute, 60)
+    time_points = get_simulation_time_points(time_start, time_start + 3 * ephem.minute, 60)
+    assert list(relay_accessible_satellites_num) == [relay[0] for relay in RELAYS]
+    # against the distances to every satellite, positions not cached before are released
+    ground_ecef = geodetic_to_ecef(np.array([relay[4] for relay in RELAYS]), np.array([relay[5] for relay in RELAYS]))
+    for time_point in time_points:
+        assert time_point not in constellation["positions"]
+        sat_positions = get_constellation_positions_at_time_t(constellation, time_point)
+        distances = np.linalg.norm(ground_ecef[:, np.newaxis, :] - sat_positions["ecef"][np.newaxis, sat_positions["valid"], :], axis = 2)
+        expected_nums = np.sum(distances <= MAX_GSL_DISTANCE, axis = 1)
+        assert [relay_accessible_satellites_num[relay[0]][time_point] for relay in RELAYS] == expected_nums.tolist()
+        assert expected_nums.min() > 0
+        release_time_point_caches(constellation, time_point, if_release_positions = True)
+    dataget.GEOIP_STORES.pop(os.path.abspath(filename_geoip_dataset), None)
@@ -0,0 +1,75 @@
+import ephem
+import numpy as np
+import pytest
+from small_fixtures import *
+
+def read_tles_lines():
+    with open(FILENAME_TLES, 'r') as tles_file:
+        return tles_file.readlines()
+
+def test_catalogue_from_tle_lines_matches_cached_catalogue():
+    catalogue = read_satellite_catalogue(FILENAME_TLES)
+    parsed_catalogue = parse_satellite_tles(read_tles_lines())
+    for field in SATELLITE_CATALOGUE_DTYPE.names:
+        assert np.array_equal(parsed_catalogue[field], catalogue[field])
+    assert build_constellation(read_tles_lines()[:30])["names"] == ["s_" + name for name in catalogue["name"][:10].tolist()]
+
+def test_ground_satellite_distance_takes_degrees(constellation):
+    # STARLINK-1699 is the satellite closest to Berlin at the first time point
+    tles_lines = read_tles_lines()
+    sat_index = constellation["names"].index("s_STARLINK-1699")
+    satellite = ephem.readtle(*tles_lines[3 * sat_index: 3 * sat_index + 3])
+    distance = distance_between_ground_satellite(CLIENT[4], CLIENT[5], TIME_POINTS[0], satellite)
+    assert distance == pytest.approx(400305, abs = 1000)
+    # same as the slant range from the SGP4 positions, up to the ephem / SGP4 propagation difference
+    sat_positions = get_constellation_positions_at_time_t(constellation, TIME_POINTS[0])
+    assert distance == pytest.approx(distance_between_ground_points_satellites(CLIENT[4], CLIENT[5], sat_positions)[0, sat_index], abs = 1000)
+
+def get_small_shell_positions(plane_num: int, plane_sat_num: int, inc: float, raan_step: float, alt: float = 550000):
+    # positions of circular orbits, `plane_num` planes of `plane_sat_num` nearly evenly spaced satellites
+    # (slightly shifted, so that no two neighbours of a satellite are at the same distance)
+    radius = EARTH_RADIUS + alt
+    raans = np.radians(np.repeat(np.arange(plane_num) * raan_step, plane_sat_num))
+    arguments_of_latitude = np.tile(2 * np.pi * np.arange(plane_sat_num) / plane_sat_num, plane_num) + 0.1 * np.repeat(np.arange(plane_num), plane_sat_num)
+    arguments_of_latitude += 1e-3 * np.sin(np.arange(plane_num * plane_sat_num) ** 2)
+    inc = np.radians(inc)
+    ecef = radius * np.stack([np.cos(raans) * np.cos(arguments_of_latitude) - np.sin(raans) * np.sin(arguments_of_latitude) * np.cos(inc),
+                              np.sin(raans) * np.cos(arguments_of_latitude) + np.cos(raans) * np.sin(arguments_of_latitude) * np.cos(inc),
+                              np.sin(arguments_of_latitude) * np.sin(inc)], axis = 1)
+    return {
+        "names": ["s_" + str(sat_index) for sat_index in range(len(ecef))],
+        "ecef": ecef,
+        "valid": np.ones(len(ecef), dtype = bool),
+        "planes": np.repeat(np.arange(plane_num), plane_sat_num)
+    }
+
+def get_brute_force_nearest_ISL_topology(sat_positions: dict, isl_interface_number: int, max_isl_distance: float):
+    # the nearest-neighbour rule of `get_ISL_topology`, satellite by satellite, sorting the distances to all other satellites
+    # (the original `get_ISL_edges` took the satellites in range in catalogue order, not in distance order)
+    # output: { (source satellite index, destination satellite index): distance }
+    isl_topology = dict()
+    ecef, planes = sat_positions["ecef"], sat_positions["planes"]
+    for src_sat_index in range(len(ecef)):
+        distances = np.linalg.norm(ecef - ecef[src_sat_index], axis = 1)
+        in_range = [sat_index for sat_index in np.argsort(distances, kind = "stable") if sat_index != src_sat_index and distances[sat_index] <= max_isl_distance]
+        same_orbit = [sat_index for sat_index in in_range if planes[sat_index] == planes[src_sat_index]]
+        different_orbit = [sat_index for sat_index in in_range if planes[sat_index] != planes[src_sat_index]]
+        if isl_interface_number is None:
+            dst_sat_indices = same_orbit + different_orbit
+        else:
+            same_wanted, different_wanted = (isl_interface_number + 1) // 2, isl_interface_number // 2
+            dst_sat_indices = (same_orbit[:same_wanted + max(0, different_wanted - len(different_orbit))] +
+                               different_orbit[:different_wanted + max(0, same_wanted - len(same_orbit))])
+        for dst_sat_index in dst_sat_indices:
+            isl_topology[(src_sat_index, int(dst_sat_index))] = distances[dst_sat_index]
+    return isl_topology
+
+@pytest.mark.parametrize("isl_interface_number", [1, 4, None])
+@pytest.mark.parametrize("plane_num, plane_sat_num, raan_step", [(6, 100, 30), (4, 200, 45)])
+def test_ISL_topology_matches_brute_force_on_small_shell(isl_interface_number, plane_num, plane_sat_num, raan_step):
+    # with 200 satellites per plane, the 16 nearest satellites are all in the same plane for most satellites
+    sat_positions = get_small_shell_positions(plane_num, plane_sat_num, 53, raan_step)
+    src_sat_indices, dst_sat_indices, distances = get_ISL_topology(sat_positions, isl_interface_number, MAX_ISL_DISTANCE)
+    expected = get_brute_force_nearest_ISL_topology(sat_positions, isl_interface_number, MAX_ISL_DISTANCE)
+    assert sorted(zip(src_sat_indices.tolist(), dst_sat_indices.tolist())) == sorted(expected.keys())
+    assert np.allclose(distances, [expected[edge] for edge in zip(src_sat_indices.tolist(), dst_sat_indices.tolist())])
@@ -0,0 +1,146 @@
+import json
+import time
+import threading
+import http.server
+import pytest
+from small_fixtures import *
+import dataget
+from dataget import *
+
+def get_record(index: int):
+    return {"ip": "10.0.0." + str(index), "lat": float(index), "lon": -float(index), "address": "city " + str(index), "country_code": "de"}
+
+@pytest.fixture
+def geoip_filename(tmp_path):
+    # stores are cached per process by file path, forget the ones of the test when it ends
+    filename = str(tmp_path / "geoip.json")
+    yield filename
+    dataget.GEOIP_STORES.pop(os.path.abspath(filename), None)
+
+def reload_geoip_store(filename: str):
+    # as a new process would load it
+    dataget.GEOIP_STORES.pop(os.path.abspath(filename), None)
+    return get_geoip_store(filename)
+
+def test_geoip_store_replays_the_journal(geoip_filename):
+    geoip_store = get_geoip_store(geoip_filename)
+    for index in range(3):
+        geoip_store_add(geoip_store, get_record(index))
+    assert not os.path.exists(geoip_filename)
+    # a record cut by a crash is skipped
+    with open(geoip_filename + ".journal", 'a') as journal_file:
+        journal_file.write('{"ip": "10.0.0.9", "la')
+    geoip_store = reload_geoip_store(geoip_filename)
+    assert geoip_store["journal_size"] == 3
+    assert geoip_store_lookup(geoip_store, "10.0.0.2") == [2.0, -2.0, "city 2", "de"]
+    assert geoip_store_lookup(geoip_store, "10.0.0.9") is None
+
+def test_geoip_store_compaction(geoip_filename, monkeypatch):
+    monkeypatch.setattr(dataget, "GEOIP_JOURNAL_COMPACT_SIZE", 4)
+    geoip_store = get_geoip_store(geoip_filename)
+    for index in range(5):
+        geoip_store_add(geoip_store, get_record(index))
+    # the first four records are compacted into the dataset, the fifth is journaled
+    with open(geoip_filename, 'r') as geo_dataset_file:
+        assert sorted(json.load(geo_dataset_file)) == ["10.0.0." + str(index) for index in range(4)]
+    with open(geoip_filename + ".journal", 'r') as journal_file:
+        assert [json.loads(line)["ip"] for line in journal_file] == ["10.0.0.4"]
+    compact_geoip_store(geoip_store)
+    assert not os.path.exists(geoip_filename + ".journal")
+    geoip_store = reload_geoip_store(geoip_filename)
+    assert geoip_store["journal_size"] == 0
+    assert len(geoip_store["records"]) == 5
+
+class GeoIPRequestHandler(http.server.BaseHTTPRequestHandler):
+    # a local stand-in of ip-api and Nominatim, ips of 10.0.1.x are unknown to it
+    def do_POST(self):
+        queries = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.requests.append(("POST", time.monotonic(), len(queries)))
+        self.send_json([{"status": "success", "query": query["query"], "lat": float(query["query"].split(".")[-1]), "lon": 1.0, "countryCode": "DE"}
+                        if not query["query"].startswith("10.0.1.") else {"status": "fail", "query": query["query"]} for query in queries])
+
+    def do_GET(self):
+        self.server.requests.append(("GET", time.monotonic(), 1))
+        self.send_json({"display_name": "Somewhere, Germany", "address": {"country_code": "de"}})
+
+    def send_json(self, data):
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def geoip_server(monkeypatch):
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), GeoIPRequestHandler)
+    server.requests = list()
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    url = "http://127.0.0.1:" + str(server.server_address[1])
+    monkeypatch.setitem(dataget.GEOIP_PROVIDERS, "ip-api", {"url": url + "/batch", "batch_size": 100, "rate": 10, "burst": 1})
+    monkeypatch.setitem(dataget.GEOIP_PROVIDERS, "nominatim", {"url": url + "/reverse", "rate": 1000, "burst": 1000, "user_agent": "test"})
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def test_geoip_resolver_batches_and_rate_limits(geoip_server, geoip_filename):
+    ips = ["10.0." + str(index // 250) + "." + str(index % 250) for index in range(260)]
+    geo_locations = resolve_ips_geo_locations(ips, geoip_filename)
+    # the ten ips unknown to the server are left out
+    assert len(geo_locations) == 250
+    assert geo_locations["10.0.0.7"] == [7.0, 1.0, "Somewhere, Germany", "DE"]
+    posts = [request for request in geoip_server.requests if request[0] == "POST"]
+    assert sorted(request[2] for request in posts) == [60, 100, 100]
+    # one token per 0.1 second, with a burst of one
+    post_times = sorted(request[1] for request in posts)
+    assert all(later - earlier >= 0.09 for earlier, later in zip(post_times, post_times[1:]))
+    assert len(geoip_server.requests) - len(posts) == 250
+    # known ips are not requested again
+    resolve_ips_geo_locations(ips[:10], geoip_filename)
+    assert len(geoip_server.requests) == 253
+
+def test_relay_geo_location_goes_through_the_resolver(geoip_server, geoip_filename):
+    relay = ["FP", "nickname", "10.0.0.3", 9001]
+    assert retrieve_relay_geo_location(relay, relay[2], geoip_filename) == relay + [3.0, 1.0, "Somewhere, Germany", "DE"]
+    assert retrieve_relay_geo_location(relay, "10.0.1.3", geoip_filename) == relay + [-1, -1, "unknown", "unknown"]
+    assert try_request_api_for_coords("10.0.0.5") == (5.0, 1.0)
+    assert [request[0] for request in geoip_server.requests] == ["POST", "GET", "POST", "POST"]
+
+def test_geoip_range_csv_database_lookup(tmp_path, geoip_filename, monkeypatch):
+    filename_database = str(tmp_path / "dbip.csv")
+    with open(filename_database, 'w') as database_file:
+        database_file.write("ip_start,ip_end,continent,country,stateprov,city,latitude,longitude\n")
+        database_file.write("10.0.0.0,10.0.0.255,EU,de,Berlin,Berlin,52.52,13.405\n")
+        database_file.write("1.0.0.0,1.0.0.9,OC,au,-,,-27.47,153.02\n")
+        database_file.write("2001:db8::,2001:db8::ffff,EU,fr,,Paris,48.85,2.35\n")
+    geoip_database = load_geoip_range_csv_database(filename_database)
+    # ranges are sorted, the bounds included
+    assert geoip_offline_database_lookup(geoip_database, "1.0.0.0") == [-27.47, 153.02, "au", "AU"]
+    assert geoip_offline_database_lookup(geoip_database, "10.0.0.255") == [52.52, 13.405, "Berlin, Berlin, de", "DE"]
+    assert geoip_offline_database_lookup(geoip_database, "2001:db8::1") == [48.85, 2.35, "Paris, fr", "FR"]
+    for ip in ["1.0.0.10", "9.255.255.255", "10.0.1.0", "0.0.0.1", "not an ip"]:
+        assert geoip_offline_database_lookup(geoip_database, ip) is None
+    # the GeoIP dataset comes first, then the offline databases
+    monkeypatch.setattr(dataget, "GEOIP_OFFLINE_DATABASES", [geoip_database])
+    geoip_store = get_geoip_store(geoip_filename)
+    geoip_store_add(geoip_store, {"ip": "10.0.0.1", "lat": 0.0, "lon": 0.0, "address": "here", "country_code": "DE"})
+    assert lookup_geo_location(geoip_store, "10.0.0.1") == [0.0, 0.0, "here", "DE"]
+    assert lookup_geo_location(geoip_store, "10.0.0.2")[:2] == [52.52, 13.405]
+
+def test_ting_pairs(tmp_path):
+    filenames = [str(tmp_path / "circuits_0.json"), str(tmp_path / "circuits_1.json")]
+    for filename, circuits in zip(filenames, [CIRCUITS, CIRCUITS[:1]]):
+        with open(filename, 'w') as tc_file:
+            tc_file.write(json.dumps(circuits))
+    all_pairs = get_ting_pairs(filenames)
+    # hops of both directions are one pair, named after the first seen
+    assert len(all_pairs) == 10
+    assert all_pairs[:3] == [("FP0 FP1", 3), ("FP1 FP3", 3), ("unknown FP0", 2)]
+    assert sum(count for _, count in all_pairs) == 3 * (len(CIRCUITS) + 1)
+    filename_relay_pairs = str(tmp_path / "relay_pairs")
+    assert get_ting_pairs(filenames, 3, filename_relay_pairs) == all_pairs[:3]
+    with open(filename_relay_pairs, 'r') as rp_f:
+        assert rp_f.read() == "FP0 FP1\nFP1 FP3\nunknown FP0\n"
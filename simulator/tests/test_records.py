@@ -0,0 +1,109 @@
+import os
+import json
+import numpy as np
+from small_fixtures import *
+from records import *
+
+def write_text_simulation_record(sim_record_filename: str, simulation_results: list):
+    # as run_simulation.py: metadata lines, then one JSON time point per line
+    with open(sim_record_filename, 'w') as sim_record_file:
+        sim_record_file.write("Simulation starts at " + TIME_POINTS[0] + "\n")
+        sim_record_file.write("Simulation routing strategy is single-bent-pipe\n")
+        for simulation_results_time_t in simulation_results:
+            sim_record_file.write(json.dumps(simulation_results_time_t) + '\n')
+
+def write_columnar_simulation_record(sim_record_path: str, simulation_results: list):
+    record_writer = create_columnar_simulation_record(sim_record_path, {"routing_strategy": "single-bent-pipe"})
+    for simulation_results_time_t in simulation_results:
+        append_columnar_simulation_record(record_writer, simulation_results_time_t)
+
+def assert_same_time_point(time_point, expected_time_point):
+    # columnar records keep float32 latencies and distances
+    assert time_point["time"] == expected_time_point["time"]
+    assert list(time_point["results"].keys()) == list(expected_time_point["results"].keys())
+    for hop_id, expected_paths in expected_time_point["results"].items():
+        paths = time_point["results"][hop_id]
+        assert len(paths) == len(expected_paths)
+        for path, expected_path in zip(paths, expected_paths):
+            assert path["path"] == expected_path["path"]
+            for key in ["lats", "lons", "distances", "latencies"]:
+                assert np.allclose(np.array(path[key], dtype = np.float64), np.array(expected_path[key], dtype = np.float64), rtol = 1e-6, equal_nan = True)
+            for key in ["path_distance", "path_latency"]:
+                assert np.isclose(path[key], expected_path[key], rtol = 1e-6)
+
+def test_text_record_round_trip(tmp_path, simulation_results):
+    sim_record_filename = str(tmp_path / "sim.txt")
+    write_text_simulation_record(sim_record_filename, simulation_results)
+    assert list(iterate_simulation_record_time_points([sim_record_filename])) == json.loads(json.dumps(simulation_results))
+    assert get_simulation_record_time_num(sim_record_filename) == len(simulation_results)
+    assert read_text_simulation_record_time_point(sim_record_filename, 1) == json.loads(json.dumps(simulation_results[1]))
+
+def test_text_record_index_of_a_rewritten_record(tmp_path):
+    sim_record_filename = str(tmp_path / "sim.txt")
+    time_points = [{"time": "t" + str(t_index), "results": {}, "padding": "x" * 10} for t_index in range(3)]
+    write_text_simulation_record(sim_record_filename, time_points)
+    assert read_text_simulation_record_time_point(sim_record_filename, 1)["time"] == "t1"
+    assert os.path.exists(sim_record_filename + SIMULATION_RECORD_INDEX_SUFFIX)
+    # the same name written again, longer, with the saved index left behind
+    rewritten_time_points = [{"time": "u" + str(t_index), "results": {}, "padding": "x" * (30 - t_index)} for t_index in range(4)]
+    write_text_simulation_record(sim_record_filename, rewritten_time_points)
+    assert get_simulation_record_time_num(sim_record_filename) == 4
+    for t_index, time_point in enumerate(rewritten_time_points):
+        assert read_text_simulation_record_time_point(sim_record_filename, t_index) == time_point
+    # a new record drops the index of the former one
+    create_text_simulation_record(sim_record_filename, ["Simulation starts at " + TIME_POINTS[0] + "\n"])
+    assert not os.path.exists(sim_record_filename + SIMULATION_RECORD_INDEX_SUFFIX)
+    assert get_simulation_record_time_num(sim_record_filename) == 0
+
+def test_columnar_record_matches_text_record(tmp_path, simulation_results):
+    assert any([len(paths) > 0 for paths in simulation_results[0]["results"].values()])
+    sim_record_filename = str(tmp_path / "sim.txt")
+    sim_record_path = str(tmp_path / "sim")
+    write_text_simulation_record(sim_record_filename, simulation_results)
+    write_columnar_simulation_record(sim_record_path, simulation_results)
+    text_time_points = list(iterate_simulation_record_time_points([sim_record_filename]))
+    columnar_time_points = list(iterate_simulation_record_time_points([sim_record_path]))
+    assert len(columnar_time_points) == len(text_time_points)
+    for columnar_time_point, text_time_point in zip(columnar_time_points, text_time_points):
+        assert_same_time_point(columnar_time_point, text_time_point)
+
+
+def test_text_record_truncation_for_resume(tmp_path, simulation_results):
+    sim_record_filename = str(tmp_path / "sim.txt")
+    write_text_simulation_record(sim_record_filename, simulation_results)
+    # an interrupted run: a time point written but not marked completed, then a partial line
+    with open(sim_record_filename, 'a') as sim_record_file:
+        sim_record_file.write(json.dumps(simulation_results[0]) + '\n' + json.dumps(simulation_results[1])[:50])
+    assert get_simulation_record_time_num(sim_record_filename) == len(simulation_results) + 1
+    truncate_simulation_record(sim_record_filename, len(simulation_results) - 1)
+    assert get_simulation_record_time_num(sim_record_filename) == len(simulation_results) - 1
+    # the resumed run appends the remaining time points
+    with open(sim_record_filename, 'a') as sim_record_file:
+        sim_record_file.write(json.dumps(simulation_results[-1]) + '\n')
+    assert list(iterate_simulation_record_time_points([sim_record_filename])) == json.loads(json.dumps(simulation_results))
+    assert read_text_simulation_record_time_point(sim_record_filename, len(simulation_results) - 1) == json.loads(json.dumps(simulation_results[-1]))
+
+def test_columnar_record_truncation_for_resume(tmp_path, simulation_results):
+    sim_record_path = str(tmp_path / "sim")
+    write_columnar_simulation_record(sim_record_path, simulation_results + simulation_results[:1])
+    # columns of a time point whose time was not written yet
+    with open(os.path.join(sim_record_path, "path_latency.bin"), 'ab') as column_file:
+        np.zeros(3, dtype = np.float32).tofile(column_file)
+    truncate_simulation_record(sim_record_path, len(simulation_results) - 1)
+    assert get_simulation_record_time_num(sim_record_path) == len(simulation_results) - 1
+    record_writer = create_columnar_simulation_record(sim_record_path, dict())
+    append_columnar_simulation_record(record_writer, simulation_results[-1])
+    resumed_time_points = list(iterate_simulation_record_time_points([sim_record_path]))
+    assert len(resumed_time_points) == len(simulation_results)
+    for resumed_time_point, expected_time_point in zip(resumed_time_points, json.loads(json.dumps(simulation_results))):
+        assert_same_time_point(resumed_time_point, expected_time_point)
+
+def test_completed_time_num_stops_at_first_gap(tmp_path):
+    manifest_filename = get_simulation_manifest_filename(str(tmp_path), get_simulation_run_key({"graph_backend": "csgraph"}))
+    manifest = {"completed": dict()}
+    for group_index, t_index in [(0, 0), (0, 1), (0, 3), (1, 1)]:
+        mark_simulation_unit_completed(manifest_filename, manifest, group_index, t_index)
+    manifest = read_simulation_manifest(manifest_filename)
+    assert get_simulation_completed_time_num(manifest, 0) == 2
+    assert get_simulation_completed_time_num(manifest, 1) == 0
+    assert get_simulation_completed_time_num(manifest, 2) == 0
@@ -0,0 +1,190 @@
+import json
+import pytest
+import numpy as np
+from small_fixtures import *
+import constellation as constellation_module
+import run_simulation
+from run_simulation import get_simulation_tasks, read_sweep_grid
+
+# Constant speeds: every combination samples the same latencies, so that they must find the same best paths
+SAT_ECDF = get_speed_ECDF([LIGHT_SPEED])
+TER_ECDF = get_speed_ECDF([TERRESTRIAL_TRANS_SPEED])
+
+def simulate_best_path_latencies(constellation, ground_stations, point_of_presences, hops, routing_strategy: str, **simulation_kwargs):
+    # output: per time point, { hop_id: best path latency, None if unreachable }
+    best_path_latencies = list()
+    for t_index, time_point in enumerate(TIME_POINTS):
+        set_sampling_seed([0, 0, t_index])
+        simulation_results_time_t = path_simulate_one_time_many_hops(hops, constellation, ground_stations, point_of_presences, time_point,
+                                                                     get_link_connectivity(routing_strategy), "all-visible", SAT_ECDF, TER_ECDF,
+                                                                     **simulation_kwargs)
+        best_path_latencies.append({hop_id: paths[0]["path_latency"] if len(paths) > 0 else None for hop_id, paths in simulation_results_time_t["results"].items()})
+    return best_path_latencies
+
+def assert_same_best_path_latencies(best_path_latencies: list, expected: list, settings: dict):
+    for time_point_latencies, expected_time_point_latencies in zip(best_path_latencies, expected):
+        assert time_point_latencies.keys() == expected_time_point_latencies.keys()
+        for hop_id, expected_latency in expected_time_point_latencies.items():
+            if expected_latency is None:
+                assert time_point_latencies[hop_id] is None, (settings, hop_id)
+            else:
+                # csgraph keeps float32 latencies
+                assert time_point_latencies[hop_id] == pytest.approx(expected_latency, rel = 1e-6), (settings, hop_id)
+
+@pytest.mark.parametrize("routing_strategy", ["single-bent-pipe", "ISL-enabled"])
+def test_single_source_dijkstra_finds_the_k_shortest_best_paths(constellation, ground_stations, point_of_presences, hops, routing_strategy):
+    # one Dijkstra per source relay, opted in with max_path_limit = 1
+    expected = simulate_best_path_latencies(constellation, ground_stations, point_of_presences, hops, routing_strategy, max_path_limit = 3)
+    assert any([latency is not None for latency in expected[0].values()])
+    settings = {"max_path_limit": 1}
+    assert_same_best_path_latencies(simulate_best_path_latencies(constellation, ground_stations, point_of_presences, hops, routing_strategy, **settings), expected, settings)
+
+@pytest.mark.parametrize("routing_strategy", ["single-bent-pipe", "ISL-enabled"])
+def test_backends_find_the_same_best_paths(constellation, ground_stations, point_of_presences, hops, routing_strategy):
+    expected = simulate_best_path_latencies(constellation, ground_stations, point_of_presences, hops, routing_strategy, graph_backend = "networkx", max_path_limit = 1)
+    for max_path_limit in [1, 3]:
+        settings = {"graph_backend": "csgraph", "max_path_limit": max_path_limit}
+        assert_same_best_path_latencies(simulate_best_path_latencies(constellation, ground_stations, point_of_presences, hops, routing_strategy, **settings), expected, settings)
+
+@pytest.mark.parametrize("graph_backend", ["networkx", "csgraph"])
+def test_temporal_topology_finds_the_same_best_paths(constellation, ground_stations, point_of_presences, hops, graph_backend):
+    # the topology is carried over the consecutive fixture time points
+    expected = simulate_best_path_latencies(constellation, ground_stations, point_of_presences, hops, "ISL-enabled", graph_backend = graph_backend, max_path_limit = 1)
+    temporal_topology = create_temporal_topology()
+    settings = {"graph_backend": graph_backend, "max_path_limit": 1, "temporal_topology": temporal_topology}
+    assert_same_best_path_latencies(simulate_best_path_latencies(constellation, ground_stations, point_of_presences, hops, "ISL-enabled", **settings), expected, settings)
+    assert temporal_topology["time"] == TIME_POINTS[-1]
+
+@pytest.mark.parametrize("time_step", [1, 15])
+def test_temporal_graph_updates_match_fresh_graphs(constellation, ground_stations, point_of_presences, time_step):
+    # the graph carried over time points, and then over the same time point (no edge appears or disappears), against the graph built anew
+    time_points = ["2024/8/12 20:00:" + str(second).zfill(2) for second in range(0, 3 * time_step, time_step)]
+    time_points.append(time_points[-1])
+    link_connectivity = get_link_connectivity("ISL-enabled")
+    ecdf = get_speed_ECDF([LIGHT_SPEED / 2, LIGHT_SPEED])
+    temporal_topologies = {"networkx": create_temporal_topology(), "csgraph": create_temporal_topology()}
+    for t_index, time_point in enumerate(time_points):
+        sat_positions = get_constellation_positions_at_time_t(constellation, time_point)
+        sat_nodes, gs_nodes, pop_nodes = get_graph_sat_gs_nodes_at_time_t(sat_positions, ground_stations, point_of_presences)
+        node_names = get_graph_node_names(sat_positions, ground_stations, point_of_presences)
+        set_sampling_seed([0, 0, t_index])
+        edge_columns = get_graph_edge_columns_no_relay(sat_positions, ground_stations, point_of_presences, link_connectivity, "all-visible", ecdf, ecdf)
+        set_sampling_seed([0, 0, t_index])
+        edges_no_relays = get_graph_edges_no_relay(sat_positions, ground_stations, point_of_presences, link_connectivity, "all-visible", ecdf, ecdf)
+
+        previous_sparse_graph = temporal_topologies["csgraph"]["graph"]
+        sparse_graph = update_temporal_sat_graph(temporal_topologies["csgraph"], time_point, sat_nodes, gs_nodes, pop_nodes, edge_columns, node_names, "csgraph")
+        expected_sparse_graph = build_sparse_sat_graph(sat_nodes, gs_nodes, pop_nodes, edges_no_relays)
+        assert sparse_graph["node_names"] == expected_sparse_graph["node_names"]
+        assert sparse_graph["lats"] == expected_sparse_graph["lats"]
+        for matrix_name in ["latency_matrix", "distance_matrix"]:
+            assert sparse_graph[matrix_name].has_sorted_indices
+            assert np.array_equal(sparse_graph[matrix_name].indptr, expected_sparse_graph[matrix_name].indptr)
+            assert np.array_equal(sparse_graph[matrix_name].indices, expected_sparse_graph[matrix_name].indices)
+            assert np.array_equal(sparse_graph[matrix_name].data, expected_sparse_graph[matrix_name].data)
+        if t_index == len(time_points) - 1:
+            # patched in place
+            assert sparse_graph["latency_matrix"] is previous_sparse_graph["latency_matrix"]
+
+        sat_graph = update_temporal_sat_graph(temporal_topologies["networkx"], time_point, sat_nodes, gs_nodes, pop_nodes, edge_columns, node_names, "networkx")
+        expected_sat_graph = generate_sat_graph(dict(), sat_nodes, gs_nodes, pop_nodes, edges_no_relays, [])
+        assert dict(sat_graph.nodes(data = True)) == dict(expected_sat_graph.nodes(data = True))
+        assert {(src, dst): data for src, dst, data in sat_graph.edges(data = True)} == {(src, dst): data for src, dst, data in expected_sat_graph.edges(data = True)}
+
+def test_simulation_tasks_are_consecutive_time_points_of_a_run():
+    # two runs of two circuit groups, the second run has completed 4 time points of its first group
+    runs = [{"circuit_groups": [{"completed_time_num": 0}, {"completed_time_num": 0}]}, {"circuit_groups": [{"completed_time_num": 4}, {"completed_time_num": 0}]}]
+    time_points = ["t" + str(t_index) for t_index in range(5)]
+    simulation_tasks = get_simulation_tasks(runs, time_points, 3)
+    assert [(run_index, group_index, [t_index for t_index, _ in time_point_tasks]) for run_index, group_index, time_point_tasks in simulation_tasks] == [
+        (0, 0, [0, 1, 2]), (0, 1, [0, 1, 2]), (1, 1, [0, 1, 2]), (0, 0, [3, 4]), (1, 0, [4]), (0, 1, [3, 4]), (1, 1, [3, 4])]
+    assert simulation_tasks[0][2] == [(0, "t0"), (1, "t1"), (2, "t2")]
+    # without the temporal topology, one time point per task
+    assert len(get_simulation_tasks(runs, time_points, 1)) == 16
+
+def test_worker_propagates_each_time_point_once(constellation, ground_stations, point_of_presences, hops, monkeypatch):
+    # one worker running every task of two runs and two circuit groups with the temporal topology, by blocks of two time points
+    time_points = ["2024/8/12 20:0" + str(minute) + ":00" for minute in range(4)]
+    worker_constellation = dict(constellation, positions = dict())
+    schedule_constellation_positions(worker_constellation, time_points)
+    propagated_time_points = list()
+    propagate_constellation = constellation_module.propagate_constellation
+    def counting_propagate_constellation(constellation: dict, date_strings: list):
+        propagated_time_points.extend(date_strings)
+        return propagate_constellation(constellation, date_strings)
+    monkeypatch.setattr(constellation_module, "propagate_constellation", counting_propagate_constellation)
+    worker_run = {"seed": 0, "hops": [hops, hops], "link_connectivity": get_link_connectivity("ISL-enabled"), "gs_satellite_link_mode": "all-visible",
+                  "sat_ecdf": SAT_ECDF, "ter_ecdf": TER_ECDF, "max_path_limit": 1, "terrestrial_edge_cache": build_terrestrial_edge_cache(ground_stations, point_of_presences)}
+    monkeypatch.setattr(run_simulation, "SIMULATION_TEMPORAL_TOPOLOGIES", dict())
+    run_simulation.init_simulation_worker({
+        "constellation": worker_constellation,
+        "ground_stations": ground_stations,
+        "point_of_presences": point_of_presences,
+        "temporal_topology": True,
+        "time_block_size": 2,
+        "runs": [dict(worker_run, graph_backend = "networkx"), dict(worker_run, graph_backend = "csgraph")]
+    })
+    runs = [{"circuit_groups": [{"completed_time_num": 0}, {"completed_time_num": 0}]}] * 2
+    simulation_tasks = get_simulation_tasks(runs, time_points, 2)
+    assert len(simulation_tasks) == 8
+    for task in simulation_tasks:
+        run_simulation.simulate_time_points(task)
+    assert sorted(propagated_time_points) == time_points
+    # the positions of the blocks done are released
+    assert sorted(worker_constellation["positions"].keys()) == time_points[2:]
+
+def test_sweep_grid_graph_backend(tmp_path):
+    filename_sweep_grid = str(tmp_path / "grid.json")
+    with open(filename_sweep_grid, 'w') as sweep_grid_file:
+        sweep_grid_file.write(json.dumps({"graph_backend": ["networkx", "csgraph"], "max_path_limit": [1, 3]}))
+    configs = read_sweep_grid(filename_sweep_grid, {"graph_backend": "networkx", "seed": 0})
+    assert [(config["graph_backend"], config["max_path_limit"], config["seed"]) for config in configs] == [("networkx", 1, 0), ("networkx", 3, 0), ("csgraph", 1, 0), ("csgraph", 3, 0)]
+    with open(filename_sweep_grid, 'w') as sweep_grid_file:
+        sweep_grid_file.write(json.dumps({"graph_backend": ["igraph"]}))
+    with pytest.raises(ValueError):
+        read_sweep_grid(filename_sweep_grid, dict())
+
+def test_k_shortest_paths_are_sorted_and_loopless(simulation_results):
+    for simulation_results_time_t in simulation_results:
+        for paths in simulation_results_time_t["results"].values():
+            assert len(paths) <= 3
+            path_latencies = [path["path_latency"] for path in paths]
+            assert path_latencies == sorted(path_latencies)
+            for path in paths:
+                assert len(set(path["path"])) == len(path["path"])
+                assert path["path_latency"] == pytest.approx(sum(path["latencies"]))
+
+def test_sparse_relay_overlay_matches_full_rebuild():
+    # graph without relays: a ring of satellites and a ground station, with an edge added twice (the last one is kept)
+    sat_nodes = {"s_" + str(i): [0.0, 10.0 * i, 550000.0] for i in range(5)}
+    gs_nodes = {"g_0": [1.0, 1.0, 0.0]}
+    edges_no_relays = [{"src": "s_" + str(i), "dst": "s_" + str((i + 1) % 5), "latency": 0.01 * (i + 1), "distance": 1000.0 * (i + 1)} for i in range(5)]
+    edges_no_relays += [{"src": "s_2", "dst": "g_0", "latency": 0.5, "distance": 5.0}, {"src": "s_2", "dst": "g_0", "latency": 0.02, "distance": 2.0}]
+    sparse_graph = build_sparse_sat_graph(sat_nodes, gs_nodes, dict(), edges_no_relays)
+    relay_nodes = {"r_a": ["1.1.1.1", 1, 0.0, 0.0], "r_b": ["1.1.1.2", 1, 1.0, 1.0], "r_c": ["1.1.1.3", 1, 2.0, 2.0]}
+    # edges leaving the source relay, entering the destination relays, and a direct relay edge, one of them added twice
+    edges_with_relays = [{"src": "r_a", "dst": "s_0", "latency": 0.003, "distance": 3.0},
+                         {"src": "r_a", "dst": "s_3", "latency": 0.004, "distance": 4.0},
+                         {"src": "g_0", "dst": "r_b", "latency": 0.9, "distance": 9.0},
+                         {"src": "s_1", "dst": "r_c", "latency": 0.006, "distance": 6.0},
+                         {"src": "r_a", "dst": "r_c", "latency": 0.2, "distance": 20.0},
+                         {"src": "g_0", "dst": "r_b", "latency": 0.005, "distance": 5.0}]
+    sparse_graph_with_relays = get_sparse_sat_graph_with_relays(sparse_graph, relay_nodes, edges_with_relays)
+    node_index = sparse_graph_with_relays["node_index"]
+    all_edges = edges_no_relays + edges_with_relays
+    expected_matrices = get_sparse_sat_graph_matrices(len(node_index),
+                                                      np.array([node_index[edge["src"]] for edge in all_edges], dtype = np.int32),
+                                                      np.array([node_index[edge["dst"]] for edge in all_edges], dtype = np.int32),
+                                                      np.array([edge["latency"] for edge in all_edges], dtype = np.float32),
+                                                      np.array([edge["distance"] for edge in all_edges], dtype = np.float32))
+    for matrix, expected_matrix in zip([sparse_graph_with_relays["latency_matrix"], sparse_graph_with_relays["distance_matrix"]], expected_matrices):
+        assert matrix.has_sorted_indices
+        assert np.array_equal(matrix.indptr, expected_matrix.indptr)
+        assert np.array_equal(matrix.indices, expected_matrix.indices)
+        assert np.array_equal(matrix.data, expected_matrix.data)
+    # the graph without relays is left untouched
+    assert sparse_graph["latency_matrix"].shape == (6, 6)
+    shortest_paths = get_sparse_shortest_paths_from_one_source(sparse_graph_with_relays, "r_a", ["r_b", "r_c"])
+    assert shortest_paths["r_b"][0]["path"] == ["r_a", "s_0", "s_1", "s_2", "g_0", "r_b"]
+    assert shortest_paths["r_b"][0]["latencies"] == pytest.approx([0.003, 0.01, 0.02, 0.02, 0.005])
+    assert shortest_paths["r_c"][0]["path"] == ["r_a", "s_0", "s_1", "r_c"]
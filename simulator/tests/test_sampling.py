@@ -0,0 +1,39 @@
+import json
+import numpy as np
+from small_fixtures import *
+
+SPEED_ECDF = get_speed_ECDF([1.0, 2.0, 3.0, 4.0])
+
+def test_same_seed_same_samples():
+    set_sampling_seed([7, 0, 0])
+    samples_1 = sample_speeds(SPEED_ECDF, 1000)
+    set_sampling_seed([7, 0, 0])
+    samples_2 = sample_speeds(SPEED_ECDF, 1000)
+    assert np.array_equal(samples_1, samples_2)
+    set_sampling_seed([7, 0, 1])
+    assert not np.array_equal(samples_1, sample_speeds(SPEED_ECDF, 1000))
+
+def test_samples_are_ecdf_values_within_range():
+    set_sampling_seed(0)
+    samples = sample_speeds(SPEED_ECDF, 1000, range_limit = (2.0, 3.0))
+    assert set(np.unique(samples).tolist()) == {2.0, 3.0}
+    assert set(np.unique(sample_speeds(SPEED_ECDF, 1000)).tolist()) == {1.0, 2.0, 3.0, 4.0}
+
+def test_latencies_use_one_speed_per_distance():
+    set_sampling_seed(1)
+    distances = np.arange(1, 101) * 1000.0
+    latencies = sample_latencies_with_distances(distances, SPEED_ECDF)
+    assert set(np.unique(np.round(distances / latencies, 9)).tolist()) <= {1.0, 2.0, 3.0, 4.0}
+
+def test_seeded_simulation_is_reproducible(constellation, ground_stations, point_of_presences, hops):
+    # the same (seed, group, time point) gives the same results, whatever ran before
+    sat_ecdf = get_speed_ECDF([LIGHT_SPEED * 0.5, LIGHT_SPEED])
+    ter_ecdf = get_speed_ECDF([TERRESTRIAL_TRANS_SPEED * 0.5, TERRESTRIAL_TRANS_SPEED])
+    def simulate(seed):
+        set_sampling_seed(seed)
+        return json.dumps(path_simulate_one_time_many_hops(hops, constellation, ground_stations, point_of_presences, TIME_POINTS[0],
+                                                           get_link_connectivity("single-bent-pipe"), "all-visible", sat_ecdf, ter_ecdf, max_path_limit = 1))
+    results = simulate([3, 0, 0])
+    simulate([3, 0, 1])
+    assert simulate([3, 0, 0]) == results
+    assert simulate([3, 1, 0]) != results
@@ -1,7 +1,6 @@
 import json
 import ephem
 import math
-from geopy.distance import great_circle
 from statsmodels.distributions.empirical_distribution import ECDF
 import numpy as np
 
@@ -25,6 +24,32 @@ def read_tor_circuits(filename_tor_circuits: str):
     verbose_print("Read", len(circuits), "circuits.", level = 1)
     return circuits
 
+def iterate_tor_circuits(filename_tor_circuits: str, chunk_size: int = 1 << 20):
+    # Yield the circuits of a circuits file (a JSON list of circuits) one by one, reading it in chunks
+    decoder = json.JSONDecoder()
+    with open(filename_tor_circuits, 'r') as tc_file:
+        buffer = tc_file.read(chunk_size).lstrip()
+        if not buffer.startswith('['):
+            raise ValueError("Circuits file " + filename_tor_circuits + " is not a JSON list")
+        buffer = buffer[1:]
+        while True:
+            buffer = buffer.lstrip()
+            if buffer.startswith(','):
+                buffer = buffer[1:].lstrip()
+            if buffer.startswith(']'):
+                return
+            try:
+                # a circuit is a list, so a circuit cut at the end of the buffer never decodes
+                circuit, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                chunk = tc_file.read(chunk_size)
+                if len(chunk) == 0:
+                    raise
+                buffer += chunk
+                continue
+            yield circuit
+            buffer = buffer[end:]
+
 def read_tor_relays(filename_tor_relays: str):
     with open(filename_tor_relays, 'r') as tr_file:
         relays = json.loads(tr_file.read())
@@ -85,12 +110,60 @@ def read_starlink_region_performance(filename_starlink_rpf: str):
 
 # -------------------- DISTANCE METHODS ----------------------#
 # All in meters
+# WGS72 ellipsoid, the one SGP4 (and EARTH_RADIUS) is defined on
+EARTH_FLATTENING = 1 / 298.26
+EARTH_ECCENTRICITY_SQUARED = EARTH_FLATTENING * (2 - EARTH_FLATTENING)
+
+def geodetic_to_ecef(lats, lons, alts = 0):
+    # input: latitudes and longitudes in degrees, altitudes in meters (scalars or arrays)
+    # output: ECEF coordinates in meters, shape = (..., 3)
+    lats = np.radians(np.asarray(lats, dtype = np.float64))
+    lons = np.radians(np.asarray(lons, dtype = np.float64))
+    alts = np.asarray(alts, dtype = np.float64)
+    sin_lats = np.sin(lats)
+    prime_vertical_radius = EARTH_RADIUS / np.sqrt(1 - EARTH_ECCENTRICITY_SQUARED * sin_lats ** 2)
+    x = (prime_vertical_radius + alts) * np.cos(lats) * np.cos(lons)
+    y = (prime_vertical_radius + alts) * np.cos(lats) * np.sin(lons)
+    z = (prime_vertical_radius * (1 - EARTH_ECCENTRICITY_SQUARED) + alts) * sin_lats
+    return np.stack([x, y, z], axis = -1)
+
+def great_circle_distances(lats_1, lons_1, lats_2, lons_2, pairwise: bool = False):
+    # Great-circle distances on a sphere of radius EARTH_RADIUS, same formula as geopy's `great_circle`
+    # (the atan2 form, which unlike plain haversine stays accurate for nearly antipodal points)
+    # input: latitudes and longitudes in degrees, scalars or arrays
+    # output: elementwise (broadcast) distances, or all pairs with shape = (len(points 1), len(points 2)) if `pairwise`
+    lats_1, lons_1 = np.radians(np.asarray(lats_1, dtype = np.float64)), np.radians(np.asarray(lons_1, dtype = np.float64))
+    lats_2, lons_2 = np.radians(np.asarray(lats_2, dtype = np.float64)), np.radians(np.asarray(lons_2, dtype = np.float64))
+    if pairwise:
+        lats_1, lons_1 = lats_1.reshape(-1, 1), lons_1.reshape(-1, 1)
+        lats_2, lons_2 = lats_2.reshape(1, -1), lons_2.reshape(1, -1)
+    sin_lats_1, cos_lats_1 = np.sin(lats_1), np.cos(lats_1)
+    sin_lats_2, cos_lats_2 = np.sin(lats_2), np.cos(lats_2)
+    delta_lons = lons_2 - lons_1
+    cos_delta_lons, sin_delta_lons = np.cos(delta_lons), np.sin(delta_lons)
+    central_angles = np.arctan2(np.sqrt((cos_lats_2 * sin_delta_lons) ** 2 + (cos_lats_1 * sin_lats_2 - sin_lats_1 * cos_lats_2 * cos_delta_lons) ** 2),
+                                sin_lats_1 * sin_lats_2 + cos_lats_1 * cos_lats_2 * cos_delta_lons)
+    return EARTH_RADIUS * central_angles
+
+def slant_range_distances(g_lats, g_lons, sat_ecef, pairwise: bool = False):
+    # Straight-line distances from ground points (at zero elevation) to satellites, on the WGS72 ellipsoid
+    # input: ground latitudes and longitudes in degrees, satellite ECEF coordinates in meters, shape = (..., 3)
+    #        (`geodetic_to_ecef(sat_lats, sat_lons, sat_alts)` for geodetic satellite positions)
+    # output: elementwise (broadcast) distances, or all pairs with shape = (ground points, satellites) if `pairwise`
+    ground_ecef = geodetic_to_ecef(g_lats, g_lons)
+    sat_ecef = np.asarray(sat_ecef, dtype = np.float64)
+    if pairwise:
+        return np.linalg.norm(ground_ecef.reshape(-1, 1, 3) - sat_ecef.reshape(1, -1, 3), axis = 2)
+    return np.linalg.norm(ground_ecef - sat_ecef, axis = -1)
+
 def distance_between_ground_satellite(g_lat:float, g_lon: float, current_time_date_string: str, satellite):
     # Get the distance between a ground point to a satellite at a time point
+    # input: latitude and longitude in degrees, as everywhere else in the simulator
     observer = ephem.Observer()
     observer.date = current_time_date_string
-    observer.lat = g_lat
-    observer.lon = g_lon
+    # ephem reads float angles as radians
+    observer.lat = math.radians(float(g_lat))
+    observer.lon = math.radians(float(g_lon))
     # ignore elevation
     observer.elevation = 0
 
@@ -112,11 +185,7 @@ def distance_between_satellites(sat_1, sat_2, current_date_time_string: str):
 def distance_between_ground_stations(g1_loc: list, g2_loc: list):
     # Get the distance between two ground points
     # Input: g1_loc: [lat, lon], g2_loc: [lat, lon]
-    return great_circle(
-        (float(g1_loc[0]), float(g1_loc[1])),
-        (float(g2_loc[0]), float(g2_loc[1])),
-        radius = EARTH_RADIUS / 1000 # in km
-    ).m
+    return float(great_circle_distances(float(g1_loc[0]), float(g1_loc[1]), float(g2_loc[0]), float(g2_loc[1])))
 
 def get_if_satellite_same_orbit(sat_1,
                                 sat_2,
@@ -125,14 +194,17 @@ def get_if_satellite_same_orbit(sat_1,
     # Judge whether two satellites are in the same orbits
     # Mainly use two parameters `Inclination (°)` and `Right Ascension of ascending node (°)`
     # Tolerance are empirical
+    # satellites are ephem bodies or rows of a satellite catalogue
     for element in orbit_elements:
-        val_1 = getattr(sat_1, element)
-        val_2 = getattr(sat_2, element)
+        val_1 = sat_1[element] if isinstance(sat_1, np.void) else getattr(sat_1, element)
+        val_2 = sat_2[element] if isinstance(sat_2, np.void) else getattr(sat_2, element)
         if abs(val_1 - val_2) > tolerance[element]:
             return False
     return True
 
 def get_satellite_orbital_parameters(sat, elements: list = ["inc", "raan"]):
+    if isinstance(sat, np.void):
+        return [float(sat[element]) for element in elements]
     return [getattr(sat, element) for element in elements]
 
 def generate_circuit_id(circuit: list):
@@ -158,19 +230,39 @@ def get_speed_ECDF(speeds: list):
     ecdf = ECDF(speeds)
     return ecdf
 
-def sample_speed(ecdf, range_limit: tuple = (-np.inf, np.inf)):
-    # Sample a speed from the ECDF
-    # in m/s
-    u = np.random.uniform(0, 1)
-    sampled_value = np.interp(u, ecdf.y, ecdf.x)
-    while sampled_value < range_limit[0] or sampled_value > range_limit[1]:
-        u = np.random.uniform(0, 1)
-        sampled_value = np.interp(u, ecdf.y, ecdf.x)
-    return sampled_value
-
-
-
+# One random generator per run (or per simulation task), see `set_sampling_seed`
+SAMPLING_RNG = np.random.default_rng()
 
+def set_sampling_seed(seed):
+    # Reseed the generator used by all sampling methods, `seed` is anything np.random.default_rng accepts
+    global SAMPLING_RNG
+    SAMPLING_RNG = np.random.default_rng(seed)
 
+def sample_speeds(ecdf, size: int, range_limit: tuple = (-np.inf, np.inf)):
+    # Sample `size` speeds from the ECDF at once, by inverse-CDF lookup
+    # samples out of `range_limit` are redrawn
+    # in m/s
+    ecdf_samples_in_range = (ecdf.x[1:] >= range_limit[0]) & (ecdf.x[1:] <= range_limit[1])
+    if size > 0 and not np.any(ecdf_samples_in_range):
+        raise ValueError("No speed sample of the ECDF is within " + str(range_limit))
+    sampled_values = np.empty(size)
+    pending = np.arange(size)
+    while len(pending) > 0:
+        # u in (0, 1], the smallest x with ECDF(x) >= u; ecdf.x[0] is -inf with ecdf.y[0] = 0, never picked
+        u = 1.0 - SAMPLING_RNG.random(len(pending))
+        values = ecdf.x[np.searchsorted(ecdf.y, u, side = "left")]
+        accepted = (values >= range_limit[0]) & (values <= range_limit[1])
+        sampled_values[pending[accepted]] = values[accepted]
+        pending = pending[~accepted]
+    return sampled_values
 
+def sample_speed(ecdf, range_limit: tuple = (-np.inf, np.inf)):
+    # Sample a speed from the ECDF
+    # in m/s
+    return sample_speeds(ecdf, 1, range_limit)[0]
 
+def sample_latencies_with_distances(distances, ecdf):
+    # input: distances in meters (array), ecdf of speed
+    # output: latencies in seconds (array), one speed sample per distance
+    distances = np.asarray(distances, dtype = np.float64)
+    return distances / sample_speeds(ecdf, len(distances))